@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Добавление product_images.image_hash (контентно-адресуемое хранилище изображений)
+
+Парсеры теперь сохраняют каждое изображение один раз под именем
+{blake2b}.png и пишут хеш в product_images.image_hash.
+
+Для старых записей хеш можно досчитать по локальным файлам:
+    python database/add_image_hash_column.py --backfill
+"""
+
+import os
+import sys
+from pathlib import Path
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту и к cp_parser_core (хеш - тот же, что у парсеров)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / 'cp_parser_core'))
+
+from utils.image_store import image_digest
+
+load_dotenv()
+
+BATCH_SIZE = 1000
+
+
+def add_image_hash_column(backfill=False, images_dir='storage/images'):
+    """Добавляет колонку image_hash и индекс, опционально заполняет хеши"""
+
+    db_url = os.getenv('DATABASE_URL') or os.getenv('DATABASE_URL_PRIVATE')
+
+    if not db_url:
+        print("❌ Не найден DATABASE_URL")
+        sys.exit(1)
+
+    print(f"📊 Подключение к БД: {db_url[:50]}...")
+    engine = create_engine(db_url, pool_pre_ping=True)
+
+    with engine.begin() as conn:
+        print("\n1️⃣  Добавление колонки image_hash...")
+        conn.execute(text("""
+            ALTER TABLE product_images
+            ADD COLUMN IF NOT EXISTS image_hash VARCHAR(64)
+        """))
+        print("✅ Колонка добавлена")
+
+        print("\n2️⃣  Создание индекса...")
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_product_images_hash ON product_images(image_hash)
+        """))
+        print("✅ Индекс создан")
+
+    if not backfill:
+        print("\n💡 Для заполнения хешей старых записей: --backfill")
+        return
+
+    print("\n3️⃣  Заполнение хешей по локальным файлам...")
+    images_dir = Path(images_dir)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT id, image_filename, local_path
+            FROM product_images
+            WHERE image_hash IS NULL
+        """)).fetchall()
+
+    print(f"   Записей без хеша: {len(rows):,}")
+
+    # Один файл может быть у многих записей - читаем его один раз
+    digest_by_path = {}
+    updates = []
+    missing = 0
+
+    for image_id, filename, local_path in rows:
+        candidates = [Path(local_path)] if local_path else []
+        if filename:
+            candidates.append(images_dir / filename)
+
+        path = next((p for p in candidates if p.exists()), None)
+        if path is None:
+            missing += 1
+            continue
+
+        key = str(path)
+        if key not in digest_by_path:
+            digest_by_path[key] = image_digest(path.read_bytes())
+        updates.append({'id': image_id, 'image_hash': digest_by_path[key]})
+
+    for start in range(0, len(updates), BATCH_SIZE):
+        batch = updates[start:start + BATCH_SIZE]
+        with engine.begin() as conn:
+            # image_hash не влияет на product_listing - триггеры витрины не нужны
+            conn.execute(text("SET LOCAL product_listing.deferred = 'on'"))
+            conn.execute(text("""
+                UPDATE product_images SET image_hash = :image_hash WHERE id = :id
+            """), batch)
+        print(f"   Обновлено: {min(start + BATCH_SIZE, len(updates)):,}/{len(updates):,}")
+
+    unique = len(set(u['image_hash'] for u in updates))
+
+    print("\n" + "="*80)
+    print("✅ ХЕШИ ИЗОБРАЖЕНИЙ ЗАПОЛНЕНЫ")
+    print("="*80)
+    print(f"🖼️  Записей с хешем:        {len(updates):,}")
+    print(f"🧬 Уникальных изображений: {unique:,}")
+    print(f"⚠️  Файл не найден:         {missing:,}")
+    print()
+
+
+if __name__ == "__main__":
+    add_image_hash_column(backfill='--backfill' in sys.argv)
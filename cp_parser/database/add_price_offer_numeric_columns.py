@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Числовые колонки price_offers для фильтров /products
+
+quantity / price_usd / price_rub хранятся текстом, поэтому фильтры делали
+CAST(po.quantity AS INTEGER) / CAST(po.price_rub AS NUMERIC) на лету (индекс
+не используется), а веб-интерфейс разбирал '20 700,00 ₽' в Python.
+
+Миграция:
+1. quantity_num INTEGER, price_usd_num NUMERIC(14,2), price_rub_num NUMERIC(14,2)
+2. SQL-функция parse_price_text() - те же правила, что у парсеров
+   (cp_parser_core/utils/offer_values.py)
+3. Триггер BEFORE INSERT OR UPDATE: числовые колонки пересчитываются из
+   текстовых при любой записи (парсеры, ручные правки, скрипты) - не
+   расходятся с quantity / price_usd / price_rub
+4. Индексы: (product_id, quantity_num), (price_rub_num), (quantity_num),
+   (delivery_time_days) - фильтры max_price / max_quantity / max_delivery_days
+   становятся range scan по индексу
+5. Досчет старых записей пачками по id (можно прервать и запустить снова)
+
+Запуск:
+    python database/add_price_offer_numeric_columns.py
+    python database/add_price_offer_numeric_columns.py --batch-size 20000
+"""
+
+import os
+import sys
+import time
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.create_product_listing import create_refresh_function
+
+load_dotenv()
+
+BATCH_SIZE = 10000
+
+
+def add_numeric_columns(conn):
+    """Колонки, функция разбора и индексы"""
+
+    print("\n1️⃣  Добавление числовых колонок...")
+    conn.execute(text("""
+        ALTER TABLE price_offers
+            ADD COLUMN IF NOT EXISTS quantity_num INTEGER,
+            ADD COLUMN IF NOT EXISTS price_usd_num NUMERIC(14, 2),
+            ADD COLUMN IF NOT EXISTS price_rub_num NUMERIC(14, 2)
+    """))
+    print("✅ Колонки добавлены")
+
+    print("\n2️⃣  Функция parse_price_text()...")
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION parse_price_text(value TEXT) RETURNS NUMERIC AS $$
+        DECLARE
+            result NUMERIC;
+        BEGIN
+            IF value IS NULL OR btrim(value) = '' THEN
+                RETURN NULL;
+            END IF;
+
+            BEGIN
+                -- Обычная запись числа (в т.ч. '1e+06')
+                result := btrim(value)::NUMERIC;
+            EXCEPTION WHEN others THEN
+                BEGIN
+                    -- '20 700,00 ₽' → '20700.00'
+                    result := replace(regexp_replace(value, '[^0-9,.\\-]', '', 'g'), ',', '.')::NUMERIC;
+                EXCEPTION WHEN others THEN
+                    RETURN NULL;
+                END;
+            END;
+
+            IF result = 'NaN'::NUMERIC OR abs(result) >= 1e12 THEN
+                RETURN NULL;
+            END IF;
+
+            RETURN round(result, 2);
+        END
+        $$ LANGUAGE plpgsql IMMUTABLE
+    """))
+    print("✅ Функция создана")
+
+    print("\n3️⃣  Триггер синхронизации...")
+    create_sync_trigger(conn)
+    print("✅ Триггер trg_price_offers_numeric создан")
+
+    print("\n4️⃣  Индексы...")
+    for index_name, columns in (
+        ('idx_price_offers_product_quantity_num', 'product_id, quantity_num'),
+        ('idx_price_offers_price_rub_num', 'price_rub_num'),
+        ('idx_price_offers_quantity_num', 'quantity_num'),
+        ('idx_price_offers_delivery_days', 'delivery_time_days'),
+    ):
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {index_name} ON price_offers({columns})
+        """))
+        print(f"   ✅ {index_name}")
+
+
+def create_sync_trigger(conn):
+    """
+    BEFORE INSERT OR UPDATE OF quantity, price_usd, price_rub: *_num из текста
+    тем же parse_price_text(), что и досчет
+    """
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION price_offers_sync_numeric() RETURNS TRIGGER AS $$
+        DECLARE
+            q NUMERIC;
+        BEGIN
+            q := parse_price_text(NEW.quantity::text);
+            NEW.quantity_num := CASE WHEN abs(q) < 2147483647 THEN round(q)::INTEGER END;
+            NEW.price_usd_num := parse_price_text(NEW.price_usd::text);
+            NEW.price_rub_num := parse_price_text(NEW.price_rub::text);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    conn.execute(text("DROP TRIGGER IF EXISTS trg_price_offers_numeric ON price_offers"))
+    conn.execute(text("""
+        CREATE TRIGGER trg_price_offers_numeric
+        BEFORE INSERT OR UPDATE OF quantity, price_usd, price_rub ON price_offers
+        FOR EACH ROW EXECUTE FUNCTION price_offers_sync_numeric()
+    """))
+
+
+def backfill(engine, batch_size=BATCH_SIZE):
+    """Заполняет числовые колонки для записей без них, пачками по id"""
+
+    with engine.connect() as conn:
+        min_id, max_id = conn.execute(text("""
+            SELECT MIN(id), MAX(id) FROM price_offers
+            WHERE quantity_num IS NULL AND price_usd_num IS NULL AND price_rub_num IS NULL
+        """)).fetchone()
+
+    if min_id is None:
+        print("✅ Все офферы уже заполнены")
+        return 0
+
+    started = time.perf_counter()
+    updated = 0
+
+    # Каждая пачка - своя транзакция: короткие блокировки, прогресс не теряется
+    for start in range(min_id, max_id + 1, batch_size):
+        with engine.begin() as conn:
+            # product_listing пересчитывается целиком после досчета
+            conn.execute(text("SET LOCAL product_listing.deferred = 'on'"))
+            result = conn.execute(text("""
+                UPDATE price_offers
+                SET quantity_num = (
+                        SELECT CASE WHEN abs(q) < 2147483647 THEN round(q)::INTEGER END
+                        FROM parse_price_text(quantity::text) q
+                    ),
+                    price_usd_num = parse_price_text(price_usd::text),
+                    price_rub_num = parse_price_text(price_rub::text)
+                WHERE id >= :start AND id < :end
+                AND quantity_num IS NULL AND price_usd_num IS NULL AND price_rub_num IS NULL
+            """), {'start': start, 'end': start + batch_size})
+            updated += result.rowcount
+
+        elapsed = time.perf_counter() - started
+        print(f"   Обновлено: {updated:,} (id до {min(start + batch_size - 1, max_id):,}) "
+              f"| {updated / elapsed if elapsed else 0:,.0f} строк/сек")
+
+    return updated
+
+
+def add_price_offer_numeric_columns(batch_size=BATCH_SIZE):
+    """Миграция + досчет числовых колонок"""
+
+    db_url = os.getenv('DATABASE_URL') or os.getenv('DATABASE_URL_PRIVATE')
+
+    if not db_url:
+        print("❌ Не найден DATABASE_URL")
+        sys.exit(1)
+
+    print(f"📊 Подключение к БД: {db_url[:50]}...")
+    engine = create_engine(db_url, pool_pre_ping=True)
+
+    with engine.begin() as conn:
+        add_numeric_columns(conn)
+
+    print("\n5️⃣  Досчет старых записей...")
+    updated = backfill(engine, batch_size)
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE price_offers"))
+
+        # product_listing считает мин. цену / тираж - переводим на числовые колонки
+        if conn.execute(text("SELECT to_regclass('product_listing') IS NOT NULL")).scalar():
+            print("\n6️⃣  refresh_product_listing() → числовые колонки...")
+            create_refresh_function(conn)
+            conn.execute(text("SELECT refresh_product_listing(NULL)"))
+            print("✅ product_listing пересчитана")
+
+    print("\n" + "="*80)
+    print("✅ ЧИСЛОВЫЕ КОЛОНКИ PRICE_OFFERS ГОТОВЫ")
+    print("="*80)
+    print(f"🔢 Досчитано офферов: {updated:,}")
+    print()
+
+
+if __name__ == "__main__":
+    batch_size = BATCH_SIZE
+    if '--batch-size' in sys.argv:
+        batch_size = int(sys.argv[sys.argv.index('--batch-size') + 1])
+    add_price_offer_numeric_columns(batch_size)
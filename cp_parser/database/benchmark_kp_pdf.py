@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк генерации PDF КП: время и пиковая память (RSS) на синтетическом КП
+
+Синтетический КП (по умолчанию 500 товаров × 3 варианта цены × 3 изображения)
+без базы: товары в формате kp_data.get_kp_products, уникальные JPEG для
+каждого товара отдает локальный HTTP-сервер (изображения проходят обычный
+путь kp_images: загрузка → уменьшение → PDF). Кэш превью - во временной
+папке, каждый прогон начинается с холодного кэша.
+
+Режимы (каждый - в отдельном процессе, чтобы пиковый RSS не смешивался):
+    buffered  - прежняя сборка: все изображения и вся story в памяти до doc.build
+    streaming - потоковая сборка: изображения блоками по --chunk-size товаров,
+                секции товаров создаются по ходу верстки
+
+Запуск:
+    python database/benchmark_kp_pdf.py
+    python database/benchmark_kp_pdf.py --items 1000 --images 5 --chunk-size 50
+    python database/benchmark_kp_pdf.py --mode streaming --keep   # оставить PDF
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from io import BytesIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+MODES = ('buffered', 'streaming')
+IMAGE_SIZE = (1200, 1200)
+
+
+def synthetic_image(seed):
+    """JPEG ~1200×1200: градиент + случайные фигуры (размер файла как у фото товара)"""
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(seed)
+    img = Image.linear_gradient('L').resize(IMAGE_SIZE).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rnd.randrange(IMAGE_SIZE[0]), rnd.randrange(IMAGE_SIZE[1])
+        r = rnd.randrange(20, 200)
+        draw.ellipse((x - r, y - r, x + r, y + r),
+                     fill=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """/img/<seed>.jpg - детерминированное синтетическое изображение"""
+
+    def do_GET(self):
+        name = self.path.rsplit('/', 1)[-1]
+        if not name.endswith('.jpg'):
+            self.send_error(404)
+            return
+        data = synthetic_image(name[:-4])
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_image_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def synthetic_products(items, offers, images, base_url):
+    """Товары КП в формате get_kp_products"""
+    rnd = random.Random(42)
+    products = {}
+    for product_id in range(1, items + 1):
+        products[product_id] = {
+            'info': {
+                'name': f'Тестовый товар {product_id}',
+                'description': 'Синтетическое описание товара для бенчмарка. ' * 6,
+                'sample_price': round(rnd.uniform(5, 50), 2),
+                'sample_delivery_time': rnd.randrange(7, 30),
+                'custom_field': None
+            },
+            'offers': [
+                {
+                    'quantity': 100 * 10 ** n,
+                    'route': rnd.choice(['ЖД', 'АВИА', 'Контейнер']),
+                    'price_usd': round(rnd.uniform(0.5, 20), 2),
+                    'price_rub': round(rnd.uniform(50, 2000), 2),
+                    'delivery_days': rnd.randrange(20, 60)
+                }
+                for n in range(offers)
+            ],
+            'images': [f"{base_url}/img/{product_id}-{n}.jpg" for n in range(images)]
+        }
+    return products
+
+
+def run_mode(args):
+    """Один прогон в текущем процессе → JSON-строка с результатом"""
+    cache_dir = tempfile.mkdtemp(prefix='kp_pdf_bench_')
+    os.environ['KP_THUMBNAIL_CACHE_DIR'] = cache_dir
+    os.environ['KP_PDF_CHUNK_SIZE'] = str(args.chunk_size)
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from kp_generator_pdf import KPPDFGenerator
+
+    products = synthetic_products(args.items, args.offers, args.images, args.base_url)
+    output_path = os.path.join(args.output_dir, f'benchmark_{args.run}.pdf')
+
+    generator = KPPDFGenerator()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    generator.render(products, output_path, streaming=args.run == 'streaming')
+    elapsed = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    print('BENCH_RESULT ' + json.dumps({
+        'mode': args.run,
+        'seconds': round(elapsed, 2),
+        'peak_rss_mb': round(peak_rss / 1024, 1),
+        'rss_growth_mb': round((peak_rss - rss_before) / 1024, 1),
+        'pdf_mb': round(os.path.getsize(output_path) / 1024 / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк генерации PDF КП')
+    parser.add_argument('--items', type=int, default=500, help='Товаров в КП')
+    parser.add_argument('--offers', type=int, default=3, help='Вариантов цены на товар')
+    parser.add_argument('--images', type=int, default=3, help='Изображений на товар')
+    parser.add_argument('--chunk-size', type=int, default=20, help='Товаров в блоке предзагрузки (streaming)')
+    parser.add_argument('--mode', choices=MODES + ('both',), default='both')
+    parser.add_argument('--keep', action='store_true', help='Не удалять сгенерированные PDF')
+    parser.add_argument('--run', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--output-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_mode(args)
+        return
+
+    server, base_url = start_image_server()
+    output_dir = tempfile.mkdtemp(prefix='kp_pdf_bench_out_')
+    modes = MODES if args.mode == 'both' else (args.mode,)
+
+    print(f"\n🧪 Синтетический КП: {args.items} товаров × {args.offers} вариантов × {args.images} изображений")
+
+    results = []
+    try:
+        for mode in modes:
+            print(f"\n⏱️  Режим {mode}...")
+            completed = subprocess.run([
+                sys.executable, os.path.abspath(__file__),
+                '--run', mode, '--base-url', base_url, '--output-dir', output_dir,
+                '--items', str(args.items), '--offers', str(args.offers),
+                '--images', str(args.images), '--chunk-size', str(args.chunk_size)
+            ], capture_output=True, text=True)
+
+            lines = [line for line in completed.stdout.splitlines() if line.startswith('BENCH_RESULT ')]
+            if completed.returncode != 0 or not lines:
+                print(completed.stdout[-2000:])
+                print(completed.stderr[-2000:])
+                print(f"❌ Режим {mode} завершился с ошибкой")
+                continue
+            results.append(json.loads(lines[-1][len('BENCH_RESULT '):]))
+    finally:
+        server.shutdown()
+        if args.keep:
+            print(f"\n📁 PDF сохранены в {output_dir}")
+        else:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    print(f"\n{'Режим':<12}{'Время, с':>10}{'Пик RSS, МБ':>14}{'Рост RSS, МБ':>15}{'PDF, МБ':>10}")
+    for r in results:
+        print(f"{r['mode']:<12}{r['seconds']:>10}{r['peak_rss_mb']:>14}{r['rss_growth_mb']:>15}{r['pdf_mb']:>10}")
+
+
+if __name__ == '__main__':
+    main()
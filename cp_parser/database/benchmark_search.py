@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк текстового поиска товаров: ILIKE-перебор vs pg_trgm + tsvector
+
+Создает отдельную схему search_bench с синтетическими товарами (по умолчанию
+120 000), применяет к ней ту же миграцию (create_search_indexes.py) и гоняет
+запросы /products в двух вариантах:
+    old - прежний ILIKE по четырем колонкам через JOIN
+    new - ProductSearch (web_interface/product_search.py)
+
+Для каждого запроса: p50 / p95 (COUNT + страница, как в products_list),
+число найденных товаров и проверка, что новый поиск находит все, что находил старый.
+
+Запуск:
+    python database/benchmark_search.py
+    python database/benchmark_search.py --products 300000 --repeat 30
+    python database/benchmark_search.py --keep      # не удалять схему после теста
+"""
+
+import os
+import sys
+import time
+import argparse
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту и к web_interface (ProductSearch)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web_interface'))
+
+from database.create_search_indexes import apply_search_schema
+from database.schema_features import reset_schema_features
+from product_search import ProductSearch
+
+load_dotenv()
+
+SCHEMA = 'search_bench'
+PAGE_SIZE = 20
+
+NOUNS = ['Кружка', 'Футболка', 'Ручка', 'Блокнот', 'Термос', 'Рюкзак', 'Зонт', 'Power bank',
+         'Шоппер', 'Бутылка', 'Кепка', 'Худи', 'Флешка', 'Ежедневник', 'Плед', 'Толстовка',
+         'Термокружка', 'Сумка', 'Брелок', 'Powerbank', 'Lanyard', 'Tote bag']
+ADJECTIVES = ['керамическая', 'хлопковая', 'металлическая', 'с логотипом', 'брендированная',
+              'складной', 'эко', 'премиум', 'с гравировкой', 'soft touch', 'из бамбука', 'детская']
+DESIGNS = ['Новогодний', 'Корпоративный', 'Минимализм', 'Космос', 'Лес', 'Неон', 'Ретро', 'Арт']
+CLIENTS = ['Сбер', 'Яндекс', 'Газпром', 'Ozon', 'Wildberries', 'МТС', 'Tinkoff', 'Ростелеком']
+DESCRIPTION_WORDS = ['объем', '350 мл', 'нанесение', 'тампопечать', 'шелкография', 'УФ-печать',
+                     'упаковка', 'индивидуальная', 'коробка', 'материал', 'пластик', 'сталь',
+                     'керамика', 'хлопок', '180 г/м2', 'цвет', 'белый', 'черный', 'синий',
+                     'размер', 'логотипом', 'вышивка', 'доставка', 'образец', 'сертификат']
+
+QUERIES = [
+    'кружка',            # частое название
+    'кружки',            # словоформа (находит только tsvector)
+    'термос металлический',
+    'логотип',           # и в названии, и в описании
+    'Космос',            # дизайн
+    'Ozon',              # проект
+    'шелкография',       # только описание
+    'powerbank',
+    'несуществующий товар',
+]
+
+
+def _sql_array(values):
+    return "ARRAY[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+
+def _pick(values):
+    return f"({_sql_array(values)})[1 + floor(random() * {len(values)})::int]"
+
+
+def seed(conn, products, projects):
+    """Синтетические projects / products в схеме search_bench"""
+    print(f"\n🧪 Генерация {products:,} товаров в {projects:,} проектах (схема {SCHEMA})...")
+    started = time.perf_counter()
+
+    conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+    conn.execute(text("SELECT setseed(0.42)"))
+
+    conn.execute(text("""
+        CREATE TABLE projects (
+            id SERIAL PRIMARY KEY,
+            project_name TEXT,
+            region TEXT,
+            offer_created_at TIMESTAMP
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE products (
+            id SERIAL PRIMARY KEY,
+            project_id INTEGER NOT NULL REFERENCES projects(id),
+            name TEXT NOT NULL,
+            custom_field TEXT,
+            description TEXT
+        )
+    """))
+    conn.execute(text("CREATE INDEX idx_products_project ON products(project_id)"))
+
+    conn.execute(text(f"""
+        INSERT INTO projects (project_name, region, offer_created_at)
+        SELECT 'КП ' || {_pick(CLIENTS)} || ' №' || g,
+               CASE WHEN random() < 0.1 THEN 'ОАЭ' ELSE 'РФ' END,
+               NOW() - g * INTERVAL '1 hour'
+        FROM generate_series(1, :projects) g
+    """), {'projects': projects})
+
+    description = " || ' ' || ".join([_pick(DESCRIPTION_WORDS)] * 6)
+    conn.execute(text(f"""
+        INSERT INTO products (project_id, name, custom_field, description)
+        SELECT 1 + floor(random() * :projects)::int,
+               {_pick(NOUNS)} || ' ' || {_pick(ADJECTIVES)},
+               CASE WHEN random() < 0.4 THEN 'Дизайн ' || {_pick(DESIGNS)} END,
+               {description}
+        FROM generate_series(1, :products) g
+    """), {'projects': projects, 'products': products})
+
+    print(f"✅ Данные созданы за {time.perf_counter() - started:.1f}с")
+
+
+def old_search(conn, search):
+    """Прежний вариант products_list: ILIKE по четырем колонкам через JOIN"""
+    params = {'search': f"%{search}%", 'limit': PAGE_SIZE}
+    where = ("(p.name ILIKE :search OR p.custom_field ILIKE :search "
+             "OR pr.project_name ILIKE :search OR p.description ILIKE :search)")
+
+    total = conn.execute(text(f"""
+        SELECT COUNT(DISTINCT p.id)
+        FROM products p LEFT JOIN projects pr ON p.project_id = pr.id
+        WHERE {where}
+    """), params).scalar()
+
+    conn.execute(text(f"""
+        SELECT DISTINCT p.id, p.name, pr.project_name,
+            CASE
+                WHEN p.name ILIKE :search THEN 1
+                WHEN p.custom_field ILIKE :search OR pr.project_name ILIKE :search THEN 2
+                WHEN p.description ILIKE :search THEN 3
+                ELSE 4
+            END as relevance_rank
+        FROM products p LEFT JOIN projects pr ON p.project_id = pr.id
+        WHERE {where}
+        ORDER BY relevance_rank ASC, p.id DESC
+        LIMIT :limit
+    """), params).fetchall()
+
+    return total, where, params
+
+
+def new_search(conn, search):
+    """Новый вариант: ProductSearch"""
+    found = ProductSearch(conn, search)
+    params = dict(found.params, limit=PAGE_SIZE)
+
+    total = conn.execute(text(f"""
+        SELECT COUNT(DISTINCT p.id)
+        FROM products p LEFT JOIN projects pr ON p.project_id = pr.id
+        WHERE {found.where}
+    """), params).scalar()
+
+    conn.execute(text(f"""
+        SELECT DISTINCT p.id, p.name, pr.project_name, {found.rank_select}
+        FROM products p LEFT JOIN projects pr ON p.project_id = pr.id
+        WHERE {found.where}
+        ORDER BY {found.order_by}, p.id DESC
+        LIMIT :limit
+    """), params).fetchall()
+
+    return total, found.where, params
+
+
+def matched_ids(conn, where, params):
+    return {row[0] for row in conn.execute(text(f"""
+        SELECT p.id FROM products p LEFT JOIN projects pr ON p.project_id = pr.id
+        WHERE {where}
+    """), params)}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def measure(conn, search_fn, search, repeat):
+    timings = []
+    total = where = params = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        total, where, params = search_fn(conn, search)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, total, where, params
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк поиска товаров')
+    parser.add_argument('--products', type=int, default=120_000, help='Сколько товаров сгенерировать')
+    parser.add_argument('--projects', type=int, default=3_000, help='Сколько проектов сгенерировать')
+    parser.add_argument('--repeat', type=int, default=20, help='Повторов на запрос')
+    parser.add_argument('--keep', action='store_true', help='Не удалять схему search_bench')
+    args = parser.parse_args()
+
+    db_url = os.getenv('DATABASE_URL') or os.getenv('DATABASE_URL_PRIVATE')
+
+    if not db_url:
+        print("❌ Не найден DATABASE_URL")
+        sys.exit(1)
+
+    print(f"📊 Подключение к БД: {db_url[:50]}...")
+    engine = create_engine(db_url, pool_pre_ping=True)
+
+    # Расширение - в public, иначе оно создастся в search_bench и удалится вместе со схемой
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+    with engine.begin() as conn:
+        seed(conn, args.products, args.projects)
+
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+
+            # До миграции: индексов поиска нет
+            baseline = {search: measure(conn, old_search, search, args.repeat) for search in QUERIES}
+
+            started = time.perf_counter()
+            apply_search_schema(conn)
+            conn.commit()
+            print(f"\n⏱️  Миграция на {args.products:,} товарах: {time.perf_counter() - started:.1f}с")
+
+            reset_schema_features('products.search_vector')
+
+            print("\n" + "="*100)
+            print(f"{'Запрос':<24} {'old p50':>9} {'old p95':>9} {'new p50':>9} {'new p95':>9} "
+                  f"{'x p50':>7} {'old N':>8} {'new N':>8}  полнота")
+            print("="*100)
+
+            for search in QUERIES:
+                old_timings, old_total, old_where, old_params = baseline[search]
+                new_timings, new_total, new_where, new_params = measure(conn, new_search, search, args.repeat)
+
+                missing = matched_ids(conn, old_where, old_params) - matched_ids(conn, new_where, new_params)
+                old_p50, new_p50 = percentile(old_timings, 50), percentile(new_timings, 50)
+                speedup = old_p50 / new_p50 if new_p50 else 0
+
+                print(f"{search:<24} {old_p50:>7.1f}мс {percentile(old_timings, 95):>7.1f}мс "
+                      f"{new_p50:>7.1f}мс {percentile(new_timings, 95):>7.1f}мс "
+                      f"{speedup:>6.1f}x {old_total:>8,} {new_total:>8,}  "
+                      f"{'✅' if not missing else f'❌ потеряно {len(missing)}'}")
+
+            print("="*100)
+            print("💡 old - без индексов поиска, new - pg_trgm + search_vector; время = COUNT + страница")
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            print(f"\n🗑️  Схема {SCHEMA} удалена")
+
+
+if __name__ == "__main__":
+    main()
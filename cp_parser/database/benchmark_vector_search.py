@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк векторного поиска pgvector: точность (recall@k) и задержка
+
+Создает в VECTOR_DATABASE_URL отдельную схему vector_bench с синтетическими
+embeddings (кластеры + шум, по умолчанию 50 000 × 1536), строит ANN-индекс
+и гоняет запросы в вариантах:
+    old     - прежний SQL: вектор f-строкой три раза, порог в WHERE
+    exact   - точный перебор без индекса (эталон для recall)
+    ivfflat - nearest_products() с разными ivfflat.probes
+    hnsw    - nearest_products() с разными hnsw.ef_search
+
+Запросы - векторы случайных строк той же таблицы.
+recall@k = доля точных k ближайших, найденных ANN-поиском.
+
+Запуск:
+    python database/benchmark_vector_search.py
+    python database/benchmark_vector_search.py --rows 200000 --dim 512 --index hnsw
+    python database/benchmark_vector_search.py --keep      # не удалять схему после теста
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту и к web_interface (vector_queries)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web_interface'))
+
+from vector_queries import VectorIndex, nearest_products, vector_literal
+
+load_dotenv()
+
+SCHEMA = 'vector_bench'
+BENCH_INDEX = VectorIndex(f'{SCHEMA}.product_embeddings', 'name_embedding')
+
+PROBES = [1, 5, 10, 20, 50]
+EF_SEARCH = [10, 40, 100, 200]
+
+
+def seed(conn, rows, dim, clusters):
+    """Синтетические embeddings: центры кластеров + шум"""
+    print(f"\n🧪 Генерация {rows:,} векторов размерности {dim} ({clusters} кластеров, схема {SCHEMA})...")
+    started = time.perf_counter()
+
+    conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    conn.execute(text("SELECT setseed(0.42)"))
+
+    conn.execute(text(f"""
+        CREATE TABLE {SCHEMA}.centers AS
+        SELECT id, ARRAY(SELECT random() - 0.5 FROM generate_series(1, :dim)) as center
+        FROM generate_series(1, :clusters) id
+    """), {'dim': dim, 'clusters': clusters})
+
+    conn.execute(text(f"""
+        CREATE TABLE {SCHEMA}.product_embeddings (
+            product_id SERIAL PRIMARY KEY,
+            name_embedding vector({dim}) NOT NULL
+        )
+    """))
+    conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.product_embeddings (name_embedding)
+        SELECT (
+            SELECT array_agg(x + (random() - 0.5) * 0.2 ORDER BY i)
+            FROM unnest(c.center) WITH ORDINALITY as t(x, i)
+        )::vector
+        FROM generate_series(1, :rows) g
+        JOIN {SCHEMA}.centers c ON c.id = 1 + g % :clusters
+    """), {'rows': rows, 'clusters': clusters})
+
+    print(f"✅ Данные созданы за {time.perf_counter() - started:.1f}с")
+
+
+def build_index(conn, kind, rows):
+    started = time.perf_counter()
+    conn.execute(text(f"DROP INDEX IF EXISTS {SCHEMA}.idx_bench_embedding"))
+    if kind == 'ivfflat':
+        lists = max(10, int(rows ** 0.5))
+        conn.execute(text(f"""
+            CREATE INDEX idx_bench_embedding ON {SCHEMA}.product_embeddings
+            USING ivfflat (name_embedding vector_cosine_ops) WITH (lists = {lists})
+        """))
+        detail = f"lists={lists}"
+    else:
+        conn.execute(text(f"""
+            CREATE INDEX idx_bench_embedding ON {SCHEMA}.product_embeddings
+            USING hnsw (name_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+        """))
+        detail = "m=16, ef_construction=64"
+    conn.execute(text(f"ANALYZE {SCHEMA}.product_embeddings"))
+    print(f"\n🏗️  Индекс {kind} ({detail}) за {time.perf_counter() - started:.1f}с")
+
+
+def sample_queries(conn, count):
+    return [json.loads(row[0]) for row in conn.execute(text(f"""
+        SELECT name_embedding::text FROM {SCHEMA}.product_embeddings
+        ORDER BY random() LIMIT :count
+    """), {'count': count})]
+
+
+def exact_search(conn, embedding, k):
+    """Точные k ближайших: перебор без индекса (до конца транзакции)"""
+    conn.execute(text("SET LOCAL enable_indexscan = off"))
+    conn.execute(text("SET LOCAL enable_bitmapscan = off"))
+    return nearest_products(conn, BENCH_INDEX, embedding, k)
+
+
+def exact_ids(conn, embedding, k):
+    ids = [row[0] for row in exact_search(conn, embedding, k)]
+    conn.rollback()
+    return ids
+
+
+def old_query(conn, embedding, k, min_similarity):
+    """Прежний вариант: вектор f-строкой в SELECT, WHERE и ORDER BY"""
+    query_vector_str = vector_literal(embedding)
+    return conn.execute(text(f"""
+        SELECT product_id,
+               1 - (name_embedding <=> '{query_vector_str}'::vector) as similarity
+        FROM {BENCH_INDEX.table}
+        WHERE 1 - (name_embedding <=> '{query_vector_str}'::vector) >= {min_similarity}
+        ORDER BY name_embedding <=> '{query_vector_str}'::vector
+        LIMIT {k}
+    """)).fetchall()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def measure(conn, queries, truth, k, search_fn):
+    """(p50 мс, p95 мс, recall@k) по всем запросам"""
+    timings = []
+    found = 0
+    for embedding, expected in zip(queries, truth):
+        started = time.perf_counter()
+        rows = search_fn(conn, embedding)
+        timings.append((time.perf_counter() - started) * 1000)
+        conn.rollback()  # сбрасываем set_config(..., true) между запросами
+        found += len(set(row[0] for row in rows) & set(expected))
+    return percentile(timings, 50), percentile(timings, 95), found / (k * len(queries))
+
+
+def print_row(label, p50, p95, recall):
+    print(f"{label:<28} {p50:>8.1f}мс {p95:>8.1f}мс {recall * 100:>8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк векторного поиска pgvector')
+    parser.add_argument('--rows', type=int, default=50_000, help='Сколько векторов сгенерировать')
+    parser.add_argument('--dim', type=int, default=1536, help='Размерность (1536 - текст, 512 - CLIP)')
+    parser.add_argument('--clusters', type=int, default=200, help='Кластеров в синтетических данных')
+    parser.add_argument('--queries', type=int, default=50, help='Сколько запросов')
+    parser.add_argument('--k', type=int, default=20, help='Сколько ближайших сравнивать (recall@k)')
+    parser.add_argument('--index', choices=['ivfflat', 'hnsw', 'both'], default='both')
+    parser.add_argument('--keep', action='store_true', help='Не удалять схему vector_bench')
+    args = parser.parse_args()
+
+    db_url = os.getenv('VECTOR_DATABASE_URL')
+
+    if not db_url:
+        print("❌ Не найден VECTOR_DATABASE_URL")
+        sys.exit(1)
+
+    print(f"📊 Подключение к БД: {db_url[:50]}...")
+    engine = create_engine(db_url, pool_pre_ping=True)
+
+    # Расширение - в public, иначе оно удалится вместе со схемой
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+    with engine.begin() as conn:
+        seed(conn, args.rows, args.dim, args.clusters)
+
+    try:
+        with engine.connect() as conn:
+            queries = sample_queries(conn, args.queries)
+            truth = [exact_ids(conn, embedding, args.k) for embedding in queries]
+
+            print("\n" + "="*62)
+            print(f"{'Вариант':<28} {'p50':>10} {'p95':>10} {'recall@' + str(args.k):>9}")
+            print("="*62)
+
+            print_row("exact (без индекса)", *measure(
+                conn, queries, truth, args.k, lambda c, e: exact_search(c, e, args.k)
+            ))
+
+            for kind in (['ivfflat', 'hnsw'] if args.index == 'both' else [args.index]):
+                build_index(conn, kind, args.rows)
+                conn.commit()
+
+                print_row(f"old f-строка ({kind})", *measure(
+                    conn, queries, truth, args.k, lambda c, e: old_query(c, e, args.k, 0.0)
+                ))
+
+                if kind == 'ivfflat':
+                    for probes in PROBES:
+                        print_row(f"ivfflat probes={probes}", *measure(
+                            conn, queries, truth, args.k,
+                            lambda c, e: nearest_products(c, BENCH_INDEX, e, args.k, probes=probes)
+                        ))
+                else:
+                    for ef_search in EF_SEARCH:
+                        print_row(f"hnsw ef_search={ef_search}", *measure(
+                            conn, queries, truth, args.k,
+                            lambda c, e: nearest_products(c, BENCH_INDEX, e, args.k, ef_search=ef_search)
+                        ))
+
+            print("="*62)
+            print("💡 Значения для продакшена: VECTOR_IVFFLAT_PROBES / VECTOR_HNSW_EF_SEARCH")
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            print(f"\n🗑️  Схема {SCHEMA} удалена")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Пакетная индексация embeddings в pgvector БД (VECTOR_DATABASE_URL)
+
+Строит / дополняет таблицы, по которым ищет веб-интерфейс (vector_queries.py):
+    image_embeddings   - CLIP embeddings изображений товаров (поиск по картинке)
+    product_embeddings - embeddings названий товаров (векторный текстовый поиск)
+
+Изображения (--target images):
+1. product_images читаются из основной БД пачками по id (keyset)
+2. картинка с уже известным хэшем содержимого (image_hash / BLAKE2b байтов)
+   не скачивается и не считается - вектор копируется
+3. остальные скачиваются (или читаются из storage/images), декодируются и
+   уменьшаются до 224px в пуле процессов
+4. embeddings - пачками через бэкенд image_embeddings.py (локальный CLIP)
+5. запись - COPY во временную таблицу + upsert, commit на каждую пачку
+
+Названия (--target products): названия пачками по 256 через EmbeddingClient
+(embeddings.py, одинаковые названия считаются один раз), запись так же.
+
+Продолжает с последнего проиндексированного id (прервать и запустить снова
+можно в любой момент). В конце - ANN-индекс (hnsw / ivfflat) и ANALYZE.
+
+Записи, которые не удалось посчитать (не скачалось, ошибка API, дубль хэша
+с такой ошибкой), остаются в таблице embedding_failures векторной БД -
+основной проход их пропускает, --retry-failed пробует заново только их.
+
+Запуск:
+    python database/build_image_embeddings.py
+    python database/build_image_embeddings.py --workers 8 --batch-size 64
+    python database/build_image_embeddings.py --target products
+    python database/build_image_embeddings.py --from-id 0 --index ivfflat   # с начала
+    python database/build_image_embeddings.py --retry-failed                # только ошибки
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту, к web_interface (бэкенды embeddings) и к cp_parser_core (image_digest)
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT))
+sys.path.append(str(PROJECT_ROOT / 'web_interface'))
+sys.path.append(str(PROJECT_ROOT.parent / 'cp_parser_core'))
+
+from utils.image_store import image_digest
+
+load_dotenv()
+
+IMAGES_DIR = PROJECT_ROOT / 'storage' / 'images'
+
+# Сколько строк product_images / products читать из основной БД за раз
+PAGE_SIZE = 1000
+DOWNLOAD_TIMEOUT = 20
+
+TARGETS = {
+    'images': {
+        'table': 'image_embeddings',
+        'key': 'image_id',
+        'column': 'image_embedding',
+        'dim': 512,
+    },
+    'products': {
+        'table': 'product_embeddings',
+        'key': 'product_id',
+        'column': 'name_embedding',
+        'dim': 1536,
+    },
+}
+
+
+# ===== СХЕМА =====
+
+def ensure_schema(conn, target):
+    """Таблица embeddings (или недостающие колонки в уже существующей)"""
+    spec = TARGETS[target]
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+    if target == 'images':
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS image_embeddings (
+                image_id INTEGER,
+                product_id INTEGER NOT NULL,
+                content_hash VARCHAR(64),
+                image_embedding vector({spec['dim']}) NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """))
+        conn.execute(text("""
+            ALTER TABLE image_embeddings
+                ADD COLUMN IF NOT EXISTS image_id INTEGER,
+                ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64),
+                ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_image_embeddings_content_hash
+            ON image_embeddings(content_hash)
+        """))
+    else:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS product_embeddings (
+                product_id INTEGER,
+                name_embedding vector({spec['dim']}) NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """))
+
+    # ON CONFLICT по ключу - повторный запуск перезаписывает, а не дублирует
+    conn.execute(text(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_{spec['table']}_{spec['key']}
+        ON {spec['table']}({spec['key']})
+    """))
+
+    # Не посчитанные записи (для --retry-failed)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS embedding_failures (
+            target VARCHAR(16) NOT NULL,
+            item_id INTEGER NOT NULL,
+            error TEXT,
+            failed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (target, item_id)
+        )
+    """))
+
+
+def last_indexed_id(conn, target):
+    spec = TARGETS[target]
+    return conn.execute(text(f"SELECT COALESCE(MAX({spec['key']}), 0) FROM {spec['table']}")).scalar()
+
+
+def failed_ids(conn, target):
+    """id записей, которые не удалось посчитать в прошлых запусках"""
+    return [row[0] for row in conn.execute(text("""
+        SELECT item_id FROM embedding_failures WHERE target = :target ORDER BY item_id
+    """), {'target': target})]
+
+
+def save_failures(conn, target, failures, done_ids):
+    """Ошибки пачки → embedding_failures; успешно записанные id оттуда удаляются"""
+    if done_ids:
+        conn.execute(text("""
+            DELETE FROM embedding_failures WHERE target = :target AND item_id = ANY(:ids)
+        """), {'target': target, 'ids': list(done_ids)})
+    if failures:
+        conn.execute(text("""
+            INSERT INTO embedding_failures (target, item_id, error)
+            VALUES (:target, :item_id, :error)
+            ON CONFLICT (target, item_id) DO UPDATE
+            SET error = EXCLUDED.error, failed_at = NOW()
+        """), [{'target': target, 'item_id': item_id, 'error': error[:500]}
+               for item_id, error in failures])
+
+
+def _id_filter(retry_ids):
+    """Условие на id для --retry-failed (иначе - все id после after_id)"""
+    return "AND id = ANY(:retry_ids)" if retry_ids is not None else ""
+
+
+def build_ann_index(conn, target, kind):
+    """ANN-индекс по embeddings: hnsw дополняется сам, ivfflat пересоздается (центроиды)"""
+    spec = TARGETS[target]
+    index_name = f"idx_{spec['table']}_{kind}"
+    started = time.perf_counter()
+
+    if kind == 'hnsw':
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {index_name} ON {spec['table']}
+            USING hnsw ({spec['column']} vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+        """))
+    else:
+        rows = conn.execute(text(f"SELECT COUNT(*) FROM {spec['table']}")).scalar()
+        lists = max(10, int(rows ** 0.5))
+        conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        conn.execute(text(f"""
+            CREATE INDEX {index_name} ON {spec['table']}
+            USING ivfflat ({spec['column']} vector_cosine_ops) WITH (lists = {lists})
+        """))
+
+    conn.execute(text(f"ANALYZE {spec['table']}"))
+    print(f"✅ Индекс {index_name} готов за {time.perf_counter() - started:.1f}с")
+
+
+# ===== ЗАПИСЬ (COPY) =====
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(map(str, value)) + ']'
+    return str(value).replace('\\', '\\\\').replace('\t', ' ').replace('\n', ' ')
+
+
+def copy_rows(conn, target, columns, rows):
+    """COPY во временную таблицу + upsert по ключу"""
+    if not rows:
+        return 0
+    spec = TARGETS[target]
+    staging = f"{spec['table']}_staging"
+
+    conn.execute(text(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {staging}
+        (LIKE {spec['table']} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+    """))
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(value) for value in row) + '\n')
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {staging} ({', '.join(columns)}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column != spec['key'])
+    conn.execute(text(f"""
+        INSERT INTO {spec['table']} ({', '.join(columns)})
+        SELECT {', '.join(columns)} FROM {staging}
+        ON CONFLICT ({spec['key']}) DO UPDATE SET {updates}, created_at = NOW()
+    """))
+    return len(rows)
+
+
+# ===== ИЗОБРАЖЕНИЯ =====
+
+def load_image(row):
+    """
+    Воркер пула: байты изображения → (image_id, product_id, content_hash, PIL.Image | None, ошибка)
+    Сначала локальный файл, потом image_url.
+    """
+    from image_embeddings import preprocess_image
+
+    image_id, product_id, image_url, local_path, image_filename, image_hash = row
+    data = None
+    try:
+        for path in (local_path, IMAGES_DIR / image_filename if image_filename else None):
+            if path and os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                break
+        if data is None and image_url:
+            import requests
+            response = requests.get(image_url, timeout=DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+            data = response.content
+        if data is None:
+            return image_id, product_id, image_hash, None, 'нет файла и image_url'
+        return image_id, product_id, image_hash or image_digest(data), preprocess_image(data), None
+    except Exception as e:
+        print(f"   ⚠️  image_id={image_id}: {e}")
+        return image_id, product_id, image_hash, None, str(e)
+
+
+def known_vectors(vector_conn, hashes):
+    """content_hash → embedding (pgvector текст) для уже проиндексированных картинок"""
+    hashes = [h for h in set(hashes) if h]
+    if not hashes:
+        return {}
+    return dict(vector_conn.execute(text("""
+        SELECT DISTINCT ON (content_hash) content_hash, image_embedding::text
+        FROM image_embeddings
+        WHERE content_hash = ANY(:hashes)
+    """), {'hashes': hashes}).fetchall())
+
+
+def index_images(main_engine, vector_conn, after_id, args, retry_ids=None):
+    from image_embeddings import BACKENDS
+
+    backend = BACKENDS[args.backend]()
+    backend.load()
+
+    columns = ('image_id', 'product_id', 'content_hash', 'image_embedding')
+    stats = {'embedded': 0, 'reused': 0, 'failed': 0}
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        while args.limit is None or stats['embedded'] + stats['reused'] < args.limit:
+            with main_engine.connect() as main_conn:
+                rows = main_conn.execute(text(f"""
+                    SELECT id, product_id, image_url, local_path, image_filename, image_hash
+                    FROM product_images
+                    WHERE id > :after_id AND product_id IS NOT NULL {_id_filter(retry_ids)}
+                    ORDER BY id
+                    LIMIT :page
+                """), {'after_id': after_id, 'page': PAGE_SIZE, 'retry_ids': retry_ids}).fetchall()
+            if not rows:
+                break
+
+            # 1. Хэш уже в индексе (или повторяется в этой пачке) - картинку не качаем
+            vectors = known_vectors(vector_conn, [row[5] for row in rows])
+            pending, duplicates, pending_hashes = [], [], set()
+            for row in rows:
+                content_hash = row[5]
+                if content_hash in vectors or content_hash in pending_hashes:
+                    duplicates.append(row)
+                else:
+                    pending.append(tuple(row))
+                    if content_hash:
+                        pending_hashes.add(content_hash)
+
+            # 2. Скачивание + декодирование в пуле, embeddings пачками
+            output, batch, failures = [], [], []
+            for image_id, product_id, content_hash, image, error in pool.map(load_image, pending, chunksize=8):
+                if image is None:
+                    failures.append((image_id, error))
+                    continue
+                if content_hash in vectors:
+                    output.append((image_id, product_id, content_hash, vectors[content_hash]))
+                    stats['reused'] += 1
+                    continue
+                batch.append((image_id, product_id, content_hash, image))
+                if len(batch) >= args.batch_size:
+                    output.extend(_embed_batch(backend, batch, vectors))
+                    stats['embedded'] += len(batch)
+                    batch = []
+            if batch:
+                output.extend(_embed_batch(backend, batch, vectors))
+                stats['embedded'] += len(batch)
+
+            for image_id, product_id, _, _, _, content_hash in duplicates:
+                if content_hash in vectors:
+                    output.append((image_id, product_id, content_hash, vectors[content_hash]))
+                    stats['reused'] += 1
+                else:
+                    # Первая копия этого хэша в пачке не загрузилась
+                    failures.append((image_id, f'дубль {content_hash}: первая копия не загрузилась'))
+            stats['failed'] += len(failures)
+
+            # 3. COPY + commit: прерванный запуск продолжится с rows[-1],
+            #    не посчитанные id - в embedding_failures (--retry-failed)
+            copy_rows(vector_conn, 'images', columns, output)
+            save_failures(vector_conn, 'images', failures, [row[0] for row in output])
+            vector_conn.commit()
+
+            after_id = rows[-1][0]
+            _progress('изображений', stats, after_id, started)
+
+    return stats
+
+
+def _embed_batch(backend, batch, vectors):
+    """Embeddings пачки; vectors (хэш → вектор) пополняется для дублей"""
+    computed = backend.embed_images([image for _, _, _, image in batch])
+    result = []
+    for (image_id, product_id, content_hash, _), vector in zip(batch, computed):
+        if content_hash:
+            vectors[content_hash] = vector
+        result.append((image_id, product_id, content_hash, vector))
+    return result
+
+
+# ===== НАЗВАНИЯ ТОВАРОВ =====
+
+def index_products(main_engine, vector_conn, after_id, args, retry_ids=None):
+    from embeddings import EmbeddingClient, MAX_BATCH_SIZE
+
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        print("❌ Не найден OPENAI_API_KEY")
+        sys.exit(1)
+    client = EmbeddingClient(api_key, timeout=60)
+
+    stats = {'embedded': 0, 'reused': 0, 'failed': 0}
+    started = time.perf_counter()
+
+    while args.limit is None or stats['embedded'] < args.limit:
+        with main_engine.connect() as main_conn:
+            rows = main_conn.execute(text(f"""
+                SELECT id, name FROM products
+                WHERE id > :after_id {_id_filter(retry_ids)}
+                ORDER BY id
+                LIMIT :page
+            """), {'after_id': after_id, 'page': PAGE_SIZE, 'retry_ids': retry_ids}).fetchall()
+        if not rows:
+            break
+
+        named = [(product_id, name) for product_id, name in rows if name and name.strip()]
+        stats['failed'] += len(rows) - len(named)
+
+        # embed_many возвращает None для названий, на которых API ответил ошибкой:
+        # NOT NULL в таблице - такие не пишем, а запоминаем для --retry-failed
+        output, failures = [], []
+        for start in range(0, len(named), MAX_BATCH_SIZE):
+            chunk = named[start:start + MAX_BATCH_SIZE]
+            vectors = client.embed_many([name for _, name in chunk])
+            for (product_id, _), vector in zip(chunk, vectors):
+                if vector is None:
+                    failures.append((product_id, 'ошибка API embeddings'))
+                else:
+                    output.append((product_id, vector))
+        stats['embedded'] += len(output)
+        stats['failed'] += len(failures)
+
+        copy_rows(vector_conn, 'products', ('product_id', 'name_embedding'), output)
+        save_failures(vector_conn, 'products', failures, [product_id for product_id, _ in output])
+        vector_conn.commit()
+
+        after_id = rows[-1][0]
+        _progress('товаров', stats, after_id, started)
+
+    return stats
+
+
+def _progress(label, stats, after_id, started):
+    elapsed = time.perf_counter() - started
+    done = stats['embedded'] + stats['reused']
+    print(f"   📦 {label}: посчитано {stats['embedded']:,}, по хэшу {stats['reused']:,}, "
+          f"ошибок {stats['failed']:,} | id ≤ {after_id} | {done / max(elapsed, 0.001):.1f}/с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пакетная индексация embeddings в pgvector')
+    parser.add_argument('--target', choices=list(TARGETS), default='images',
+                        help='images - CLIP по product_images, products - названия товаров')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4,
+                        help='Процессов для скачивания и декодирования изображений')
+    parser.add_argument('--batch-size', type=int, default=32, help='Изображений на вызов модели')
+    parser.add_argument('--backend', default='local', help='Бэкенд image_embeddings.py (local / huggingface)')
+    parser.add_argument('--from-id', type=int, default=None,
+                        help='Начать после этого id (по умолчанию - после последнего проиндексированного)')
+    parser.add_argument('--limit', type=int, default=None, help='Остановиться примерно после N записей')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Пересчитать только записи из embedding_failures')
+    parser.add_argument('--index', choices=['hnsw', 'ivfflat', 'none'], default='hnsw',
+                        help='ANN-индекс после индексации')
+    args = parser.parse_args()
+
+    db_url = os.getenv('DATABASE_URL')
+    vector_db_url = os.getenv('VECTOR_DATABASE_URL')
+
+    if not db_url or not vector_db_url:
+        print("❌ Нужны DATABASE_URL и VECTOR_DATABASE_URL")
+        sys.exit(1)
+
+    print(f"📊 Основная БД: {db_url[:50]}...")
+    print(f"📊 Векторная БД: {vector_db_url[:50]}...")
+    main_engine = create_engine(db_url, pool_pre_ping=True)
+    vector_engine = create_engine(vector_db_url, pool_pre_ping=True)
+
+    retry_ids = None
+    with vector_engine.begin() as conn:
+        ensure_schema(conn, args.target)
+        if args.retry_failed:
+            retry_ids = failed_ids(conn, args.target)
+            after_id = 0
+        else:
+            after_id = args.from_id if args.from_id is not None else last_indexed_id(conn, args.target)
+
+    if retry_ids is not None:
+        if not retry_ids:
+            print("✅ Ошибок прошлых запусков нет - нечего пересчитывать")
+            return
+        print(f"\n🔁 Повтор {len(retry_ids):,} не посчитанных записей {TARGETS[args.target]['table']}")
+    else:
+        print(f"\n🚀 Индексация {TARGETS[args.target]['table']} с id > {after_id}")
+    started = time.perf_counter()
+
+    with vector_engine.connect() as conn:
+        if args.target == 'images':
+            stats = index_images(main_engine, conn, after_id, args, retry_ids)
+        else:
+            stats = index_products(main_engine, conn, after_id, args, retry_ids)
+
+    print(f"\n✅ Готово за {time.perf_counter() - started:.1f}с: {stats}")
+
+    if args.index != 'none':
+        with vector_engine.begin() as conn:
+            build_ann_index(conn, args.target, args.index)
+
+
+if __name__ == "__main__":
+    main()
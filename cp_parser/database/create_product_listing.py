@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Денормализованная таблица product_listing для списков товаров
+
+Раньше /products и /project/<id> на КАЖДУЮ строку выполняли коррелированные
+подзапросы:
+- главное изображение (ORDER BY CASE is_main_image::text ...)
+- для сортировки по цене MIN(CAST(po.price_rub AS NUMERIC))
+
+Теперь это заранее посчитано в product_listing (одна строка на товар):
+    main_image_url, min_price_rub, min_quantity, max_delivery_days, offer_count
+
+Обновляется инкрементально: парсеры после записи проекта вызывают
+refresh_product_listing(ARRAY[id товаров]) в той же транзакции
+(cp_parser_core/utils/bulk_writer.py). Удаление товара удаляет строку (CASCADE).
+
+Любые другие изменения product_images / price_offers (compress_images_*.py,
+relink_*, batch_fix_*, ручные правки) пересчитывают витрину триггерами
+уровня оператора: одна refresh_product_listing() на затронутые товары
+оператора. Массовые записи, которые пересчитывают витрину сами, отключают
+триггеры на свою транзакцию: SET LOCAL product_listing.deferred = 'on'.
+
+Запуск:
+    python database/create_product_listing.py            # создать + заполнить
+    python database/create_product_listing.py --refresh  # полный пересчет
+                                                         # (правки до появления триггеров)
+"""
+
+import os
+import sys
+import time
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+load_dotenv()
+
+
+def apply_product_listing_schema(conn):
+    """Таблица, индексы и функция инкрементального обновления"""
+
+    print("\n1️⃣  Таблица product_listing...")
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS product_listing (
+            product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+            project_id INTEGER NOT NULL,
+            main_image_url VARCHAR(1000),
+            min_price_rub NUMERIC,
+            min_quantity INTEGER,
+            max_delivery_days INTEGER,
+            offer_count INTEGER NOT NULL DEFAULT 0,
+            refreshed_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """))
+    print("✅ Таблица создана")
+
+    print("\n2️⃣  Индексы...")
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_product_listing_min_price
+        ON product_listing(min_price_rub, product_id)
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_product_listing_project
+        ON product_listing(project_id, product_id)
+    """))
+    print("✅ Индексы созданы")
+
+    print("\n3️⃣  Функция refresh_product_listing(ids) и триггеры...")
+    create_refresh_function(conn)
+    create_sync_triggers(conn)
+    print("✅ Функция и триггеры созданы")
+
+
+def create_refresh_function(conn):
+    """
+    refresh_product_listing(ids): upsert витрины для товаров, ids = NULL - все.
+    Если у price_offers уже есть числовые колонки
+    (add_price_offer_numeric_columns.py) - агрегаты по ним, без CAST.
+    """
+    numeric_offers = conn.execute(text("""
+        SELECT COUNT(*) = 2 FROM information_schema.columns
+        WHERE table_name = 'price_offers' AND column_name IN ('price_rub_num', 'quantity_num')
+    """)).scalar()
+
+    if numeric_offers:
+        min_price = "MIN(po.price_rub_num)"
+        min_quantity = "MIN(po.quantity_num)"
+    else:
+        min_price = "MIN(CAST(po.price_rub AS NUMERIC))"
+        min_quantity = "MIN(CAST(po.quantity AS INTEGER))"
+
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION refresh_product_listing(ids INTEGER[]) RETURNS INTEGER AS $$
+            WITH upserted AS (
+                INSERT INTO product_listing (
+                    product_id, project_id, main_image_url,
+                    min_price_rub, min_quantity, max_delivery_days, offer_count, refreshed_at
+                )
+                SELECT p.id, p.project_id, img.image_url,
+                       o.min_price_rub, o.min_quantity, o.max_delivery_days, o.offer_count, NOW()
+                FROM products p
+                LEFT JOIN LATERAL (
+                    SELECT pi.image_url
+                    FROM product_images pi
+                    WHERE pi.product_id = p.id
+                    AND pi.image_url IS NOT NULL
+                    ORDER BY
+                        CASE WHEN pi.is_main_image::text = 'true' THEN 0 ELSE 1 END,
+                        pi.cell_position
+                    LIMIT 1
+                ) img ON TRUE
+                CROSS JOIN LATERAL (
+                    SELECT {min_price} as min_price_rub,
+                           {min_quantity} as min_quantity,
+                           MAX(po.delivery_time_days) as max_delivery_days,
+                           COUNT(*) as offer_count
+                    FROM price_offers po
+                    WHERE po.product_id = p.id
+                ) o
+                WHERE ids IS NULL OR p.id = ANY(ids)
+                ON CONFLICT (product_id) DO UPDATE SET
+                    project_id = EXCLUDED.project_id,
+                    main_image_url = EXCLUDED.main_image_url,
+                    min_price_rub = EXCLUDED.min_price_rub,
+                    min_quantity = EXCLUDED.min_quantity,
+                    max_delivery_days = EXCLUDED.max_delivery_days,
+                    offer_count = EXCLUDED.offer_count,
+                    refreshed_at = EXCLUDED.refreshed_at
+                RETURNING 1
+            )
+            SELECT COUNT(*)::INTEGER FROM upserted
+        $$ LANGUAGE sql
+    """))
+
+
+# Событие → transition tables (допускаются только при одном событии на триггер)
+TRANSITION_TABLES = {
+    'INSERT': "NEW TABLE AS new_rows",
+    'UPDATE': "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    'DELETE': "OLD TABLE AS old_rows",
+}
+
+
+def create_statement_triggers(conn, name, function, tables):
+    """
+    AFTER INSERT / UPDATE / DELETE ... FOR EACH STATEMENT на таблицах:
+    trg_<таблица>_<name>_<событие> → function(), строки в new_rows / old_rows
+    """
+    for table in tables:
+        for event, referencing in TRANSITION_TABLES.items():
+            trigger = f"trg_{table}_{name}_{event.lower()}"
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON {table}"))
+            conn.execute(text(f"""
+                CREATE TRIGGER {trigger}
+                AFTER {event} ON {table}
+                REFERENCING {referencing}
+                FOR EACH STATEMENT EXECUTE FUNCTION {function}()
+            """))
+
+
+def create_sync_triggers(conn):
+    """
+    AFTER INSERT / UPDATE / DELETE ... FOR EACH STATEMENT на product_images и
+    price_offers: refresh_product_listing() по product_id измененных строк
+    """
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION product_listing_sync() RETURNS TRIGGER AS $$
+        DECLARE
+            ids INTEGER[];
+        BEGIN
+            -- Запись сама пересчитает витрину в конце транзакции (bulk_writer)
+            IF current_setting('product_listing.deferred', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+
+            IF TG_OP = 'INSERT' THEN
+                SELECT array_agg(DISTINCT product_id) INTO ids
+                FROM new_rows WHERE product_id IS NOT NULL;
+            ELSIF TG_OP = 'UPDATE' THEN
+                -- product_id мог смениться - пересчитываем и старый, и новый товар
+                SELECT array_agg(DISTINCT product_id) INTO ids FROM (
+                    SELECT product_id FROM new_rows
+                    UNION SELECT product_id FROM old_rows
+                ) changed WHERE product_id IS NOT NULL;
+            ELSE
+                SELECT array_agg(DISTINCT product_id) INTO ids
+                FROM old_rows WHERE product_id IS NOT NULL;
+            END IF;
+
+            IF ids IS NOT NULL THEN
+                PERFORM refresh_product_listing(ids);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+
+    create_statement_triggers(conn, 'listing', 'product_listing_sync', ('product_images', 'price_offers'))
+
+
+def refresh_all(conn):
+    """Полный пересчет product_listing"""
+    started = time.perf_counter()
+    rows = conn.execute(text("SELECT refresh_product_listing(NULL)")).scalar()
+    conn.execute(text("ANALYZE product_listing"))
+    print(f"✅ Пересчитано товаров: {rows:,} за {time.perf_counter() - started:.1f}с")
+
+
+def create_product_listing(refresh_only=False):
+    """Создает product_listing и заполняет ее"""
+
+    db_url = os.getenv('DATABASE_URL') or os.getenv('DATABASE_URL_PRIVATE')
+
+    if not db_url:
+        print("❌ Не найден DATABASE_URL")
+        sys.exit(1)
+
+    print(f"📊 Подключение к БД: {db_url[:50]}...")
+    engine = create_engine(db_url, pool_pre_ping=True)
+
+    with engine.begin() as conn:
+        if not refresh_only:
+            apply_product_listing_schema(conn)
+        elif conn.execute(text("SELECT to_regproc('product_listing_sync') IS NULL")).scalar():
+            # Витрина создана до триггеров
+            create_sync_triggers(conn)
+
+        print("\n4️⃣  Заполнение product_listing...")
+        refresh_all(conn)
+
+    print("\n" + "="*80)
+    print("✅ PRODUCT_LISTING ГОТОВА")
+    print("="*80)
+    print()
+
+
+if __name__ == "__main__":
+    create_product_listing(refresh_only='--refresh' in sys.argv)
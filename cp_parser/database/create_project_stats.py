@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Счетчики проекта в таблице project_stats
+
+Раньше /project/<id> на каждый просмотр считал COUNT(*) товаров (дважды -
+для пагинации и для статистики), офферов и изображений (JOIN с products),
+а /projects - COUNT(*) товаров подзапросом на каждую строку списка.
+
+Теперь одна строка на проект:
+    products_count, offers_count, images_count
+
+Обновляется парсерами: после записи проекта ProjectBulkWriter вызывает
+refresh_project_stats(ARRAY[id проектов]) в той же транзакции
+(cp_parser_core/utils/bulk_writer.py). Удаление проекта удаляет строку (CASCADE).
+
+Остальные записи (batch_fix_projects*.py, src/cleanup_products.py,
+src/clear_all_data.py, cleanup_test_data.py, ручные правки) пересчитывают
+счетчики триггерами уровня оператора на products / price_offers /
+product_images - как product_listing (create_product_listing.py). UPDATE
+пересчитывает только строки, сменившие проект / товар: счетчики от правок
+полей не меняются. ProjectBulkWriter отключает триггеры на свою транзакцию
+(SET LOCAL project_stats.deferred = 'on') - он пересчитывает проекты сам.
+
+Запуск:
+    python database/create_project_stats.py            # создать + заполнить
+    python database/create_project_stats.py --refresh  # полный пересчет
+                                                       # (правки до появления триггеров)
+"""
+
+import os
+import sys
+import time
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.create_product_listing import create_statement_triggers
+
+load_dotenv()
+
+
+def apply_project_stats_schema(conn):
+    """Таблица и функция пересчета"""
+
+    print("\n1️⃣  Таблица project_stats...")
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS project_stats (
+            project_id INTEGER PRIMARY KEY REFERENCES projects(id) ON DELETE CASCADE,
+            products_count INTEGER NOT NULL DEFAULT 0,
+            offers_count INTEGER NOT NULL DEFAULT 0,
+            images_count INTEGER NOT NULL DEFAULT 0,
+            refreshed_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """))
+    print("✅ Таблица создана")
+
+    print("\n2️⃣  Функция refresh_project_stats(ids) и триггеры...")
+    create_refresh_function(conn)
+    create_sync_triggers(conn)
+    print("✅ Функция и триггеры созданы")
+
+
+def create_refresh_function(conn):
+    """refresh_project_stats(ids): upsert счетчиков проектов, ids = NULL - все"""
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION refresh_project_stats(ids INTEGER[]) RETURNS INTEGER AS $$
+            WITH upserted AS (
+                INSERT INTO project_stats (
+                    project_id, products_count, offers_count, images_count, refreshed_at
+                )
+                SELECT pr.id,
+                       (SELECT COUNT(*) FROM products p WHERE p.project_id = pr.id),
+                       (SELECT COUNT(*) FROM price_offers po
+                        JOIN products p ON po.product_id = p.id
+                        WHERE p.project_id = pr.id),
+                       (SELECT COUNT(*) FROM product_images pi
+                        JOIN products p ON pi.product_id = p.id
+                        WHERE p.project_id = pr.id),
+                       NOW()
+                FROM projects pr
+                WHERE ids IS NULL OR pr.id = ANY(ids)
+                ON CONFLICT (project_id) DO UPDATE SET
+                    products_count = EXCLUDED.products_count,
+                    offers_count = EXCLUDED.offers_count,
+                    images_count = EXCLUDED.images_count,
+                    refreshed_at = EXCLUDED.refreshed_at
+                RETURNING 1
+            )
+            SELECT COUNT(*)::INTEGER FROM upserted
+        $$ LANGUAGE sql
+    """))
+
+
+def create_sync_triggers(conn):
+    """
+    AFTER INSERT / UPDATE / DELETE ... FOR EACH STATEMENT на products,
+    price_offers, product_images: refresh_project_stats() по проектам строк
+    """
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION project_stats_sync() RETURNS TRIGGER AS $$
+        DECLARE
+            ids INTEGER[];
+        BEGIN
+            -- Запись сама пересчитает проекты в конце транзакции (bulk_writer)
+            IF current_setting('project_stats.deferred', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+
+            IF TG_TABLE_NAME = 'products' THEN
+                IF TG_OP = 'INSERT' THEN
+                    SELECT array_agg(DISTINCT project_id) INTO ids FROM new_rows;
+                ELSIF TG_OP = 'UPDATE' THEN
+                    -- Счетчики меняет только перенос товара в другой проект
+                    SELECT array_agg(DISTINCT project_id) INTO ids FROM (
+                        SELECT n.project_id FROM new_rows n JOIN old_rows o ON o.id = n.id
+                        WHERE n.project_id IS DISTINCT FROM o.project_id
+                        UNION
+                        SELECT o.project_id FROM new_rows n JOIN old_rows o ON o.id = n.id
+                        WHERE n.project_id IS DISTINCT FROM o.project_id
+                    ) moved;
+                ELSE
+                    SELECT array_agg(DISTINCT project_id) INTO ids FROM old_rows;
+                END IF;
+            ELSE
+                -- price_offers / product_images: проекты через товары
+                IF TG_OP = 'INSERT' THEN
+                    SELECT array_agg(DISTINCT product_id) INTO ids FROM new_rows;
+                ELSIF TG_OP = 'UPDATE' THEN
+                    SELECT array_agg(DISTINCT product_id) INTO ids FROM (
+                        SELECT n.product_id FROM new_rows n JOIN old_rows o ON o.id = n.id
+                        WHERE n.product_id IS DISTINCT FROM o.product_id
+                        UNION
+                        SELECT o.product_id FROM new_rows n JOIN old_rows o ON o.id = n.id
+                        WHERE n.product_id IS DISTINCT FROM o.product_id
+                    ) moved;
+                ELSE
+                    -- При удалении товара (CASCADE) его уже нет - проект
+                    -- пересчитает триггер products
+                    SELECT array_agg(DISTINCT product_id) INTO ids FROM old_rows;
+                END IF;
+                SELECT array_agg(DISTINCT p.project_id) INTO ids
+                FROM products p WHERE p.id = ANY(ids);
+            END IF;
+
+            ids := array_remove(ids, NULL);
+            IF cardinality(ids) > 0 THEN
+                PERFORM refresh_project_stats(ids);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+
+    create_statement_triggers(conn, 'project_stats', 'project_stats_sync',
+                              ('products', 'price_offers', 'product_images'))
+
+
+def refresh_all(conn):
+    """Полный пересчет project_stats"""
+    started = time.perf_counter()
+    rows = conn.execute(text("SELECT refresh_project_stats(NULL)")).scalar()
+    conn.execute(text("ANALYZE project_stats"))
+    print(f"✅ Пересчитано проектов: {rows:,} за {time.perf_counter() - started:.1f}с")
+
+
+def create_project_stats(refresh_only=False):
+    """Создает project_stats и заполняет ее"""
+
+    db_url = os.getenv('DATABASE_URL') or os.getenv('DATABASE_URL_PRIVATE')
+
+    if not db_url:
+        print("❌ Не найден DATABASE_URL")
+        sys.exit(1)
+
+    print(f"📊 Подключение к БД: {db_url[:50]}...")
+    engine = create_engine(db_url, pool_pre_ping=True)
+
+    with engine.begin() as conn:
+        if not refresh_only:
+            apply_project_stats_schema(conn)
+        elif conn.execute(text("SELECT to_regproc('project_stats_sync') IS NULL")).scalar():
+            # Счетчики созданы до триггеров
+            create_sync_triggers(conn)
+
+        print("\n3️⃣  Заполнение project_stats...")
+        refresh_all(conn)
+
+    print("\n" + "="*80)
+    print("✅ PROJECT_STATS ГОТОВА")
+    print("="*80)
+    print()
+
+
+if __name__ == "__main__":
+    create_project_stats(refresh_only='--refresh' in sys.argv)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Индексы для текстового поиска товаров (/products)
+
+Раньше поиск делал ILIKE '%...%' по четырем колонкам - полный перебор
+products + projects на каждый запрос.
+
+Теперь:
+1. pg_trgm: GIN-индексы (gin_trgm_ops) на products.name, custom_field,
+   description и projects.project_name - ILIKE '%...%' идет по индексу
+2. products.search_vector - взвешенный tsvector:
+       A - название товара
+       B - дизайн (custom_field) + название проекта
+       C - описание
+   Находит словоформы ("кружки" → "кружка"), GIN-индекс.
+   Поддерживается триггерами (товары и переименование проекта).
+
+Запуск:
+    python database/create_search_indexes.py
+"""
+
+import os
+import sys
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+load_dotenv()
+
+# Конфигурация полнотекстового поиска (латиница тоже стеммится - english_stem)
+SEARCH_CONFIG = 'russian'
+
+SEARCH_VECTOR_SQL = f"""
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(p.name, '')), 'A') ||
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(p.custom_field, '') || ' ' || coalesce(pr.project_name, '')), 'B') ||
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(p.description, '')), 'C')
+"""
+
+TRGM_INDEXES = (
+    ('idx_products_name_trgm', 'products', 'name'),
+    ('idx_products_custom_field_trgm', 'products', 'custom_field'),
+    ('idx_products_description_trgm', 'products', 'description'),
+    ('idx_projects_project_name_trgm', 'projects', 'project_name'),
+)
+
+
+def apply_search_schema(conn, backfill=True):
+    """
+    DDL поиска (имена таблиц без схемы - работает и для бенчмарка
+    в отдельной схеме через search_path)
+    """
+    print("\n1️⃣  Расширение pg_trgm...")
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    print("✅ pg_trgm включен")
+
+    print("\n2️⃣  Триграммные GIN-индексы...")
+    for index_name, table, column in TRGM_INDEXES:
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {index_name}
+            ON {table} USING gin ({column} gin_trgm_ops)
+        """))
+        print(f"   ✅ {index_name}")
+
+    print("\n3️⃣  Колонка products.search_vector...")
+    conn.execute(text("""
+        ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+    """))
+
+    # Товар: пересчет при вставке / изменении полей поиска
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+        DECLARE
+            project_title TEXT;
+        BEGIN
+            SELECT project_name INTO project_title FROM projects WHERE id = NEW.project_id;
+            NEW.search_vector :=
+                setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.name, '')), 'A') ||
+                setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.custom_field, '') || ' ' || coalesce(project_title, '')), 'B') ||
+                setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'C');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    conn.execute(text("DROP TRIGGER IF EXISTS trg_products_search_vector ON products"))
+    conn.execute(text("""
+        CREATE TRIGGER trg_products_search_vector
+        BEFORE INSERT OR UPDATE OF name, custom_field, description, project_id ON products
+        FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+    """))
+
+    # Проект переименован: пересчитываем его товары (UPDATE вызовет триггер выше)
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION projects_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            UPDATE products SET project_id = project_id WHERE project_id = NEW.id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    conn.execute(text("DROP TRIGGER IF EXISTS trg_projects_search_vector ON projects"))
+    conn.execute(text("""
+        CREATE TRIGGER trg_projects_search_vector
+        AFTER UPDATE OF project_name ON projects
+        FOR EACH ROW
+        WHEN (OLD.project_name IS DISTINCT FROM NEW.project_name)
+        EXECUTE FUNCTION projects_search_vector_update()
+    """))
+    print("✅ Колонка и триггеры созданы")
+
+    if backfill:
+        print("\n4️⃣  Заполнение search_vector для существующих товаров...")
+        result = conn.execute(text(f"""
+            UPDATE products p
+            SET search_vector = {SEARCH_VECTOR_SQL}
+            FROM projects pr
+            WHERE pr.id = p.project_id
+            AND p.search_vector IS NULL
+        """))
+        print(f"✅ Обновлено товаров: {result.rowcount:,}")
+
+    print("\n5️⃣  GIN-индекс по search_vector...")
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_products_search_vector
+        ON products USING gin (search_vector)
+    """))
+    print("✅ Индекс создан")
+
+    conn.execute(text("ANALYZE products"))
+    conn.execute(text("ANALYZE projects"))
+
+
+def create_search_indexes():
+    """Создает индексы поиска в основной БД"""
+
+    db_url = os.getenv('DATABASE_URL') or os.getenv('DATABASE_URL_PRIVATE')
+
+    if not db_url:
+        print("❌ Не найден DATABASE_URL")
+        sys.exit(1)
+
+    print(f"📊 Подключение к БД: {db_url[:50]}...")
+    engine = create_engine(db_url, pool_pre_ping=True)
+
+    with engine.begin() as conn:
+        apply_search_schema(conn)
+
+    print("\n" + "="*80)
+    print("✅ ИНДЕКСЫ ПОИСКА СОЗДАНЫ")
+    print("="*80)
+    print("💡 Проверка: python database/benchmark_search.py")
+    print()
+
+
+if __name__ == "__main__":
+    create_search_indexes()
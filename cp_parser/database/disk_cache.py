@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Кэш файлов на локальном диске с ограничением размера (LRU)
+
+Общий для процессов одного хоста (воркеры gunicorn, генераторы КП):
+- ключ - любая строка (URL, имя файла + размер превью ...), файл -
+  <dir>/<2 символа sha1>/<sha1>.bin, рядом <sha1>.json с метаданными
+  (content_type, etag, last_modified, checked_at ...)
+- запись атомарная (tmp + os.replace): читатель видит старый или новый файл
+- LRU по mtime: каждое чтение обновляет mtime файла; когда записано больше
+  ~5% лимита, процесс пересчитывает размер каталога и удаляет самые старые
+  файлы до 90% лимита (под flock - один процесс за раз)
+
+Любая ошибка диска = промах кэша: вызывающий код идет в сеть, а не падает.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Удаляем до этой доли лимита, чтобы не чистить на каждой записи
+EVICT_TARGET = 0.9
+
+
+class DiskLRUCache:
+    """Ключ → файл + метаданные в каталоге, суммарно не больше max_bytes"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._written = None  # None - размер каталога еще не проверяли
+        self._lock = threading.Lock()
+
+    def _paths(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, digest[:2], digest)
+        return base + '.bin', base + '.json'
+
+    # ===== ЧТЕНИЕ =====
+
+    def get(self, key):
+        """(путь к файлу, метаданные) или None"""
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            os.utime(data_path)  # отметка использования для LRU
+        except (OSError, ValueError):
+            return None
+        return data_path, meta
+
+    def read(self, key):
+        """(байты, метаданные) или None"""
+        cached = self.get(key)
+        if cached is None:
+            return None
+        try:
+            with open(cached[0], 'rb') as f:
+                return f.read(), cached[1]
+        except OSError:
+            return None
+
+    # ===== ЗАПИСЬ =====
+
+    def _write_atomic(self, path, payload):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def put(self, key, data, meta=None):
+        """Сохраняет байты и метаданные; путь к файлу или None при ошибке диска"""
+        data_path, meta_path = self._paths(key)
+        try:
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            self._write_atomic(data_path, data)
+            self._write_atomic(meta_path, json.dumps(meta or {}).encode('utf-8'))
+        except OSError as e:
+            print(f"⚠️  [DISK CACHE] Запись в {self.directory}: {e}")
+            return None
+
+        self._after_write(len(data))
+        return data_path
+
+    def update_meta(self, key, meta):
+        """Только метаданные (например, checked_at после ревалидации)"""
+        _, meta_path = self._paths(key)
+        try:
+            self._write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+        except OSError as e:
+            print(f"⚠️  [DISK CACHE] Метаданные {self.directory}: {e}")
+
+    def delete(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # ===== ВЫТЕСНЕНИЕ =====
+
+    def _after_write(self, size):
+        with self._lock:
+            if self._written is not None:
+                self._written += size
+                if self._written < self.max_bytes * 0.05:
+                    return
+            self._written = 0
+        self.evict()
+
+    def evict(self):
+        """Удаляет самые давно использованные файлы, пока каталог больше лимита"""
+        lock_path = os.path.join(self.directory, '.lock')
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(lock_path, 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    return self._evict_locked()
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        except OSError as e:
+            print(f"⚠️  [DISK CACHE] Очистка {self.directory}: {e}")
+            return 0
+
+    def _evict_locked(self):
+        files = []
+        total = 0
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith('.bin'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+        if total <= self.max_bytes:
+            return 0
+
+        started = time.perf_counter()
+        target = self.max_bytes * EVICT_TARGET
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            for victim in (path, path[:-len('.bin')] + '.json'):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+
+        print(f"🧹 [DISK CACHE] {self.directory}: удалено {removed} файлов "
+              f"за {(time.perf_counter() - started) * 1000:.0f}мс, осталось {total / 1024 / 1024:.1f} МБ")
+        return removed
@@ -192,6 +192,7 @@ class ProductImage(Base):
     image_url = Column(String(1000), nullable=True, comment="URL изображения (если онлайн)")
     local_path = Column(String(1000), nullable=True, comment="Локальный путь к файлу")
     image_filename = Column(String(500), nullable=True, comment="Имя файла изображения")
+    image_hash = Column(String(64), nullable=True, comment="BLAKE2b-хеш содержимого (имя blob'а в хранилище)")
     
     # Позиция в исходной таблице
     sheet_name = Column(String(200), nullable=True, comment="Название листа Excel")
@@ -250,3 +251,4 @@ Index('idx_price_offers_table_id', PriceOffer.table_id)
 Index('idx_product_images_product', ProductImage.product_id)
 Index('idx_product_images_main', ProductImage.is_main_image)
 Index('idx_product_images_table_id', ProductImage.table_id)
+Index('idx_product_images_hash', ProductImage.image_hash)
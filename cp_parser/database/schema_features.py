@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Какие миграции применены к БД - проверка один раз на процесс
+
+Веб-интерфейс и парсеры работают и до миграций (прежние запросы), и после
+(таблицы product_listing / project_stats, числовые колонки офферов,
+search_vector, image_hash). Каждая такая проверка - один запрос к схеме при
+первом обращении, дальше - значение из общего кэша процесса.
+
+Использование:
+    if schema_feature(session, 'product_listing',
+                      "SELECT to_regclass('product_listing') IS NOT NULL",
+                      missing="[LISTING] product_listing нет - подзапросы "
+                              "(запустите database/create_product_listing.py)"):
+        ...
+
+name - ключ кэша: одинаковые проверки разных модулей (например, числовые
+колонки price_offers в bulk_writer и product_listing) выполняются один раз.
+"""
+
+from sqlalchemy import text
+
+# name → bool
+_features = {}
+
+# Проверки, общие для нескольких модулей (одинаковый name - одинаковый SQL)
+NUMERIC_OFFERS_SQL = """
+    SELECT COUNT(*) = 3 FROM information_schema.columns
+    WHERE table_name = 'price_offers'
+    AND column_name IN ('quantity_num', 'price_usd_num', 'price_rub_num')
+"""
+
+
+def schema_feature(session, name, sql, params=None, missing=None):
+    """
+    Результат проверки sql (scalar → bool), кэшируется по name.
+    missing - сообщение в лог, если миграции нет (печатается один раз)
+    """
+    if name not in _features:
+        _features[name] = bool(session.execute(text(sql), params or {}).scalar())
+        if not _features[name] and missing:
+            print(f"⚠️  {missing}")
+    return _features[name]
+
+
+def reset_schema_features(*names):
+    """Забыть результаты (все, если names не заданы) - после применения миграции"""
+    if names:
+        for name in names:
+            _features.pop(name, None)
+    else:
+        _features.clear()
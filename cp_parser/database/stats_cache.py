@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Общий кэш статистики в локальном SQLite-файле
+
+Кэш в памяти процесса у каждого воркера gunicorn свой: 4 воркера = 4 холодных
+подсчета и 4 разных значения. Файл SQLite виден всем воркерам и парсерам
+на том же хосте:
+- веб-интерфейс читает/кладет значения с TTL (dashboard_stats.py)
+- парсеры после записи проекта сбрасывают статистику (ProjectBulkWriter.flush)
+- результаты поиска по изображению (web_interface/image_search_results.py)
+
+Парсер на другом хосте файл не видит - там значение обновится по TTL.
+Любая ошибка SQLite = промах кэша: страница считается из БД, а не падает.
+
+Путь: STATS_CACHE_PATH (по умолчанию <tmp>/cp_parser_stats_cache.sqlite3)
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+STATS_CACHE_PATH = os.getenv(
+    'STATS_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'cp_parser_stats_cache.sqlite3')
+)
+
+# Ключ статистики главной страницы и /api/stats
+DASHBOARD_STATS_KEY = 'dashboard_stats'
+
+
+class SharedStatsCache:
+    """Ключ → JSON-значение с временем жизни, общий для процессов хоста"""
+
+    def __init__(self, path=STATS_CACHE_PATH):
+        self.path = path
+
+    def _connect(self):
+        # Соединение на каждый вызов: безопасно после fork воркеров gunicorn
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        return conn
+
+    def get(self, key):
+        """Значение или None (нет, протухло, ошибка)"""
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT value FROM stats_cache WHERE key = ? AND expires_at > ?",
+                    (key, time.time())
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️  [STATS CACHE] Чтение {self.path}: {e}")
+            return None
+
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    # Протухшие ключи (разовые, например результаты поиска) не копятся
+                    conn.execute("DELETE FROM stats_cache WHERE expires_at <= ?", (time.time(),))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO stats_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value), time.time() + ttl)
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️  [STATS CACHE] Запись {self.path}: {e}")
+
+    def invalidate(self, key=None):
+        """Сбрасывает ключ (None - весь кэш)"""
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    if key is None:
+                        conn.execute("DELETE FROM stats_cache")
+                    else:
+                        conn.execute("DELETE FROM stats_cache WHERE key = ?", (key,))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️  [STATS CACHE] Сброс {self.path}: {e}")
+
+
+stats_cache = SharedStatsCache()
+
+
+def invalidate_dashboard_stats():
+    """Вызывается парсерами после записи проекта"""
+    stats_cache.invalidate(DASHBOARD_STATS_KEY)
@@ -0,0 +1,163 @@
+"""
+Данные КП (kp_items) для генераторов PDF / Excel / Google Sheets и /api/kp
+
+Раньше каждый генератор сначала выбирал строки КП, а потом делал по запросу
+product_images на каждый товар (LIMIT 3 / LIMIT 5) - N+1 запросов, и у каждого
+генератора своя копия SQL и своя (или никакая) замена FTP-ссылок на S3.
+
+Теперь один запрос: строки КП + товар + вариант цены, а первые N изображений
+каждого товара - array_agg по LATERAL-подзапросу (один раз на товар, а не на
+каждую строку КП). Порядок изображений прежний: сначала колонка 1 (основное), потом по id.
+
+Использование:
+    products = get_kp_products(db_session, session_id, image_limit=5)   # генераторы
+    rows = fetch_kp_rows(db_session, session_id, image_limit=1, order='added')  # /api/kp
+"""
+
+from sqlalchemy import text
+
+S3_BUCKET_URL = 'https://s3.ru1.storage.beget.cloud/73d16f7545b3-promogoods'
+S3_IMAGES_URL = f'{S3_BUCKET_URL}/images/'
+
+# Сортировка строк КП: генераторы - по названию и тиражу, /api/kp - последние добавленные сверху
+ORDERS = {
+    'name': 'p.name, po.quantity',
+    'added': 'ki.added_at DESC',
+}
+
+KP_ROWS_SQL = """
+    WITH kp_products AS (
+        SELECT DISTINCT product_id FROM kp_items WHERE session_id = :session_id
+    ),
+    kp_images AS (
+        SELECT kp.product_id, top.image_urls, top.image_filenames
+        FROM kp_products kp
+        CROSS JOIN LATERAL (
+            SELECT array_agg(pi.image_url ORDER BY pi.main_first, pi.id) as image_urls,
+                   array_agg(pi.image_filename ORDER BY pi.main_first, pi.id) as image_filenames
+            FROM (
+                SELECT id, image_url, image_filename,
+                       CASE WHEN column_number = 1 THEN 0 ELSE 1 END as main_first
+                FROM product_images
+                WHERE product_id = kp.product_id
+                AND (image_url IS NOT NULL OR image_filename IS NOT NULL)
+                ORDER BY main_first, id
+                LIMIT :image_limit
+            ) pi
+        ) top
+    )
+    SELECT
+        ki.id as kp_item_id,
+        ki.quantity as kp_quantity,
+        ki.added_at,
+        p.id as product_id,
+        p.name as product_name,
+        p.description,
+        p.sample_price,
+        p.sample_delivery_time,
+        p.custom_field,
+        po.id as price_offer_id,
+        po.quantity,
+        po.route,
+        po.price_usd,
+        po.price_rub,
+        po.delivery_time_days,
+        im.image_urls,
+        im.image_filenames
+    FROM kp_items ki
+    JOIN products p ON p.id = ki.product_id
+    JOIN price_offers po ON po.id = ki.price_offer_id
+    LEFT JOIN kp_images im ON im.product_id = p.id
+    WHERE ki.session_id = :session_id
+    ORDER BY {order}
+"""
+
+
+def safe_float(value):
+    """
+    Безопасное преобразование в float
+    Обрабатывает случаи: None, пустые строки, '9.7 / 9.4' (берет первое значение)
+    """
+    if value is None or value == '':
+        return None
+
+    try:
+        # Если строка содержит '/' - берем первое значение
+        if isinstance(value, str) and '/' in value:
+            value = value.split('/')[0].strip()
+
+        return float(value)
+    except (ValueError, TypeError) as e:
+        print(f"⚠️  [PRICE PARSE] Не удалось преобразовать '{value}' в float: {e}")
+        return None
+
+
+def normalize_image_url(image_url, image_filename=None):
+    """URL изображения в S3: image_url или images/<image_filename>, FTP-ссылки → S3"""
+    if not image_url and image_filename:
+        return f"{S3_IMAGES_URL}{image_filename}"
+    if not image_url:
+        return None
+
+    # 1. Домен: ftp.ru1.storage.beget.cloud → s3.ru1.storage.beget.cloud
+    if 'ftp.ru1.storage.beget.cloud' in image_url:
+        return image_url.replace('ftp.ru1.storage.beget.cloud', 's3.ru1.storage.beget.cloud')
+
+    # 2. Протокол ftp://
+    if image_url.lower().startswith('ftp://'):
+        if 'ftp.promogoods.website' in image_url:
+            return f"{S3_BUCKET_URL}{image_url.split('ftp.promogoods.website')[-1]}"
+        return image_url.replace('ftp://', f'{S3_BUCKET_URL}/')
+
+    return image_url
+
+
+def fetch_kp_rows(db_session, session_id, image_limit=5, order='name'):
+    """Строки КП (одна на вариант цены) с первыми image_limit изображениями товара - один запрос"""
+    result = db_session.execute(
+        text(KP_ROWS_SQL.format(order=ORDERS[order])),
+        {'session_id': session_id, 'image_limit': image_limit}
+    )
+
+    rows = []
+    for row in result.mappings():
+        row = dict(row)
+        urls = row.pop('image_urls') or []
+        filenames = row.pop('image_filenames') or []
+        images = [normalize_image_url(url, filename) for url, filename in zip(urls, filenames)]
+        row['images'] = [url for url in images if url]
+        rows.append(row)
+    return rows
+
+
+def get_kp_products(db_session, session_id, image_limit=5):
+    """
+    Товары КП для генераторов: {product_id: {'info': {...}, 'offers': [...], 'images': [url, ...]}}
+    в порядке названий, варианты цены - по тиражу
+    """
+    products = {}
+
+    for row in fetch_kp_rows(db_session, session_id, image_limit=image_limit):
+        product = products.get(row['product_id'])
+        if product is None:
+            product = products[row['product_id']] = {
+                'info': {
+                    'name': row['product_name'],
+                    'description': row['description'],
+                    'sample_price': safe_float(row['sample_price']),
+                    'sample_delivery_time': row['sample_delivery_time'],
+                    'custom_field': row['custom_field']  # Дизайн/кастомизация
+                },
+                'offers': [],
+                'images': row['images']
+            }
+
+        product['offers'].append({
+            'quantity': row['quantity'],
+            'route': row['route'],
+            'price_usd': safe_float(row['price_usd']),
+            'price_rub': safe_float(row['price_rub']),
+            'delivery_days': row['delivery_time_days']
+        })
+
+    return products
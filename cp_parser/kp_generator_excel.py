@@ -7,7 +7,6 @@ import os
 from pathlib import Path
 import sys
 from datetime import datetime
-from collections import defaultdict
 
 # Добавляем путь к модулям проекта
 sys.path.append(str(Path(__file__).parent))
@@ -16,13 +15,17 @@ from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.drawing.image import Image as XLImage
 from openpyxl.utils import get_column_letter
-import requests
 from io import BytesIO
-from PIL import Image as PILImage
 
 from database.postgresql_manager import PostgreSQLManager
+from kp_images import ImageRequest, download, prefetch_images, prepare_image
+from kp_data import get_kp_products
 from sqlalchemy import text
 
+# Размер изображений в ячейках (пиксели): основное и дополнительные
+MAIN_IMAGE_SIZE = (150, 150)
+ADDITIONAL_IMAGE_SIZE = (100, 100)
+
 
 class KPExcelGenerator:
     """Генератор Excel файлов для коммерческого предложения"""
@@ -50,117 +53,26 @@ class KPExcelGenerator:
         self.left_alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
     
     def get_kp_items(self, session_id):
-        """Получает товары из КП и группирует по product_id"""
+        """Получает товары из КП, сгруппированные по product_id (один запрос, см. kp_data.py)"""
         
         db_session = self.db_manager.get_session_direct()
         
         try:
-            result = db_session.execute(text("""
-                SELECT 
-                    ki.id as kp_item_id,
-                    p.id as product_id,
-                    p.name as product_name,
-                    p.description,
-                    p.sample_price,
-                    p.sample_delivery_time,
-                    po.id as price_offer_id,
-                    po.quantity,
-                    po.route,
-                    po.price_usd,
-                    po.price_rub,
-                    po.delivery_time_days
-                FROM kp_items ki
-                JOIN products p ON p.id = ki.product_id
-                JOIN price_offers po ON po.id = ki.price_offer_id
-                WHERE ki.session_id = :session_id
-                ORDER BY p.name, po.quantity
-            """), {'session_id': session_id})
-            
-            # Группируем по product_id
-            products_grouped = defaultdict(lambda: {
-                'info': None,
-                'offers': [],
-                'images': []
-            })
-            
-            for row in result:
-                product_id = row[1]
-                
-                # Информация о товаре (заполняем один раз)
-                if products_grouped[product_id]['info'] is None:
-                    products_grouped[product_id]['info'] = {
-                        'name': row[2],
-                        'description': row[3],
-                        'sample_price': float(row[4]) if row[4] else None,
-                        'sample_delivery_time': row[5]
-                    }
-                
-                # Добавляем ценовое предложение
-                products_grouped[product_id]['offers'].append({
-                    'quantity': row[7],
-                    'route': row[8],
-                    'price_usd': float(row[9]) if row[9] else None,
-                    'price_rub': float(row[10]) if row[10] else None,
-                    'delivery_days': row[11]
-                })
-            
-            # Получаем все изображения для каждого товара
-            for product_id in products_grouped.keys():
-                img_result = db_session.execute(text("""
-                    SELECT image_url, image_filename
-                    FROM product_images
-                    WHERE product_id = :product_id
-                    AND (image_url IS NOT NULL OR image_filename IS NOT NULL)
-                    ORDER BY CASE WHEN column_number = 1 THEN 0 ELSE 1 END, id
-                    LIMIT 5
-                """), {'product_id': product_id})
-                
-                for img_row in img_result:
-                    image_url = img_row[0]
-                    if not image_url and img_row[1]:
-                        image_url = f"https://s3.ru1.storage.beget.cloud/73d16f7545b3-promogoods/images/{img_row[1]}"
-                    
-                    if image_url:
-                        products_grouped[product_id]['images'].append(image_url)
-            
-            return products_grouped
+            return get_kp_products(db_session, session_id, image_limit=5)
         finally:
             db_session.close()
     
-    def download_image(self, url, max_size=(150, 150)):
-        """Скачивает и подготавливает изображение для Excel"""
+    def download_image(self, url, max_size=MAIN_IMAGE_SIZE):
+        """Скачивает и подготавливает одно изображение для Excel (для КП - prefetch_images)"""
         
         if not url:
             return None
         
+        data = download(url)
+        if data is None:
+            return None
         try:
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                # Открываем изображение
-                img = PILImage.open(BytesIO(response.content))
-                
-                # Конвертируем в RGB если нужно
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    background = PILImage.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                    img = background
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Resize с сохранением пропорций
-                img.thumbnail(max_size, PILImage.Resampling.LANCZOS)
-                
-                # Сохраняем в BytesIO
-                img_byte_arr = BytesIO()
-                img.save(img_byte_arr, format='PNG')
-                img_byte_arr.seek(0)
-                
-                return img_byte_arr
-            else:
-                print(f"⚠️  Не удалось загрузить изображение: {url} (статус {response.status_code})")
-                return None
+            return BytesIO(prepare_image(data, 'PNG', max_size).data)
         except Exception as e:
             print(f"⚠️  Ошибка загрузки изображения {url}: {e}")
             return None
@@ -216,6 +128,15 @@ class KPExcelGenerator:
         date_cell.alignment = self.center_alignment
         current_row += 2
         
+        # Все изображения КП - параллельно, до заполнения листа (см. kp_images.py)
+        image_requests = []
+        for product_data in products.values():
+            images = product_data['images']
+            if images:
+                image_requests.append(ImageRequest(images[0], 'PNG', MAIN_IMAGE_SIZE))
+            image_requests.extend(ImageRequest(url, 'PNG', ADDITIONAL_IMAGE_SIZE) for url in images[1:5])
+        prepared_images = prefetch_images(image_requests)
+        
         # Генерируем товары
         for product_id, product_data in products.items():
             product_info = product_data['info']
@@ -318,8 +239,9 @@ class KPExcelGenerator:
             # Вставляем изображения
             # Основное изображение (колонка A)
             if images and len(images) > 0:
-                img_data = self.download_image(images[0])
-                if img_data:
+                prepared = prepared_images.get(ImageRequest(images[0], 'PNG', MAIN_IMAGE_SIZE))
+                if prepared:
+                    img_data = BytesIO(prepared.data)
                     try:
                         img = XLImage(img_data)
                         img.width = 130
@@ -337,8 +259,9 @@ class KPExcelGenerator:
                 if idx >= len(image_columns):
                     break
                 
-                img_data = self.download_image(img_url, max_size=(100, 100))
-                if img_data:
+                prepared = prepared_images.get(ImageRequest(img_url, 'PNG', ADDITIONAL_IMAGE_SIZE))
+                if prepared:
+                    img_data = BytesIO(prepared.data)
                     try:
                         img = XLImage(img_data)
                         img.width = 90
@@ -8,13 +8,17 @@ import sys
 import json
 from pathlib import Path
 from datetime import datetime
-from collections import defaultdict
 
 # Добавляем путь к модулям проекта
 sys.path.append(str(Path(__file__).parent.parent))
 
 from database.postgresql_manager import PostgreSQLManager
-from sqlalchemy import text
+from kp_images import public_thumbnail_url
+from kp_data import get_kp_products
+
+# Ширина превью для =IMAGE() (через прокси веб-интерфейса, см. kp_images.public_thumbnail_url)
+MAIN_IMAGE_WIDTH = 640
+ADDITIONAL_IMAGE_WIDTH = 320
 
 # Google Sheets API
 try:
@@ -28,25 +32,6 @@ except ImportError:
     print("⚠️  [Google Sheets] google-auth и google-api-python-client не установлены")
 
 
-def safe_float(value):
-    """
-    Безопасное преобразование в float
-    Обрабатывает случаи: None, пустые строки, '9.7 / 9.4' (берет первое значение)
-    """
-    if value is None or value == '':
-        return None
-    
-    try:
-        # Если строка содержит '/' - берем первое значение
-        if isinstance(value, str) and '/' in value:
-            value = value.split('/')[0].strip()
-        
-        return float(value)
-    except (ValueError, TypeError) as e:
-        print(f"⚠️  [PRICE PARSE] Не удалось преобразовать '{value}' в float: {e}")
-        return None
-
-
 class KPGoogleSheetsGenerator:
     """Генератор Google Sheets файлов для коммерческого предложения"""
     
@@ -194,108 +179,12 @@ class KPGoogleSheetsGenerator:
             traceback.print_exc()
     
     def get_kp_items(self, session_id):
-        """Получает товары из КП и группирует по product_id"""
+        """Получает товары из КП, сгруппированные по product_id (один запрос, см. kp_data.py)"""
         
         db_session = self.db_manager.get_session_direct()
         
         try:
-            result = db_session.execute(text("""
-                SELECT 
-                    ki.id as kp_item_id,
-                    p.id as product_id,
-                    p.name as product_name,
-                    p.description,
-                    p.sample_price,
-                    p.sample_delivery_time,
-                    p.custom_field,
-                    po.id as price_offer_id,
-                    po.quantity,
-                    po.route,
-                    po.price_usd,
-                    po.price_rub,
-                    po.delivery_time_days
-                FROM kp_items ki
-                JOIN products p ON p.id = ki.product_id
-                JOIN price_offers po ON po.id = ki.price_offer_id
-                WHERE ki.session_id = :session_id
-                ORDER BY p.name, po.quantity
-            """), {'session_id': session_id})
-            
-            # Группируем по product_id
-            products_grouped = defaultdict(lambda: {
-                'info': None,
-                'offers': [],
-                'images': []
-            })
-            
-            for row in result:
-                product_id = row[1]
-                
-                # Информация о товаре (заполняем один раз)
-                if products_grouped[product_id]['info'] is None:
-                    products_grouped[product_id]['info'] = {
-                        'name': row[2],
-                        'description': row[3],
-                        'sample_price': safe_float(row[4]),
-                        'sample_delivery_time': row[5],
-                        'custom_field': row[6]  # Дизайн/кастомизация
-                    }
-                
-                # Добавляем ценовое предложение
-                # row[7] = price_offer_id, row[8] = quantity, row[9] = route, 
-                # row[10] = price_usd, row[11] = price_rub, row[12] = delivery_time_days
-                products_grouped[product_id]['offers'].append({
-                    'quantity': row[8],
-                    'route': row[9],
-                    'price_usd': safe_float(row[10]),
-                    'price_rub': safe_float(row[11]),
-                    'delivery_days': row[12]
-                })
-            
-            # Получаем все изображения для каждого товара
-            for product_id in products_grouped.keys():
-                img_result = db_session.execute(text("""
-                    SELECT image_url, image_filename
-                    FROM product_images
-                    WHERE product_id = :product_id
-                    AND (image_url IS NOT NULL OR image_filename IS NOT NULL)
-                    ORDER BY CASE WHEN column_number = 1 THEN 0 ELSE 1 END, id
-                    LIMIT 5
-                """), {'product_id': product_id})
-                
-                for img_row in img_result:
-                    image_url = img_row[0]
-                    original_url = image_url  # Сохраняем оригинальный URL для логирования
-                    
-                    if not image_url and img_row[1]:
-                        image_url = f"https://s3.ru1.storage.beget.cloud/73d16f7545b3-promogoods/images/{img_row[1]}"
-                    
-                    # ИСПРАВЛЕНИЕ: Заменяем FTP на S3
-                    if image_url:
-                        replaced = False
-                        
-                        # 1. Проверка домена: ftp.ru1.storage.beget.cloud → s3.ru1.storage.beget.cloud
-                        if 'ftp.ru1.storage.beget.cloud' in image_url:
-                            image_url = image_url.replace('ftp.ru1.storage.beget.cloud', 's3.ru1.storage.beget.cloud')
-                            replaced = True
-                        
-                        # 2. Проверка протокола: ftp://
-                        elif image_url.lower().startswith('ftp://'):
-                            if 'ftp.promogoods.website' in image_url:
-                                path = image_url.split('ftp.promogoods.website')[-1]
-                                image_url = f"https://s3.ru1.storage.beget.cloud/73d16f7545b3-promogoods{path}"
-                            else:
-                                image_url = image_url.replace('ftp://', 'https://s3.ru1.storage.beget.cloud/73d16f7545b3-promogoods/')
-                            replaced = True
-                        
-                        if replaced:
-                            print(f"      🔄 FTP → S3:")
-                            print(f"         Было: {original_url}")
-                            print(f"         Стало: {image_url}")
-                        
-                        products_grouped[product_id]['images'].append(image_url)
-            
-            return products_grouped
+            return get_kp_products(db_session, session_id, image_limit=5)
         finally:
             db_session.close()
     
@@ -355,7 +244,7 @@ class KPGoogleSheetsGenerator:
             
             # Подготовка данных
             # ФОТО: параметр 1 = сохранять пропорции (не искажать)
-            main_image = f'=IMAGE("{images[0]}"; 1)' if images else ''
+            main_image = f'=IMAGE("{public_thumbnail_url(images[0], MAIN_IMAGE_WIDTH)}"; 1)' if images else ''
             
             # ДИЗАЙН - текстовое поле из БД (custom_field)
             design_text = product_info.get('custom_field') or '-'
@@ -380,9 +269,9 @@ class KPGoogleSheetsGenerator:
             sample_text = ' | '.join(sample_info) if sample_info else '-'
             
             # Дополнительные фото (2-3-4-5 изображения) - ГОРИЗОНТАЛЬНО в разных колонках
-            additional_photo_1 = f'=IMAGE("{images[1]}"; 1)' if len(images) > 1 else ''
-            additional_photo_2 = f'=IMAGE("{images[2]}"; 1)' if len(images) > 2 else ''
-            additional_photo_3 = f'=IMAGE("{images[3]}"; 1)' if len(images) > 3 else ''
+            additional_photo_1 = f'=IMAGE("{public_thumbnail_url(images[1], ADDITIONAL_IMAGE_WIDTH)}"; 1)' if len(images) > 1 else ''
+            additional_photo_2 = f'=IMAGE("{public_thumbnail_url(images[2], ADDITIONAL_IMAGE_WIDTH)}"; 1)' if len(images) > 2 else ''
+            additional_photo_3 = f'=IMAGE("{public_thumbnail_url(images[3], ADDITIONAL_IMAGE_WIDTH)}"; 1)' if len(images) > 3 else ''
             
             # Запоминаем начальную строку для merge
             start_row = current_row
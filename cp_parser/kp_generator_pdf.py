@@ -4,10 +4,11 @@
 """
 
 import os
+import itertools
 from pathlib import Path
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from collections import defaultdict
 
 # Добавляем путь к модулям проекта
 sys.path.append(str(Path(__file__).parent))
@@ -21,11 +22,11 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.utils import ImageReader
-import requests
 from io import BytesIO
-from PIL import Image as PILImage
 
 from database.postgresql_manager import PostgreSQLManager
+from kp_images import ImageRequest, download, prefetch_images, prepare_image
+from kp_data import get_kp_products
 from sqlalchemy import text
 
 
@@ -52,6 +53,35 @@ if _FONT_PATHS and _FONT_PATHS[0]:
 else:
     print("⚠️  [PDF] Встроенный шрифт не найден - кириллица не будет работать")
 
+# Разрешение изображений в PDF (пикселей на дюйм при заданной ширине в мм)
+IMAGE_DPI = 300
+
+# Потоковая сборка PDF (KPPDFGenerator.render) и сколько товаров в одном блоке предзагрузки изображений
+KP_PDF_STREAMING = os.getenv('KP_PDF_STREAMING', 'True').lower() == 'true'
+KP_PDF_CHUNK_SIZE = int(os.getenv('KP_PDF_CHUNK_SIZE', 20))
+
+
+class StreamingStory(list):
+    """
+    Story для doc.build, которая наполняется по мере верстки
+    
+    ReportLab берет flowables[0] и удаляет его после размещения на странице.
+    Когда список пуст, из sections берется следующая секция (список flowables) -
+    в памяти только текущий товар, а не весь КП.
+    """
+    
+    def __init__(self, *sections):
+        super().__init__()
+        self._sections = itertools.chain(*sections)
+    
+    def __len__(self):
+        while not list.__len__(self):
+            section = next(self._sections, None)
+            if section is None:
+                break
+            self.extend(section)
+        return list.__len__(self)
+
 
 class KPPDFGenerator:
     """Генератор PDF файлов для коммерческого предложения"""
@@ -179,127 +209,48 @@ class KPPDFGenerator:
         )
     
     def get_kp_items(self, session_id):
-        """Получает товары из КП и группирует по product_id"""
+        """Получает товары из КП, сгруппированные по product_id (один запрос, см. kp_data.py)"""
         
         db_session = self.db_manager.get_session_direct()
         
         try:
-            result = db_session.execute(text("""
-                SELECT 
-                    ki.id as kp_item_id,
-                    p.id as product_id,
-                    p.name as product_name,
-                    p.description,
-                    p.sample_price,
-                    p.sample_delivery_time,
-                    po.id as price_offer_id,
-                    po.quantity,
-                    po.route,
-                    po.price_usd,
-                    po.price_rub,
-                    po.delivery_time_days
-                FROM kp_items ki
-                JOIN products p ON p.id = ki.product_id
-                JOIN price_offers po ON po.id = ki.price_offer_id
-                WHERE ki.session_id = :session_id
-                ORDER BY p.name, po.quantity
-            """), {'session_id': session_id})
-            
-            # Группируем по product_id
-            products_grouped = defaultdict(lambda: {
-                'info': None,
-                'offers': [],
-                'images': []
-            })
-            
-            for row in result:
-                product_id = row[1]
-                
-                # Информация о товаре (заполняем один раз)
-                if products_grouped[product_id]['info'] is None:
-                    products_grouped[product_id]['info'] = {
-                        'name': row[2],
-                        'description': row[3],
-                        'sample_price': float(row[4]) if row[4] else None,
-                        'sample_delivery_time': row[5]
-                    }
-                
-                # Добавляем ценовое предложение
-                products_grouped[product_id]['offers'].append({
-                    'quantity': row[7],
-                    'route': row[8],
-                    'price_usd': float(row[9]) if row[9] else None,
-                    'price_rub': float(row[10]) if row[10] else None,
-                    'delivery_days': row[11]
-                })
-            
-            # Получаем изображения для каждого товара
-            for product_id in products_grouped.keys():
-                img_result = db_session.execute(text("""
-                    SELECT image_url, image_filename
-                    FROM product_images
-                    WHERE product_id = :product_id
-                    AND (image_url IS NOT NULL OR image_filename IS NOT NULL)
-                    ORDER BY CASE WHEN column_number = 1 THEN 0 ELSE 1 END, id
-                    LIMIT 3
-                """), {'product_id': product_id})
-                
-                for img_row in img_result:
-                    image_url = img_row[0]
-                    if not image_url and img_row[1]:
-                        image_url = f"https://s3.ru1.storage.beget.cloud/73d16f7545b3-promogoods/images/{img_row[1]}"
-                    
-                    if image_url:
-                        products_grouped[product_id]['images'].append(image_url)
-            
-            return products_grouped
+            return get_kp_products(db_session, session_id, image_limit=3)
         finally:
             db_session.close()
     
+    def image_request(self, url, max_width=80):
+        """Запрос изображения шириной max_width мм (300 dpi - больше пикселей в PDF не нужно)"""
+        width_px = int(max_width / 25.4 * IMAGE_DPI)
+        return ImageRequest(url, 'JPEG', (width_px, width_px * 3))
+    
+    def make_rl_image(self, prepared, max_width=80):
+        """RLImage с адаптивной высотой (сохраняем пропорции) из подготовленного изображения"""
+        if prepared is None:
+            return None
+        
+        aspect_ratio = prepared.height / prepared.width
+        target_width = max_width * mm
+        target_height = target_width * aspect_ratio
+        
+        return RLImage(BytesIO(prepared.data), width=target_width, height=target_height)
+    
     def download_image(self, url, max_width=80):
-        """Скачивает и подготавливает изображение для PDF"""
+        """Скачивает и подготавливает одно изображение для PDF (для КП - prefetch_images)"""
         
         if not url:
             return None
         
+        data = download(url)
+        if data is None:
+            return None
         try:
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                # Открываем изображение
-                img = PILImage.open(BytesIO(response.content))
-                
-                # Конвертируем в RGB если нужно
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    background = PILImage.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                    img = background
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Сохраняем в BytesIO
-                img_byte_arr = BytesIO()
-                img.save(img_byte_arr, format='JPEG', quality=85)
-                img_byte_arr.seek(0)
-                
-                # Создаем RLImage с адаптивной высотой (сохраняем пропорции)
-                original_width, original_height = img.size
-                aspect_ratio = original_height / original_width
-                
-                target_width = max_width * mm
-                target_height = target_width * aspect_ratio
-                
-                rl_img = RLImage(img_byte_arr, width=target_width, height=target_height)
-                return rl_img
-            else:
-                print(f"⚠️  Не удалось загрузить изображение: {url} (статус {response.status_code})")
-                return None
+            request = self.image_request(url, max_width)
+            return self.make_rl_image(prepare_image(data, request.format, request.max_size), max_width)
         except Exception as e:
             print(f"⚠️  Ошибка загрузки изображения {url}: {e}")
             return None
     
-    def generate(self, session_id, output_path=None):
+    def generate(self, session_id, output_path=None, streaming=None):
         """Генерирует PDF файл коммерческого предложения"""
         
         print("📄 [KP PDF] Начинаю генерацию PDF...")
@@ -313,6 +264,19 @@ class KPPDFGenerator:
         print(f"   Найдено товаров: {len(products)}")
         print(f"   Общее количество предложений: {sum(len(p['offers']) for p in products.values())}")
         
+        return self.render(products, output_path, streaming)
+    
+    def render(self, products, output_path=None, streaming=None):
+        """
+        PDF из товаров КП (формат get_kp_products)
+        streaming=True - потоковая сборка (по умолчанию KP_PDF_STREAMING):
+        изображения предзагружаются блоками по KP_PDF_CHUNK_SIZE товаров, а секции
+        товаров создаются по мере верстки и освобождаются после отрисовки страницы.
+        streaming=False - прежняя сборка: все изображения и вся story в памяти до doc.build.
+        """
+        if streaming is None:
+            streaming = KP_PDF_STREAMING
+        
         # Создание PDF
         if output_path is None:
             output_dir = Path(__file__).parent / 'output'
@@ -328,152 +292,195 @@ class KPPDFGenerator:
             bottomMargin=20*mm
         )
         
-        # Элементы документа
-        story = []
-        
         # Заголовок
-        story.append(Paragraph('КОММЕРЧЕСКОЕ ПРЕДЛОЖЕНИЕ', self.title_style))
-        story.append(Paragraph(f'от {datetime.now().strftime("%d.%m.%Y")}', self.date_style))
-        story.append(Spacer(1, 10*mm))
-        
-        # Генерируем товары
-        for idx, (product_id, product_data) in enumerate(products.items()):
-            product_info = product_data['info']
-            offers = product_data['offers']
+        header = [
+            Paragraph('КОММЕРЧЕСКОЕ ПРЕДЛОЖЕНИЕ', self.title_style),
+            Paragraph(f'от {datetime.now().strftime("%d.%m.%Y")}', self.date_style),
+            Spacer(1, 10*mm),
+        ]
+        
+        if streaming:
+            story = StreamingStory([header], self.iter_product_sections(products))
+        else:
+            # Все изображения КП - параллельно, до построения документа (см. kp_images.py)
+            prepared_images = prefetch_images(self.image_requests(products.values()))
+            story = list(header)
+            for idx, product_data in enumerate(products.values()):
+                story.extend(self.product_section(product_data, prepared_images, idx + 1 == len(products)))
+        
+        # Сохранение
+        doc.build(story)
+        print(f"✅ [KP PDF] Файл сохранен: {output_path}")
+        
+        return str(output_path)
+    
+    def image_requests(self, products):
+        """Запросы изображений товаров: основное 80 мм + до 4 дополнительных 35 мм"""
+        requests = []
+        for product_data in products:
             images = product_data['images']
-            
-            print(f"   Обрабатываю: {product_info['name']} ({len(offers)} вариантов, {len(images)} изображений)")
-            
-            # Загружаем изображения
-            # Основное изображение (большое, слева)
-            main_image = None
-            if images and len(images) > 0:
-                main_image = self.download_image(images[0], max_width=80)
-            
-            # Дополнительные изображения (маленькие, СЕТКА СПРАВА 2x2)
-            additional_images = []
-            for img_url in images[1:5]:  # До 4 дополнительных
-                img = self.download_image(img_url, max_width=35)
-                if img:
-                    additional_images.append(img)
-            
-            # Создаем блок с изображениями: ОСНОВНОЕ СЛЕВА + СЕТКА СПРАВА
-            if main_image:
-                # Создаем сетку дополнительных изображений (2x2)
-                add_img_grid = None
-                if additional_images:
-                    # Разбиваем на строки по 2 изображения
-                    grid_data = []
-                    for i in range(0, len(additional_images), 2):
-                        row = additional_images[i:i+2]
-                        # Дополняем строку пустыми ячейками если нужно
-                        while len(row) < 2:
-                            row.append('')
-                        grid_data.append(row)
-                    
-                    add_img_grid = Table(grid_data, colWidths=[36*mm, 36*mm])
-                    add_img_grid.setStyle(TableStyle([
-                        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                        ('LEFTPADDING', (0, 0), (-1, -1), 2),
-                        ('RIGHTPADDING', (0, 0), (-1, -1), 2),
-                        ('TOPPADDING', (0, 0), (-1, -1), 2),
-                        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
-                    ]))
+            if images:
+                requests.append(self.image_request(images[0], max_width=80))
+            requests.extend(self.image_request(url, max_width=35) for url in images[1:5])
+        return requests
+    
+    def iter_product_sections(self, products):
+        """
+        Секции товаров для StreamingStory: изображения - блоками по KP_PDF_CHUNK_SIZE
+        товаров; следующий блок скачивается в фоне, пока верстается текущий
+        """
+        items = list(products.values())
+        chunks = [items[i:i + KP_PDF_CHUNK_SIZE] for i in range(0, len(items), KP_PDF_CHUNK_SIZE)]
+        
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='kp-pdf-prefetch') as prefetcher:
+            pending = prefetcher.submit(prefetch_images, self.image_requests(chunks[0])) if chunks else None
+            for chunk_idx, chunk in enumerate(chunks):
+                prepared_images = pending.result()
+                pending = None
+                if chunk_idx + 1 < len(chunks):
+                    pending = prefetcher.submit(prefetch_images, self.image_requests(chunks[chunk_idx + 1]))
+                
+                for idx, product_data in enumerate(chunk):
+                    is_last = chunk_idx + 1 == len(chunks) and idx + 1 == len(chunk)
+                    yield self.product_section(product_data, prepared_images, is_last)
+                
+                # Байты изображений блока остаются только у еще не отрисованных секций
+                prepared_images.clear()
+    
+    def product_section(self, product_data, prepared_images, is_last=False):
+        """Flowables одного товара (1 товар = 1 страница)"""
+        product_info = product_data['info']
+        offers = product_data['offers']
+        images = product_data['images']
+        
+        print(f"   Обрабатываю: {product_info['name']} ({len(offers)} вариантов, {len(images)} изображений)")
+        
+        # Загружаем изображения
+        # Основное изображение (большое, слева)
+        main_image = None
+        if images and len(images) > 0:
+            main_image = self.make_rl_image(
+                prepared_images.get(self.image_request(images[0], max_width=80)), max_width=80
+            )
+        
+        # Дополнительные изображения (маленькие, СЕТКА СПРАВА 2x2)
+        additional_images = []
+        for img_url in images[1:5]:  # До 4 дополнительных
+            img = self.make_rl_image(
+                prepared_images.get(self.image_request(img_url, max_width=35)), max_width=35
+            )
+            if img:
+                additional_images.append(img)
+        
+        # Создаем блок с изображениями: ОСНОВНОЕ СЛЕВА + СЕТКА СПРАВА
+        if main_image:
+            # Создаем сетку дополнительных изображений (2x2)
+            add_img_grid = None
+            if additional_images:
+                # Разбиваем на строки по 2 изображения
+                grid_data = []
+                for i in range(0, len(additional_images), 2):
+                    row = additional_images[i:i+2]
+                    # Дополняем строку пустыми ячейками если нужно
+                    while len(row) < 2:
+                        row.append('')
+                    grid_data.append(row)
                 
-                # Собираем горизонтальную таблицу: основное слева, сетка справа
-                if add_img_grid:
-                    images_cell = Table([[main_image, add_img_grid]], colWidths=[85*mm, 75*mm])
-                else:
-                    images_cell = Table([[main_image, '']], colWidths=[85*mm, 75*mm])
-                    
-                images_cell.setStyle(TableStyle([
+                add_img_grid = Table(grid_data, colWidths=[36*mm, 36*mm])
+                add_img_grid.setStyle(TableStyle([
                     ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 0),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                    ('LEFTPADDING', (0, 0), (-1, -1), 2),
+                    ('RIGHTPADDING', (0, 0), (-1, -1), 2),
+                    ('TOPPADDING', (0, 0), (-1, -1), 2),
+                    ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
                 ]))
-            else:
-                images_cell = None
-            
-            # ВЕРТИКАЛЬНАЯ СТРУКТУРА: изображения → название/описание → таблица
-            product_elements = []
-            
-            # 1. Блок с изображениями (если есть)
-            if images_cell:
-                product_elements.append(images_cell)
-                product_elements.append(Spacer(1, 5*mm))
-            
-            # 2. Название товара
-            product_elements.append(Paragraph(product_info['name'], self.product_style))
-            
-            # 3. Описание
-            if product_info['description']:
-                desc_text = product_info['description'][:250] + ('...' if len(product_info['description']) > 250 else '')
-                product_elements.append(Paragraph(desc_text, self.description_style))
-            
-            # 4. Информация об образце
-            if product_info['sample_price'] or product_info['sample_delivery_time']:
-                sample_parts = []
-                if product_info['sample_price']:
-                    sample_parts.append(f"Образец: ${product_info['sample_price']:.2f}")
-                if product_info['sample_delivery_time']:
-                    sample_parts.append(f"Срок: {product_info['sample_delivery_time']} дн.")
-                product_elements.append(Paragraph(' | '.join(sample_parts), self.sample_style))
-            
-            product_elements.append(Spacer(1, 5*mm))
-            
-            # 5. Таблица ценовых предложений
-            price_table_data = [
-                ['Тираж', 'USD', 'RUB', 'Доставка', 'Срок']
-            ]
-            
-            for offer in offers:
-                price_table_data.append([
-                    f"{offer['quantity']:,.0f} шт",
-                    f"${offer['price_usd']:.2f}" if offer['price_usd'] else '-',
-                    f"₽{offer['price_rub']:.2f}" if offer['price_rub'] else '-',
-                    offer['route'] or '-',
-                    f"{offer['delivery_days']} дн." if offer['delivery_days'] else '-'
-                ])
             
-            price_table = Table(price_table_data, colWidths=[34*mm, 28*mm, 34*mm, 28*mm, 22*mm])
-            price_table.setStyle(TableStyle([
-                # Заголовок (минималистичный серый стиль)
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f3f4f6')),  # Светло-серый фон
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#374151')),   # Темно-серый текст
-                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), self.font_name_bold),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-                ('TOPPADDING', (0, 0), (-1, 0), 8),
+            # Собираем горизонтальную таблицу: основное слева, сетка справа
+            if add_img_grid:
+                images_cell = Table([[main_image, add_img_grid]], colWidths=[85*mm, 75*mm])
+            else:
+                images_cell = Table([[main_image, '']], colWidths=[85*mm, 75*mm])
                 
-                # Данные
-                ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 1), (-1, -1), self.font_name),
-                ('FONTSIZE', (0, 1), (-1, -1), 9),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#e5e7eb')),  # Светло-серая граница
-                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9fafb')]),  # Чередование белый/светло-серый
-                ('TOPPADDING', (0, 1), (-1, -1), 6),
-                ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
+            images_cell.setStyle(TableStyle([
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('LEFTPADDING', (0, 0), (-1, -1), 0),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 0),
             ]))
+        else:
+            images_cell = None
+        
+        # ВЕРТИКАЛЬНАЯ СТРУКТУРА: изображения → название/описание → таблица
+        product_elements = []
+        
+        # 1. Блок с изображениями (если есть)
+        if images_cell:
+            product_elements.append(images_cell)
+            product_elements.append(Spacer(1, 5*mm))
+        
+        # 2. Название товара
+        product_elements.append(Paragraph(product_info['name'], self.product_style))
+        
+        # 3. Описание
+        if product_info['description']:
+            desc_text = product_info['description'][:250] + ('...' if len(product_info['description']) > 250 else '')
+            product_elements.append(Paragraph(desc_text, self.description_style))
+        
+        # 4. Информация об образце
+        if product_info['sample_price'] or product_info['sample_delivery_time']:
+            sample_parts = []
+            if product_info['sample_price']:
+                sample_parts.append(f"Образец: ${product_info['sample_price']:.2f}")
+            if product_info['sample_delivery_time']:
+                sample_parts.append(f"Срок: {product_info['sample_delivery_time']} дн.")
+            product_elements.append(Paragraph(' | '.join(sample_parts), self.sample_style))
+        
+        product_elements.append(Spacer(1, 5*mm))
+        
+        # 5. Таблица ценовых предложений
+        price_table_data = [
+            ['Тираж', 'USD', 'RUB', 'Доставка', 'Срок']
+        ]
+        
+        for offer in offers:
+            price_table_data.append([
+                f"{offer['quantity']:,.0f} шт",
+                f"${offer['price_usd']:.2f}" if offer['price_usd'] else '-',
+                f"₽{offer['price_rub']:.2f}" if offer['price_rub'] else '-',
+                offer['route'] or '-',
+                f"{offer['delivery_days']} дн." if offer['delivery_days'] else '-'
+            ])
+        
+        price_table = Table(price_table_data, colWidths=[34*mm, 28*mm, 34*mm, 28*mm, 22*mm])
+        price_table.setStyle(TableStyle([
+            # Заголовок (минималистичный серый стиль)
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f3f4f6')),  # Светло-серый фон
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#374151')),   # Темно-серый текст
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), self.font_name_bold),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+            ('TOPPADDING', (0, 0), (-1, 0), 8),
             
-            product_elements.append(price_table)
-            
-            # Добавляем все элементы товара в story
-            for elem in product_elements:
-                story.append(elem)
-            
-            story.append(Spacer(1, 10*mm))
-            
-            # Page break после КАЖДОГО товара (1 товар = 1 страница)
-            if idx + 1 < len(products):
-                story.append(PageBreak())
+            # Данные
+            ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 1), (-1, -1), self.font_name),
+            ('FONTSIZE', (0, 1), (-1, -1), 9),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#e5e7eb')),  # Светло-серая граница
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9fafb')]),  # Чередование белый/светло-серый
+            ('TOPPADDING', (0, 1), (-1, -1), 6),
+            ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
+        ]))
         
-        # Сохранение
-        doc.build(story)
-        print(f"✅ [KP PDF] Файл сохранен: {output_path}")
+        product_elements.append(price_table)
         
-        return str(output_path)
+        product_elements.append(Spacer(1, 10*mm))
+        
+        # Page break после КАЖДОГО товара (1 товар = 1 страница)
+        if not is_last:
+            product_elements.append(PageBreak())
+        
+        return product_elements
 
 
 def main():
@@ -0,0 +1,191 @@
+"""
+Предзагрузка изображений для генераторов КП (PDF / Excel) и общий кэш превью
+
+Раньше генератор качал каждое изображение по очереди (requests.get, таймаут 10с)
+прямо во время построения документа: КП на 60 товаров почти все время ждал S3.
+
+Теперь перед построением документа:
+1. все URL изображений КП собираются заранее (ImageRequest: url + формат + размер)
+2. уникальные URL скачиваются параллельно (пул потоков KP_IMAGE_DOWNLOAD_WORKERS,
+   одна requests.Session с пулом соединений)
+3. по мере загрузки каждое изображение декодируется, переводится в RGB
+   (прозрачность - на белый фон), уменьшается и кодируется в нужный формат
+   во втором пуле (KP_IMAGE_DECODE_WORKERS; Pillow отпускает GIL на
+   декодировании и resize)
+4. генератор получает готовые байты (PreparedImage) и только вставляет их
+
+Готовые превью кэшируются на диске (database/disk_cache.py, LRU,
+KP_THUMBNAIL_CACHE_DIR, не больше KP_THUMBNAIL_CACHE_MAX_MB) по ключу
+(URL, формат, размер): повторный КП с теми же товарами собирается без сети.
+Google Sheets вставляет изображения формулой =IMAGE(url) и качает их сам -
+при KP_PUBLIC_BASE_URL он получает превью /images/<файл>?w= из дискового
+кэша прокси веб-интерфейса (public_thumbnail_url), а не оригиналы из S3.
+
+Использование:
+    prepared = prefetch_images([ImageRequest(url, 'JPEG', (945, 945)), ...])
+    image = prepared.get(ImageRequest(url, 'JPEG', (945, 945)))  # None - не загрузилось
+"""
+
+import os
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image as PILImage
+
+from database.disk_cache import DiskLRUCache
+from kp_data import S3_IMAGES_URL
+
+KP_IMAGE_DOWNLOAD_WORKERS = int(os.getenv('KP_IMAGE_DOWNLOAD_WORKERS', 16))
+KP_IMAGE_DECODE_WORKERS = int(os.getenv('KP_IMAGE_DECODE_WORKERS', min(4, os.cpu_count() or 1)))
+KP_IMAGE_TIMEOUT = float(os.getenv('KP_IMAGE_TIMEOUT', 10))
+
+KP_THUMBNAIL_CACHE_DIR = os.getenv('KP_THUMBNAIL_CACHE_DIR',
+                                   str(Path(__file__).parent / 'storage' / 'kp_thumbnails'))
+KP_THUMBNAIL_CACHE_MAX_MB = int(os.getenv('KP_THUMBNAIL_CACHE_MAX_MB', 512))
+
+# Публичный адрес веб-интерфейса (https://...) для превью в Google Sheets; пусто - URL S3 как есть
+KP_PUBLIC_BASE_URL = os.getenv('KP_PUBLIC_BASE_URL', '').rstrip('/')
+
+# url - откуда качать, format - 'JPEG' / 'PNG', max_size - (ш, в) в пикселях или None (без уменьшения)
+ImageRequest = namedtuple('ImageRequest', ['url', 'format', 'max_size'])
+
+# data - готовые байты в нужном формате, width/height - размер в пикселях
+PreparedImage = namedtuple('PreparedImage', ['data', 'width', 'height'])
+
+thumbnail_cache = DiskLRUCache(KP_THUMBNAIL_CACHE_DIR, KP_THUMBNAIL_CACHE_MAX_MB * 1024 * 1024)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Одна сессия на процесс: keep-alive и пул соединений к S3 на все потоки"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=KP_IMAGE_DOWNLOAD_WORKERS)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+    return _session
+
+
+def download(url, timeout=KP_IMAGE_TIMEOUT):
+    """Байты изображения или None"""
+    try:
+        response = get_http_session().get(url, timeout=timeout)
+    except requests.RequestException as e:
+        print(f"⚠️  Ошибка загрузки изображения {url}: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"⚠️  Не удалось загрузить изображение: {url} (статус {response.status_code})")
+        return None
+    return response.content
+
+
+def prepare_image(data, image_format='JPEG', max_size=None):
+    """Байты исходного файла → PreparedImage (RGB на белом фоне, уменьшено, перекодировано)"""
+    img = PILImage.open(BytesIO(data))
+    if max_size:
+        # JPEG декодируется сразу в уменьшенном масштабе
+        img.draft('RGB', max_size)
+
+    # Конвертируем в RGB если нужно
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = PILImage.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    # Resize с сохранением пропорций
+    if max_size:
+        img.thumbnail(max_size, PILImage.Resampling.LANCZOS)
+
+    buffer = BytesIO()
+    if image_format == 'JPEG':
+        img.save(buffer, format='JPEG', quality=85)
+    else:
+        img.save(buffer, format=image_format)
+    return PreparedImage(buffer.getvalue(), img.width, img.height)
+
+
+def thumbnail_key(image_request):
+    """Ключ дискового кэша: формат + размер + URL"""
+    size = 'x'.join(map(str, image_request.max_size)) if image_request.max_size else 'full'
+    return f"{image_request.format}:{size}:{image_request.url}"
+
+
+def cached_thumbnail(image_request):
+    """PreparedImage из дискового кэша или None"""
+    cached = thumbnail_cache.read(thumbnail_key(image_request))
+    if cached is None:
+        return None
+    data, meta = cached
+    if not meta.get('width') or not meta.get('height'):
+        return None
+    return PreparedImage(data, meta['width'], meta['height'])
+
+
+def public_thumbnail_url(url, width):
+    """URL для =IMAGE() в Google Sheets: превью через прокси веб-интерфейса (если настроен)"""
+    if KP_PUBLIC_BASE_URL and url and url.startswith(S3_IMAGES_URL):
+        return f"{KP_PUBLIC_BASE_URL}/images/{url[len(S3_IMAGES_URL):]}?w={width}"
+    return url
+
+
+def prefetch_images(image_requests, download_workers=KP_IMAGE_DOWNLOAD_WORKERS,
+                    decode_workers=KP_IMAGE_DECODE_WORKERS):
+    """{ImageRequest: PreparedImage | None} для всех запросов (сначала дисковый кэш)"""
+    image_requests = list(dict.fromkeys(r for r in image_requests if r.url))
+    if not image_requests:
+        return {}
+
+    started = time.perf_counter()
+    results = {}
+    by_url = {}
+    for image_request in image_requests:
+        results[image_request] = cached_thumbnail(image_request)
+        if results[image_request] is None:
+            by_url.setdefault(image_request.url, []).append(image_request)
+    cache_hits = len(image_requests) - sum(len(pending) for pending in by_url.values())
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix='kp-download') as downloads, \
+            ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix='kp-decode') as decoders:
+        download_futures = {downloads.submit(download, url): url for url in by_url}
+
+        # Декодирование начинается, как только приходит первый файл
+        decode_futures = {}
+        for future in as_completed(download_futures):
+            data = future.result()
+            if data is None:
+                failed += 1
+                continue
+            for image_request in by_url[download_futures[future]]:
+                decode_futures[decoders.submit(
+                    prepare_image, data, image_request.format, image_request.max_size
+                )] = image_request
+
+        for future, image_request in decode_futures.items():
+            try:
+                prepared = future.result()
+            except Exception as e:
+                print(f"⚠️  Ошибка обработки изображения {image_request.url}: {e}")
+                continue
+            results[image_request] = prepared
+            thumbnail_cache.put(thumbnail_key(image_request), prepared.data,
+                                {'width': prepared.width, 'height': prepared.height})
+
+    print(f"   🖼️  Изображения: {len(image_requests)} вариантов, из кэша {cache_hits}, "
+          f"скачано {len(by_url) - failed} файлов ({failed} не загружено) "
+          f"за {time.perf_counter() - started:.1f}с")
+    return results
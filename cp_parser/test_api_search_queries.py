@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Регрессионный тест N+1 для /api/search
+Считает SQL-запросы к БД на один вызов endpoint'а (как test_n+1_performance.py)
+
+Раньше: 1 запрос товаров + 2 запроса на КАЖДЫЙ товар (изображение, цена)
+         → limit=10 давал 21 запрос к Railway
+Теперь: 1 запрос при любом limit
+
+Запуск (из cp_parser, нужен DATABASE_URL):
+    python test_api_search_queries.py
+"""
+
+import sys
+from pathlib import Path
+import time
+sys.path.insert(0, str(Path.cwd()))
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'web_interface'))
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Максимум запросов на один вызов /api/search (не зависит от limit)
+MAX_QUERIES = 1
+
+# Частые запросы автокомплита
+SEARCH_QUERIES = ['кружка', 'ручка', 'футболка', 'a']
+
+# Счетчик запросов
+query_count = 0
+queries_log = []
+
+@event.listens_for(Engine, "before_cursor_execute")
+def receive_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Перехватывает каждый SQL запрос"""
+    global query_count, queries_log
+    query_count += 1
+    # Логируем только первые 100 символов запроса
+    query_preview = statement.replace('\n', ' ')[:100]
+    queries_log.append(f"Query #{query_count}: {query_preview}...")
+
+
+def _logged_in_client():
+    """Flask test client с активной сессией"""
+    from app import app
+    from auth import create_session_token
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['session_token'] = create_session_token()
+        session['username'] = 'admin'
+    return client
+
+
+def _count_queries(client, search, limit):
+    """Вызывает /api/search и возвращает (запросов, результатов, мс)"""
+    global query_count, queries_log
+    query_count = 0
+    queries_log = []
+
+    start_time = time.time()
+    response = client.get('/api/search', query_string={'q': search, 'limit': limit})
+    elapsed = (time.time() - start_time) * 1000
+
+    assert response.status_code == 200, f"/api/search вернул {response.status_code}"
+    return query_count, len(response.get_json()), elapsed
+
+
+def test_api_search_query_count():
+    """Количество запросов /api/search не растет с limit"""
+    client = _logged_in_client()
+
+    # Прогрев: проверки миграций (ListingColumns) делаются один раз на процесс
+    client.get('/api/search', query_string={'q': 'прогрев', 'limit': 1})
+
+    print("\n" + "="*80)
+    print("📊 ТЕСТ: количество SQL-запросов /api/search")
+    print("="*80 + "\n")
+
+    print(f"{'Запрос':<15} | {'limit':<6} | {'Результатов':<11} | {'Запросов':<8} | Время")
+    print("-"*80)
+
+    failures = []
+    for search in SEARCH_QUERIES:
+        for limit in (10, 50):
+            queries, found, elapsed = _count_queries(client, search, limit)
+            print(f"{search:<15} | {limit:<6} | {found:<11} | {queries:<8} | {elapsed:.1f} мс")
+
+            if queries > MAX_QUERIES:
+                failures.append((search, limit, queries, list(queries_log)))
+
+    for search, limit, queries, log in failures:
+        print(f"\n❌ q='{search}', limit={limit}: {queries} запросов (ожидалось ≤ {MAX_QUERIES})")
+        for line in log:
+            print(f"   {line}")
+
+    assert not failures, "N+1 в /api/search вернулся"
+    print(f"\n✅ /api/search: ≤ {MAX_QUERIES} запрос при любом limit")
+
+
+if __name__ == "__main__":
+    try:
+        test_api_search_query_count()
+    except AssertionError as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)
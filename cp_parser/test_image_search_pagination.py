@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Пагинация результатов поиска по изображению (/products?image_search=<id>)
+
+Ранжирование хранится на сервере (image_search_results.py), а в ссылках
+страниц передается только его id. Проверяем, что:
+- ссылки пагинации (filter_url) сохраняют image_search - иначе страница 2
+  молча показывает весь каталог
+- ключ следующей страницы продолжает порядок по сходству (image_rank)
+
+Запуск (из cp_parser, база не нужна):
+    python -m pytest -q test_image_search_pagination.py
+"""
+
+import sys
+import unittest
+from collections import namedtuple
+from pathlib import Path
+from urllib.parse import parse_qs
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'web_interface'))
+
+from pagination import KeysetPage, decode_cursor, filter_signature
+
+IMAGE_SORT_KEYS = [('image_rank', 'ASC'), ('id', 'ASC')]
+
+
+class Row(namedtuple('Row', ['id', 'image_rank'])):
+    """Строка результата SQL с _mapping, как у SQLAlchemy Row"""
+
+    @property
+    def _mapping(self):
+        return self._asdict()
+
+
+class TestImageSearchPagination(unittest.TestCase):
+
+    def _filter_url(self, page_num, cursor='', **context):
+        """filter_url из products_list.html с контекстом страницы (пустой список)"""
+        from app import app
+
+        context = {'products': [], 'pagination': {'total': 0, 'total_pages': 0}, 'search': '', **context}
+        with app.test_request_context('/products'):
+            template = app.jinja_env.get_template('products_list.html')
+            return template.make_module(context).filter_url(page_num, cursor)
+
+    def test_page_links_keep_image_search(self):
+        """Ссылки на следующую страницу и по номеру несут image_search"""
+        search_id = '3f2504e0-4f89-11d3-9a0c-0305e82c3301'
+
+        for url in (self._filter_url(2, 'after=abc', image_search_id=search_id),
+                    self._filter_url(5, image_search_id=search_id)):
+            query = parse_qs(url.lstrip('?'))
+            self.assertEqual(query['image_search'], [search_id])
+
+    def test_page_links_without_image_search(self):
+        """Обычный список - без image_search"""
+        self.assertNotIn('image_search', self._filter_url(2, 'after=abc', image_search_id=''))
+
+    def test_second_page_continues_similarity_order(self):
+        """Страница 2 начинается после последнего товара страницы 1 по image_rank"""
+        signature = filter_signature('products', 'p.id = ANY(...)', {'image_ids': [42, 7, 19, 3]})
+
+        first = KeysetPage(IMAGE_SORT_KEYS, 2, 1, 4, signature)
+        first.finish([Row(42, 1), Row(7, 2)])
+        pagination = first.pagination()
+        self.assertTrue(pagination['next_cursor'].startswith('after='))
+
+        cursor = pagination['next_cursor'][len('after='):]
+        self.assertEqual(decode_cursor(cursor, 2), [2, 7])
+
+        second = KeysetPage(IMAGE_SORT_KEYS, 2, 2, 4, signature, after=cursor)
+        sql, params = second.query("SELECT p.id, 1 as image_rank FROM products p")
+        self.assertIn('listing.image_rank ASC NULLS LAST', sql)
+        self.assertIn('listing.image_rank > :seek_0', sql)
+        self.assertEqual(params['seek_0'], 2)
+        self.assertEqual(params['page_offset'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Локальный векторный индекс (web_interface/local_vector_index.py)
+
+Только numpy и временная папка: БД заменена каталогом товаров в памяти
+(id → embedding), запросы индекса к products подменены чтением из него.
+Проверяем:
+- search: порядок по косинусу, min_similarity, удаленные строки, размерность
+- refresh_changed: товары, досчитанные позже (id меньше уже проиндексированных),
+  пересчитанные embeddings (updated_at) и пропавшие embeddings
+
+Запуск (из cp_parser, база не нужна):
+    python -m pytest -q test_local_vector_index.py
+"""
+
+import sys
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'web_interface'))
+
+import local_vector_index
+from local_vector_index import LocalVectorIndex
+
+
+class FakeSession:
+    """Отвечает только на SELECT NOW() сверки - остальное подменено в тестах"""
+
+    def __init__(self):
+        self.now = 0
+
+    def execute(self, statement, params=None):
+        self.now += 1
+        return mock.Mock(scalar=mock.Mock(return_value=f"2026-01-01 00:00:{self.now:02d}"))
+
+
+class TestLocalVectorIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='local_vector_index_')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.index = LocalVectorIndex(self.directory)
+        self.session = FakeSession()
+
+        # Каталог товаров: id → embedding; updated - id, измененные после прошлой сверки
+        self.catalog = {}
+        self.updated = set()
+
+        def fetch(session, source, where, params):
+            ids = params.get('ids', sorted(self.catalog))
+            return [(pid, self.catalog[pid]) for pid in sorted(ids) if pid in self.catalog]
+
+        for patcher in (
+            mock.patch.object(local_vector_index, '_embedding_source',
+                              return_value=('p.name_embedding_text', 'p.name_embedding_text')),
+            mock.patch.object(local_vector_index, '_embedded_ids',
+                              side_effect=lambda session, column: set(self.catalog)),
+            mock.patch.object(local_vector_index, '_updated_ids',
+                              side_effect=lambda session, since: set(self.updated)),
+            mock.patch.object(self.index, '_fetch', side_effect=fetch),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _sync(self):
+        stats = self.index.refresh_changed(self.session, force=True)
+        self.updated.clear()
+        return stats
+
+    def test_search_orders_by_cosine(self):
+        """Top-k по убыванию сходства, векторы нормируются"""
+        self.catalog = {1: [1.0, 0.0, 0.0], 2: [0.0, 2.0, 0.0], 3: [3.0, 3.0, 0.0]}
+        self._sync()
+
+        results = self.index.search([1.0, 0.1, 0.0], limit=2)
+        self.assertEqual([pid for pid, _ in results], [1, 3])
+        self.assertAlmostEqual(results[0][1], 0.995, places=3)
+
+        self.assertEqual([pid for pid, _ in self.index.search([0.0, 1.0, 0.0], min_similarity=0.5)], [2, 3])
+        self.assertEqual(self.index.search([1.0, 0.0]), [])
+        self.assertEqual(self.index.search([0.0, 0.0, 0.0]), [])
+
+    def test_empty_index(self):
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.search([1.0, 0.0]), [])
+
+    def test_refresh_picks_up_late_embeddings(self):
+        """Embedding товара 2 посчитан после товара 3 - все равно попадает в индекс"""
+        self.catalog = {1: [1.0, 0.0], 3: [0.0, 1.0]}
+        self.assertEqual(self._sync()['added'], 2)
+
+        self.catalog[2] = [1.0, 1.0]
+        self.assertEqual(self._sync()['added'], 1)
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.search([1.0, 1.0], limit=1)[0][0], 2)
+
+    def test_refresh_rereads_updated_embeddings(self):
+        """Пересчитанный embedding (updated_at после сверки) перезаписывает строку"""
+        self.catalog = {1: [1.0, 0.0], 2: [0.0, 1.0]}
+        self._sync()
+
+        self.catalog[1] = [0.0, 1.0]
+        self.updated = {1}
+        self.assertEqual(self._sync()['updated'], 1)
+
+        results = dict(self.index.search([0.0, 1.0]))
+        self.assertAlmostEqual(results[1], 1.0, places=5)
+
+    def test_refresh_removes_vanished_embeddings(self):
+        """Товар удален / embedding стерт - строка больше не находится"""
+        self.catalog = {1: [1.0, 0.0], 2: [0.9, 0.1]}
+        self._sync()
+
+        del self.catalog[1]
+        self.assertEqual(self._sync()['removed'], 1)
+        self.assertEqual([pid for pid, _ in self.index.search([1.0, 0.0])], [2])
+
+    def test_refresh_without_changes(self):
+        """Повторная сверка ничего не перечитывает, но сохраняет время сверки"""
+        self.catalog = {1: [1.0, 0.0]}
+        self._sync()
+        self.index._reload_if_changed()
+        first_sync = self.index.meta['synced_at']
+
+        self.assertEqual(self._sync(), {'updated': 0, 'added': 0, 'removed': 0})
+        self.index._reload_if_changed()
+        self.assertNotEqual(self.index.meta['synced_at'], first_sync)
+
+    def test_reopened_index_sees_rows(self):
+        """Другой процесс открывает те же файлы"""
+        self.catalog = {5: [0.0, 1.0], 7: [1.0, 0.0]}
+        self._sync()
+
+        reopened = LocalVectorIndex(self.directory)
+        self.assertEqual(len(reopened), 2)
+        self.assertEqual(reopened.search([1.0, 0.0], limit=1)[0][0], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
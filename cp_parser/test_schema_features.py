@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Проверка примененных миграций (database/schema_features.py)
+
+Сессия БД заменена счетчиком запросов: проверяем, что проверка выполняется
+один раз на процесс (и один раз на name для разных модулей), предупреждение
+печатается один раз, а reset_schema_features() заставляет проверить заново.
+
+Запуск (из cp_parser, база не нужна):
+    python -m pytest -q test_schema_features.py
+"""
+
+import io
+import sys
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from database import schema_features
+from database.schema_features import reset_schema_features, schema_feature
+
+
+def fake_session(result):
+    """Сессия, на любой запрос отвечающая result"""
+    session = mock.Mock()
+    session.execute.return_value.scalar.return_value = result
+    return session
+
+
+class TestSchemaFeatures(unittest.TestCase):
+
+    def setUp(self):
+        reset_schema_features()
+        self.addCleanup(reset_schema_features)
+
+    def test_checked_once_per_name(self):
+        session = fake_session(True)
+        for _ in range(3):
+            self.assertTrue(schema_feature(session, 'product_listing', "SELECT 1"))
+        self.assertEqual(session.execute.call_count, 1)
+
+        # Другой модуль с тем же name - из кэша
+        other = fake_session(False)
+        self.assertTrue(schema_feature(other, 'product_listing', "SELECT 1"))
+        other.execute.assert_not_called()
+
+    def test_missing_warning_printed_once(self):
+        session = fake_session(None)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            for _ in range(2):
+                self.assertFalse(schema_feature(session, 'project_stats', "SELECT 1",
+                                                missing="project_stats нет"))
+        self.assertEqual(output.getvalue().count('project_stats нет'), 1)
+
+    def test_reset_rechecks(self):
+        self.assertFalse(schema_feature(fake_session(False), 'products.search_vector', "SELECT 1"))
+
+        reset_schema_features('products.search_vector')
+        self.assertNotIn('products.search_vector', schema_features._features)
+        self.assertTrue(schema_feature(fake_session(True), 'products.search_vector', "SELECT 1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
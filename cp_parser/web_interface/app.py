@@ -30,16 +30,23 @@ import sys
 # ===== ВЕКТОРНЫЙ ПОИСК: pgvector (отдельная БД) =====
 PGVECTOR_ENABLED = False
 PGVECTOR_ENGINE = None
-OPENAI_CLIENT = None
+EMBEDDING_CLIENT = None
 
 try:
-    from openai import OpenAI
+    import openai  # noqa: F401 - SDK для EmbeddingClient
     from dotenv import load_dotenv
     from sqlalchemy import create_engine
     
     load_dotenv()
     
-    # 1. Подключение к pgvector БД
+    # 1. OpenAI API для генерации embeddings (кэш + один HTTP-клиент, см. embeddings.py)
+    #    Нужен и pgvector, и локальному индексу (local_vector_index.py)
+    api_key = os.getenv('OPENAI_API_KEY')
+    if api_key:
+        from embeddings import EmbeddingClient
+        EMBEDDING_CLIENT = EmbeddingClient(api_key)
+    
+    # 2. Подключение к pgvector БД
     vector_db_url = os.getenv('VECTOR_DATABASE_URL')
     if vector_db_url:
         PGVECTOR_ENGINE = create_engine(vector_db_url, pool_pre_ping=True)
@@ -50,10 +57,7 @@ try:
         print("✅ [APP] pgvector БД подключена")
         print(f"   URL: {vector_db_url[:50]}...")
     
-    # 2. OpenAI API для генерации embeddings
-    api_key = os.getenv('OPENAI_API_KEY')
-    if api_key and PGVECTOR_ENGINE:
-        OPENAI_CLIENT = OpenAI(api_key=api_key)
+    if EMBEDDING_CLIENT and PGVECTOR_ENGINE:
         PGVECTOR_ENABLED = True
         print("✅ [APP] Векторный поиск через pgvector ВКЛЮЧЕН")
         print("   📝 Поиск делает PostgreSQL (СУПЕР БЫСТРО!)")
@@ -69,34 +73,15 @@ except Exception as e:
 if not PGVECTOR_ENABLED:
     print("ℹ️  [APP] Используется обычный текстовый поиск (ILIKE)")
 
-# ===== IMAGE SEARCH: CLIP модель =====
-# ВРЕМЕННО ОТКЛЮЧЕНО: Блокирует запуск приложения на Railway
-IMAGE_SEARCH_ENABLED = False
-CLIP_MODEL = None
-print("ℹ️  [APP] Поиск по изображениям ОТКЛЮЧЕН (загрузка CLIP модели пропущена)")
-
-# Раскомментируй для включения (требует ~1GB RAM):
-# try:
-#     if PGVECTOR_ENGINE and OPENAI_CLIENT:  # Image search требует pgvector БД
-#         print("🔄 [APP] Загружаю CLIP модель (это может занять 10-30 секунд)...")
-#         import time
-#         start_time = time.time()
-#         
-#         from sentence_transformers import SentenceTransformer
-#         CLIP_MODEL = SentenceTransformer('clip-ViT-B-32')
-#         
-#         load_time = time.time() - start_time
-#         IMAGE_SEARCH_ENABLED = True
-#         print(f"✅ [APP] CLIP модель загружена за {load_time:.1f}с - поиск по изображениям ВКЛЮЧЕН")
-#     elif not PGVECTOR_ENGINE:
-#         print("ℹ️  [APP] CLIP модель НЕ загружается: отсутствует pgvector БД")
-#     elif not OPENAI_CLIENT:
-#         print("ℹ️  [APP] CLIP модель НЕ загружается: отсутствует OpenAI API")
-# except Exception as e:
-#     import traceback
-#     print(f"⚠️  [APP] CLIP модель недоступна: {e}")
-#     print(f"   Traceback: {traceback.format_exc()}")
-#     print("ℹ️  [APP] Поиск по изображениям ОТКЛЮЧЕН")
+# ===== IMAGE SEARCH: embeddings изображений (см. image_embeddings.py) =====
+# Модель грузится в фоне: запуск приложения на Railway не блокируется
+from image_embeddings import get_image_embedder, ImageEmbeddingError
+IMAGE_EMBEDDER = get_image_embedder()
+if IMAGE_EMBEDDER and PGVECTOR_ENGINE:  # без pgvector искать негде - модель не грузим
+    IMAGE_EMBEDDER.warm_up()
+    print(f"🔄 [APP] Поиск по изображениям: бэкенд {IMAGE_EMBEDDER.backend.name}, загрузка в фоне")
+else:
+    print("ℹ️  [APP] Поиск по изображениям ОТКЛЮЧЕН (IMAGE_EMBEDDING_BACKEND пуст)")
 
 # Добавляем путь к модулям проекта
 sys.path.append(str(Path(__file__).parent.parent))
@@ -144,20 +129,36 @@ def inject_image_url():
 
 # Импортируем конфигурацию
 from config import (
-    CLOUD_STORAGE_ENABLED, S3_BASE_URL, CLOUD_IMAGES_PREFIX,
+    CLOUD_STORAGE_ENABLED, S3_BASE_URL, CLOUD_IMAGES_PREFIX, IMAGE_PROXY_ENABLED,
     PRODUCTS_PER_PAGE, PROJECTS_PER_PAGE, IMAGES_DIR,
     get_image_url
 )
+from product_search import ProductSearch
+from pagination import KeysetPage, cached_count, filter_signature
+from product_listing import ListingColumns
+from project_stats import ProjectStatsColumns
+from dashboard_stats import get_dashboard_stats
+from vector_queries import PRODUCT_NAME_INDEX, PRODUCT_IMAGE_INDEX, nearest_products
+from local_vector_index import get_local_index
+from image_search_results import save_image_search, load_image_search
+from kp_data import fetch_kp_rows
+from kp_jobs import KP_JOB_FORMATS, submit_job, get_job, job_response
 from auth import AUTH_USERNAME, AUTH_PASSWORD, SECRET_KEY, create_session_token, check_session, login_required
 
-# image_proxy не нужен - изображения публично доступны в S3
+# image_proxy - для /images/<файл> при IMAGE_PROXY_ENABLED (дисковый кэш + превью)
 
 from datetime import datetime
+from decimal import Decimal
 
 # ===== УТИЛИТЫ =====
 
 def parse_price(price_str):
     """Парсит цену из текстового формата '20 700,00 ₽' в float"""
+    if price_str is None:
+        return None
+    # Числовые колонки (price_rub_num и т.п.) - без разбора строки
+    if isinstance(price_str, (int, float, Decimal)):
+        return float(price_str)
     if not price_str:
         return None
     try:
@@ -173,62 +174,33 @@ def parse_price(price_str):
 
 def generate_search_embedding(query: str):
     """
-    Генерирует embedding для поискового запроса
+    Генерирует embedding для поискового запроса (из кэша, если уже считали)
     Возвращает None если векторный поиск недоступен
     """
-    if not VECTOR_SEARCH_AVAILABLE or not OPENAI_CLIENT:
-        return None
-    
-    try:
-        # Таймаут 10 секунд для OpenAI API
-        import httpx
-        client_with_timeout = OpenAI(
-            api_key=OPENAI_CLIENT.api_key,
-            timeout=httpx.Timeout(10.0, connect=5.0)
-        )
-        response = client_with_timeout.embeddings.create(
-            input=query[:8000],
-            model="text-embedding-3-small"
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"⚠️  [VECTOR] Ошибка генерации embedding: {e}")
+    if not EMBEDDING_CLIENT:
         return None
+    return EMBEDDING_CLIENT.embed(query)
 
-def cosine_similarity(vec1, vec2):
-    """Вычисляет косинусное сходство между двумя векторами"""
-    import math
-    dot_product = sum(a * b for a, b in zip(vec1, vec2))
-    magnitude1 = math.sqrt(sum(a * a for a in vec1))
-    magnitude2 = math.sqrt(sum(b * b for b in vec2))
-    if magnitude1 == 0 or magnitude2 == 0:
-        return 0
-    return dot_product / (magnitude1 * magnitude2)
-
-def vector_search_pgvector(search_query, limit=200):
+def vector_search_pgvector(search_query, limit=200, probes=None, ef_search=None):
     """
     Выполняет векторный поиск через pgvector БД (СУПЕР БЫСТРО!)
-    PostgreSQL делает поиск используя индекс ivfflat
+    PostgreSQL делает поиск используя индекс ivfflat / hnsw (см. vector_queries.py)
+    probes / ef_search - точность ANN для этого запроса (None - из config.py)
     
     Возвращает: list of product_id или None (fallback)
     """
-    if not PGVECTOR_ENABLED or not PGVECTOR_ENGINE or not OPENAI_CLIENT:
+    if not PGVECTOR_ENABLED or not PGVECTOR_ENGINE or not EMBEDDING_CLIENT:
         return None
     
     try:
-        import httpx
-        from sqlalchemy import text
         import time
         
         start_time = time.time()
         
-        # 1. Генерируем embedding для запроса
-        response = OPENAI_CLIENT.embeddings.create(
-            model="text-embedding-3-small",
-            input=search_query.strip(),
-            timeout=httpx.Timeout(10.0)
-        )
-        query_embedding = response.data[0].embedding
+        # 1. Embedding запроса: кэш в памяти/на диске, иначе один вызов API
+        query_embedding = EMBEDDING_CLIENT.embed(search_query)
+        if query_embedding is None:
+            return None
         
         embedding_time = time.time() - start_time
         
@@ -236,22 +208,10 @@ def vector_search_pgvector(search_query, limit=200):
         #    PostgreSQL делает поиск (не Python!)
         search_start = time.time()
         
-        # Преобразуем list в строку для pgvector
-        # pgvector ожидает строку вида '[0.1, 0.2, ...]'
-        query_vector_str = '[' + ','.join(map(str, query_embedding)) + ']'
-        
+        # Вектор - один bind-параметр, порог сходства - после LIMIT (индексный ANN-скан)
         with PGVECTOR_ENGINE.connect() as conn:
-            # Используем format SQL так как SQLAlchemy text() конфликтует с ::vector cast
-            sql_query = f"""
-                SELECT 
-                    product_id,
-                    1 - (name_embedding <=> '{query_vector_str}'::vector) as similarity
-                FROM product_embeddings
-                WHERE 1 - (name_embedding <=> '{query_vector_str}'::vector) >= 0.55
-                ORDER BY name_embedding <=> '{query_vector_str}'::vector
-                LIMIT {limit}
-            """
-            results = conn.execute(text(sql_query)).fetchall()
+            results = nearest_products(conn, PRODUCT_NAME_INDEX, query_embedding, limit,
+                                       min_similarity=0.55, probes=probes, ef_search=ef_search)
         
         search_time = time.time() - search_start
         total_time = time.time() - start_time
@@ -272,119 +232,32 @@ def vector_search_pgvector(search_query, limit=200):
 
 def vector_search_products(session, query_embedding, limit=100):
     """
-    СТАРАЯ ФУНКЦИЯ: Векторный поиск через TEXT embeddings (медленно!)
-    Оставлена для обратной совместимости
+    Векторный поиск без pgvector: локальный индекс embeddings всего каталога
+    (numpy memmap + argpartition, см. local_vector_index.py)
     Возвращает список ID товаров, отсортированных по релевантности
-    Если что-то не работает - возвращает None (fallback на обычный поиск)
+    Если индекс выключен или пуст - None (fallback на обычный поиск)
     """
     if not query_embedding:
         return None
     
+    index = get_local_index()
+    if index is None:
+        return None
+    
     try:
-        from sqlalchemy import text
-        import json
-        
-        # Проверяем что колонка существует (сначала TEXT версия, потом pgvector)
-        check_text = session.execute(text("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = 'products' 
-            AND column_name = 'name_embedding_text'
-        """)).fetchone()
-        
-        check_vector = session.execute(text("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = 'products' 
-            AND column_name = 'name_embedding'
-        """)).fetchone()
-        
-        if not check_text and not check_vector:
-            print("⚠️  [VECTOR] Embeddings колонки не существуют, используем обычный поиск")
-            return None
+        import time
+        start_time = time.time()
         
-        # Если есть TEXT колонка - используем её (простая версия)
-        if check_text:
-            print("🔍 [VECTOR] Используем TEXT embeddings (оптимизированная версия)")
-            
-            import time
-            start_time = time.time()
-            
-            # ОПТИМИЗАЦИЯ: Загружаем только 200 товаров вместо 1000
-            # Берем последние добавленные товары (они обычно актуальнее)
-            result = session.execute(text("""
-                SELECT id, name, name_embedding_text
-                FROM products
-                WHERE name_embedding_text IS NOT NULL
-                ORDER BY id DESC
-                LIMIT 200
-            """)).fetchall()
-            
-            fetch_time = time.time() - start_time
-            print(f"   Загружено {len(result)} товаров за {fetch_time:.2f}с")
-            
-            # Вычисляем similarity в Python
-            similarities = []
-            calc_start = time.time()
-            
-            for product_id, product_name, embedding_json in result:
-                try:
-                    # ОПТИМИЗАЦИЯ: Таймаут на весь поиск (5 секунд max)
-                    if time.time() - start_time > 5.0:
-                        print("⚠️  [VECTOR] Timeout 5с, прерываем поиск")
-                        break
-                    
-                    product_embedding = json.loads(embedding_json)
-                    similarity = cosine_similarity(query_embedding, product_embedding)
-                    
-                    # ОПТИМИЗАЦИЯ: Снизили порог до 0.25 для лучшего recall
-                    if similarity > 0.25:
-                        similarities.append((product_id, product_name, similarity))
-                except:
-                    continue
-            
-            calc_time = time.time() - calc_start
-            print(f"   Вычислено similarity для {len(similarities)} товаров за {calc_time:.2f}с")
-            
-            # Сортируем по similarity
-            similarities.sort(key=lambda x: x[2], reverse=True)
-            
-            # Берем top results
-            product_ids = [pid for pid, _, _ in similarities[:limit]]
-            
-            total_time = time.time() - start_time
-            
-            if product_ids:
-                print(f"✅ [VECTOR] Найдено {len(product_ids)} релевантных товаров за {total_time:.2f}с")
-            else:
-                print("⚠️  [VECTOR] Векторный поиск не нашел релевантных товаров")
-            
-            return product_ids if product_ids else None
+        # Новые и пересчитанные embeddings докладываются в индекс сами (не чаще раза в минуту)
+        index.refresh_changed(session)
         
-        # Если есть pgvector колонка - используем её (быстрая версия)
-        elif check_vector:
-            print("🔍 [VECTOR] Используем pgvector (быстрая версия)")
-            
-            result = session.execute(text("""
-                SELECT id, name, 
-                       1 - (name_embedding <=> :query_embedding::vector) as similarity
-                FROM products
-                WHERE name_embedding IS NOT NULL
-                ORDER BY name_embedding <=> :query_embedding::vector
-                LIMIT :limit
-            """), {
-                'query_embedding': str(query_embedding),
-                'limit': limit
-            }).fetchall()
-            
-            product_ids = [row[0] for row in result if row[2] > 0.3]
-            
-            if product_ids:
-                print(f"✅ [VECTOR] Найдено {len(product_ids)} релевантных товаров (pgvector)")
-            else:
-                print("⚠️  [VECTOR] Векторный поиск не нашел релевантных товаров")
-            
-            return product_ids if product_ids else None
+        results = index.search(query_embedding, limit=limit, min_similarity=0.25)
+        product_ids = [product_id for product_id, _ in results]
+        
+        print(f"🔍 [LOCAL VECTOR] Найдено {len(product_ids)} товаров из {len(index):,} "
+              f"за {(time.time() - start_time) * 1000:.1f}мс")
+        
+        return product_ids if product_ids else None
         
     except Exception as e:
         print(f"⚠️  [VECTOR] Ошибка векторного поиска: {e}")
@@ -467,31 +340,39 @@ def products_list():
         params = {}
         
         # ===== ПОИСК ПО ИЗОБРАЖЕНИЮ =====
-        image_product_ids = None
+        # Ранжирование хранится на сервере (image_search_results.py), порядок - по сходству
+        image_results = None
         if image_search_id:
-            # Получаем product_ids из сессии
-            session_key = f'image_search_{image_search_id}'
-            image_product_ids = flask_session.get(session_key)
+            image_results = load_image_search(image_search_id)
             
-            if image_product_ids:
-                print(f"🖼️  [IMAGE SEARCH] Показываем результаты поиска по изображению: {len(image_product_ids)} товаров")
-                where_conditions.append(f"p.id IN :image_ids")
-                params["image_ids"] = tuple(image_product_ids)
+            if image_results:
+                print(f"🖼️  [IMAGE SEARCH] Показываем результаты поиска по изображению: {len(image_results)} товаров")
+                where_conditions.append("p.id = ANY(CAST(:image_ids AS INTEGER[]))")
+                params["image_ids"] = [product_id for product_id, _ in image_results]
                 # Отключаем текстовый поиск при image search
                 search = ''
             else:
-                print(f"⚠️  [IMAGE SEARCH] Результаты не найдены в сессии (search_id: {image_search_id})")
-        
-        # ===== ТЕКСТОВЫЙ ПОИСК: только ILIKE (векторный отключен) =====
-        # ОТКЛЮЧЕНО: Векторный поиск (тормозит) - используем только ILIKE
-        # vector_product_ids = vector_search_pgvector(search.strip(), limit=200)
+                print(f"⚠️  [IMAGE SEARCH] Результаты не найдены или устарели (search_id: {image_search_id})")
         
+        # ===== ТЕКСТОВЫЙ ПОИСК: pg_trgm + tsvector + векторный (pgvector) =====
         search_mode = None  # Для определения сортировки
+        product_search = None
         if search.strip():
-            # Используем только текстовый поиск (быстро и надежно)
-            print(f"🔍 [SEARCH] Используем текстовый поиск (ILIKE) с приоритетом: название → дизайн/проект → описание")
-            where_conditions.append("(p.name ILIKE :search OR p.custom_field ILIKE :search OR pr.project_name ILIKE :search OR p.description ILIKE :search)")
-            params["search"] = f"%{search.strip()}%"
+            # Смысловые совпадения из pgvector (embedding запроса кэшируется, см. embeddings.py)
+            # Без pgvector - локальный индекс (если включен); None - только текст
+            vector_product_ids = None
+            if PGVECTOR_ENABLED:
+                vector_product_ids = vector_search_pgvector(search.strip(), limit=200)
+            elif get_local_index() is not None:
+                vector_product_ids = vector_search_products(
+                    session, generate_search_embedding(search.strip()), limit=200
+                )
+            
+            # Текстовый поиск по индексам (pg_trgm + tsvector), см. product_search.py
+            print(f"🔍 [SEARCH] Используем индексный текстовый поиск с приоритетом: название → дизайн/проект → описание")
+            product_search = ProductSearch(session, search, vector_ids=vector_product_ids)
+            where_conditions.append(product_search.where)
+            params.update(product_search.params)
             search_mode = 'active'  # Флаг для применения релевантной сортировки
         
         # Фильтр по региону ОАЭ
@@ -501,100 +382,106 @@ def products_list():
         # Фильтры по цене, тиражу и сроку требуют JOIN с price_offers
         needs_price_join = max_quantity is not None or max_price is not None or max_delivery_days is not None
         
+        listing = ListingColumns(session)
+        
         if needs_price_join:
             # Добавляем подзапрос для фильтрации по ценовым предложениям
-            # ВАЖНО: quantity и price_rub могут быть TEXT в БД, поэтому используем CAST
+            # Числовые колонки quantity_num / price_rub_num - range scan по индексам
+            # (без миграции - CAST текста, как раньше)
             price_filters = []
             if max_quantity is not None:
-                price_filters.append("CAST(po.quantity AS INTEGER) <= :max_quantity")
+                price_filters.append(f"{listing.quantity_filter} <= :max_quantity")
                 params["max_quantity"] = max_quantity
             if max_price is not None:
-                price_filters.append("CAST(po.price_rub AS NUMERIC) <= :max_price")
+                price_filters.append(f"{listing.price_rub_filter} <= :max_price")
                 params["max_price"] = max_price
             if max_delivery_days is not None:
                 price_filters.append("po.delivery_time_days <= :max_delivery_days")
                 params["max_delivery_days"] = max_delivery_days
             
             price_where = " AND ".join(price_filters)
-            where_conditions.append(f"p.id IN (SELECT DISTINCT product_id FROM price_offers po WHERE {price_where})")
+            where_conditions.append(f"p.id IN (SELECT product_id FROM price_offers po WHERE {price_where})")
         
         where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
         
-        # Определяем SELECT и ORDER BY в зависимости от sort_by
-        # ВАЖНО: для SELECT DISTINCT все поля в ORDER BY должны быть в SELECT
+        # Определяем SELECT и порядок в зависимости от sort_by
+        # DISTINCT не нужен: JOIN с projects - многие к одному, строки товаров уникальны
         # Используем offer_created_at (TIMESTAMP) вместо offer_creation_date (TEXT) для корректной сортировки
-        # ОПТИМИЗАЦИЯ: Добавлен подзапрос только для главного изображения, цены загружаются батчем
-        base_select = """p.id, p.project_id, p.name, p.description, p.article_number, 
+        # ОПТИМИЗАЦИЯ: Главное изображение и мин. цена - из product_listing (JOIN по ключу), цены батчем
+        base_select = f"""p.id, p.project_id, p.name, p.description, p.article_number, 
                    p.sample_price, p.sample_delivery_time, p.row_number, pr.region, pr.offer_created_at,
                    (SELECT MAX(ki.added_at) FROM kp_items ki WHERE ki.product_id = p.id AND ki.session_id = :session_id_kp) as kp_added_at,
                    pr.project_name,
-                   (SELECT pi.image_url 
-                    FROM product_images pi 
-                    WHERE pi.product_id = p.id 
-                    AND pi.image_url IS NOT NULL
-                    ORDER BY 
-                        CASE WHEN pi.is_main_image::text = 'true' THEN 0 ELSE 1 END,
-                        pi.cell_position
-                    LIMIT 1) as main_image_url"""
+                   {listing.main_image_url} as main_image_url"""
+        
+        # Подсчитываем общее количество с фильтрами (кэш с коротким TTL по сигнатуре фильтров)
+        # session_id_kp в условие не входит - добавляем после сигнатуры
+        count_signature = filter_signature('products', where_clause, params)
+        count_sql = text(f"""
+            SELECT COUNT(*) 
+            FROM products p
+            LEFT JOIN projects pr ON p.project_id = pr.id
+            WHERE {where_clause}
+        """)
+        count_params = dict(params)
+        if where_conditions:
+            total = cached_count(count_signature, lambda: session.execute(count_sql, count_params).scalar())
+        else:
+            # Без фильтров (главная) - число товаров из общей статистики
+            total = get_dashboard_stats(session)['products']
         
         # Добавляем session_id для подзапроса kp_added_at
         params["session_id_kp"] = get_session_id()
         
-        order_by = "p.id DESC"  # По умолчанию
+        # Ключи сортировки (алиасы SELECT) - последним всегда id, NULL в конце
+        sort_keys = [('id', 'DESC')]  # По умолчанию
         select_fields = base_select
+        page_signature = filter_signature(count_signature, sort_by)
         
         # Определяем сортировку
         if sort_by == "date_asc":
-            order_by = "pr.offer_created_at ASC NULLS LAST, p.id ASC"
+            sort_keys = [('offer_created_at', 'ASC'), ('id', 'ASC')]
         elif sort_by == "date_desc":
-            order_by = "pr.offer_created_at DESC NULLS LAST, p.id DESC"
+            sort_keys = [('offer_created_at', 'DESC'), ('id', 'DESC')]
         elif sort_by == "kp_date":
-            # Сортировка по дате добавления в КП (сначала новые)
-            select_fields = base_select + """, (SELECT MAX(ki.added_at) FROM kp_items ki WHERE ki.product_id = p.id AND ki.session_id = :session_id) as kp_added_at"""
-            order_by = "kp_added_at DESC NULLS LAST, p.id DESC"
-            params["session_id"] = get_session_id()
+            # Сортировка по дате добавления в КП (сначала новые) - kp_added_at уже в base_select
+            sort_keys = [('kp_added_at', 'DESC'), ('id', 'DESC')]
+            # Порядок зависит от КП пользователя - закладки страниц тоже
+            page_signature = filter_signature(count_signature, sort_by, params["session_id_kp"])
         elif sort_by == "price_asc":
             # Добавляем подзапрос для цены в SELECT для сортировки
-            select_fields = base_select + """, (SELECT MIN(CAST(po.price_rub AS NUMERIC)) FROM price_offers po WHERE po.product_id = p.id) as min_price"""
-            order_by = "min_price ASC NULLS LAST, p.id ASC"
+            select_fields = base_select + f", {listing.min_price} as min_price"
+            sort_keys = [('min_price', 'ASC'), ('id', 'ASC')]
         elif sort_by == "price_desc":
-            select_fields = base_select + """, (SELECT MIN(CAST(po.price_rub AS NUMERIC)) FROM price_offers po WHERE po.product_id = p.id) as min_price"""
-            order_by = "min_price DESC NULLS LAST, p.id DESC"
+            select_fields = base_select + f", {listing.min_price} as min_price"
+            sort_keys = [('min_price', 'DESC'), ('id', 'DESC')]
+        elif image_results and not sort_by:
+            # Поиск по изображению: позиция в ранжировании (1 = самый похожий)
+            select_fields = base_select + ", array_position(CAST(:image_ids AS INTEGER[]), p.id) as image_rank"
+            sort_keys = [('image_rank', 'ASC'), ('id', 'ASC')]
         elif search_mode == 'active' and not sort_by:
             # ПРИОРИТЕТ: При поиске БЕЗ явной сортировки - сортируем по релевантности
             # 1 = название товара, 2 = дизайн/проект, 3 = описание
-            select_fields = base_select + """, 
-                CASE 
-                    WHEN p.name ILIKE :search THEN 1
-                    WHEN p.custom_field ILIKE :search OR pr.project_name ILIKE :search THEN 2
-                    WHEN p.description ILIKE :search THEN 3
-                    ELSE 4
-                END as relevance_rank"""
-            order_by = "relevance_rank ASC, p.id DESC"
+            # Внутри группы - ts_rank по взвешенному search_vector
+            select_fields = base_select + ", " + product_search.rank_select
+            sort_keys = product_search.sort_keys + [('id', 'DESC')]
             print(f"   → Сортировка: название (1) → дизайн/проект (2) → описание (3)")
         
-        # Подсчитываем общее количество с фильтрами
-        count_sql = text(f"""
-            SELECT COUNT(DISTINCT p.id) 
-            FROM products p
-            LEFT JOIN projects pr ON p.project_id = pr.id
-            WHERE {where_clause}
-        """)
-        total = session.execute(count_sql, params).scalar()
-        
-        # Получаем товары с фильтрами
-        products_sql = text(f"""
-            SELECT DISTINCT {select_fields}
+        # Получаем товары с фильтрами: keyset-пагинация вместо OFFSET (см. pagination.py)
+        keyset_page = KeysetPage(
+            sort_keys, PRODUCTS_PER_PAGE, page, total, page_signature,
+            after=request.args.get('after'), before=request.args.get('before')
+        )
+        products_sql, page_params = keyset_page.query(f"""
+            SELECT {select_fields}
             FROM products p
             LEFT JOIN projects pr ON p.project_id = pr.id
+            {listing.join}
             WHERE {where_clause}
-            ORDER BY {order_by}
-            LIMIT :limit OFFSET :offset
         """)
-        params["limit"] = PRODUCTS_PER_PAGE
-        params["offset"] = (page - 1) * PRODUCTS_PER_PAGE
+        params.update(page_params)
         
-        rows = session.execute(products_sql, params).fetchall()
+        rows = keyset_page.finish(session.execute(text(products_sql), params).fetchall())
         
         # Преобразуем в объекты Product
         products = []
@@ -641,11 +528,12 @@ def products_list():
         
         # BATCH LOADING: Загружаем ВСЕ цены одним запросом (вместо N запросов)
         if product_ids:
-            offers_sql = text("""
-                SELECT product_id, id, quantity, price_usd, price_rub, delivery_time_days
-                FROM price_offers
-                WHERE product_id = ANY(:product_ids)
-                ORDER BY product_id, quantity
+            offers_sql = text(f"""
+                SELECT po.product_id, po.id, {listing.offer_quantity}, {listing.offer_price_usd},
+                       {listing.offer_price_rub}, po.delivery_time_days
+                FROM price_offers po
+                WHERE po.product_id = ANY(:product_ids)
+                ORDER BY po.product_id, {listing.offer_quantity}
             """)
             offer_rows = session.execute(offers_sql, {"product_ids": product_ids}).fetchall()
             
@@ -669,20 +557,8 @@ def products_list():
                 if product.id in offers_by_product:
                     product.price_offers = offers_by_product[product.id][:3]
         
-        # Вычисляем данные для пагинации
-        total_pages = math.ceil(total / PRODUCTS_PER_PAGE)
-        has_prev = page > 1
-        has_next = page < total_pages
-        
-        pagination = {
-            'page': page,
-            'total_pages': total_pages,
-            'has_prev': has_prev,
-            'has_next': has_next,
-            'prev_num': page - 1 if has_prev else None,
-            'next_num': page + 1 if has_next else None,
-            'total': total
-        }
+        # Данные для пагинации (номера страниц + ключи для ←/→)
+        pagination = keyset_page.pagination()
         
         return render_template('products_list.html', 
                              products=products, 
@@ -692,7 +568,8 @@ def products_list():
                              max_price=max_price,
                              max_delivery_days=max_delivery_days,
                              region_uae=region_uae,
-                             sort_by=sort_by)
+                             sort_by=sort_by,
+                             image_search_id=image_search_id if image_results else '')
 
 @app.route('/projects')
 @login_required
@@ -704,49 +581,35 @@ def projects_list():
     search = request.args.get('search', '', type=str)
     
     with db_manager.get_session() as session:
-        # Подсчитываем общее количество с поиском
+        params = {}
+        where_clause = "1=1"
         if search.strip():
-            count_sql = text("""
-                SELECT COUNT(*) FROM projects 
-                WHERE project_name ILIKE :search OR table_id ILIKE :search
-            """)
-            total = session.execute(count_sql, {"search": f"%{search.strip()}%"}).scalar()
-            
-            # Получаем проекты с поиском (считаем товары на лету)
-            projects_sql = text("""
-                SELECT p.id, p.project_name, p.file_name, p.google_sheets_url, 
-                       p.manager_name, 
-                       (SELECT COUNT(*) FROM products WHERE project_id = p.id) as total_products_found,
-                       p.total_images_found,
-                       p.parsing_status, p.updated_at, p.created_at
-                FROM projects p
-                WHERE p.project_name ILIKE :search OR p.table_id ILIKE :search
-                ORDER BY p.id DESC 
-                LIMIT :limit OFFSET :offset
-            """)
-            rows = session.execute(projects_sql, {
-                "search": f"%{search.strip()}%",
-                "limit": PROJECTS_PER_PAGE,
-                "offset": (page - 1) * PROJECTS_PER_PAGE
-            }).fetchall()
-        else:
-            # Без поиска
-            total = session.execute(text("SELECT COUNT(*) FROM projects")).scalar()
-            
-            projects_sql = text("""
-                SELECT p.id, p.project_name, p.file_name, p.google_sheets_url, 
-                       p.manager_name,
-                       (SELECT COUNT(*) FROM products WHERE project_id = p.id) as total_products_found,
-                       p.total_images_found,
-                       p.parsing_status, p.updated_at, p.created_at
-                FROM projects p
-                ORDER BY p.id DESC 
-                LIMIT :limit OFFSET :offset
-            """)
-            rows = session.execute(projects_sql, {
-                "limit": PROJECTS_PER_PAGE,
-                "offset": (page - 1) * PROJECTS_PER_PAGE
-            }).fetchall()
+            where_clause = "p.project_name ILIKE :search OR p.table_id ILIKE :search"
+            params["search"] = f"%{search.strip()}%"
+        
+        # Подсчитываем общее количество с поиском (кэш с коротким TTL)
+        signature = filter_signature('projects', where_clause, params)
+        total = cached_count(signature, lambda: session.execute(text(f"""
+            SELECT COUNT(*) FROM projects p WHERE {where_clause}
+        """), params).scalar())
+        
+        # Получаем проекты (счетчики из project_stats): keyset-пагинация по id
+        stats_columns = ProjectStatsColumns(session)
+        keyset_page = KeysetPage(
+            [('id', 'DESC')], PROJECTS_PER_PAGE, page, total, signature,
+            after=request.args.get('after'), before=request.args.get('before')
+        )
+        projects_sql, page_params = keyset_page.query(f"""
+            SELECT p.id, p.project_name, p.file_name, p.google_sheets_url, 
+                   p.manager_name, 
+                   {stats_columns.products_count} as total_products_found,
+                   {stats_columns.images_count} as total_images_found,
+                   p.parsing_status, p.updated_at, p.created_at
+            FROM projects p
+            {stats_columns.join}
+            WHERE {where_clause}
+        """)
+        rows = keyset_page.finish(session.execute(text(projects_sql), {**params, **page_params}).fetchall())
         
         # Преобразуем в объекты Project
         projects = []
@@ -765,20 +628,8 @@ def projects_list():
             project.created_at = datetime.fromisoformat(str(row[9])) if row[9] else None
             projects.append(project)
         
-        # Вычисляем данные для пагинации
-        total_pages = math.ceil(total / PROJECTS_PER_PAGE)
-        has_prev = page > 1
-        has_next = page < total_pages
-        
-        pagination = {
-            'page': page,
-            'total_pages': total_pages,
-            'has_prev': has_prev,
-            'has_next': has_next,
-            'prev_num': page - 1 if has_prev else None,
-            'next_num': page + 1 if has_next else None,
-            'total': total
-        }
+        # Данные для пагинации (номера страниц + ключи для ←/→)
+        pagination = keyset_page.pagination()
         
         return render_template('projects_list.html', 
                              projects=projects, 
@@ -792,14 +643,19 @@ def project_detail(project_id):
     from sqlalchemy import text
     
     with db_manager.get_session() as session:
-        # Получаем проект
-        project_sql = text("""
-            SELECT id, table_id, project_name, file_name, google_sheets_url, 
-                   manager_name, total_products_found, total_images_found,
-                   parsing_status, region, updated_at, created_at, offer_created_at,
-                   planfix_task_url
-            FROM projects 
-            WHERE id = :project_id
+        # Получаем проект вместе со счетчиками (project_stats) - один запрос
+        stats_columns = ProjectStatsColumns(session)
+        project_sql = text(f"""
+            SELECT p.id, p.table_id, p.project_name, p.file_name, p.google_sheets_url, 
+                   p.manager_name,
+                   {stats_columns.products_count} as products_count,
+                   {stats_columns.images_count} as images_count,
+                   p.parsing_status, p.region, p.updated_at, p.created_at, p.offer_created_at,
+                   p.planfix_task_url,
+                   {stats_columns.offers_count} as offers_count
+            FROM projects p
+            {stats_columns.join}
+            WHERE p.id = :project_id
         """)
         project_row = session.execute(project_sql, {"project_id": project_id}).fetchone()
         
@@ -823,29 +679,26 @@ def project_detail(project_id):
         project.offer_created_at = project_row[12]  # TIMESTAMP
         project.planfix_task_url = project_row[13]  # Planfix URL
         
+        # Статистика проекта (те же счетчики, что в списке проектов)
+        project_stats = {
+            'products_count': project.total_products_found,
+            'offers_count': int(project_row[14]) if project_row[14] is not None else 0,
+            'images_count': project.total_images_found
+        }
+        
         # Получаем товары проекта с пагинацией
         page = request.args.get('page', 1, type=int)
+        total = project_stats['products_count']
         
-        # Подсчитываем общее количество
-        total = session.execute(
-            text("SELECT COUNT(*) FROM products WHERE project_id = :project_id"),
-            {"project_id": project_id}
-        ).scalar()
-        
-        # Получаем товары (с регионом) + ОПТИМИЗАЦИЯ: подзапрос только для изображений, цены батчем
-        products_sql = text("""
+        # Получаем товары (с регионом) + ОПТИМИЗАЦИЯ: главное изображение из product_listing, цены батчем
+        listing = ListingColumns(session)
+        products_sql = text(f"""
             SELECT p.id, p.project_id, p.name, p.description, p.article_number, 
                    p.sample_price, p.sample_delivery_time, p.row_number, pr.region,
-                   (SELECT pi.image_url 
-                    FROM product_images pi 
-                    WHERE pi.product_id = p.id 
-                    AND pi.image_url IS NOT NULL
-                    ORDER BY 
-                        CASE WHEN pi.is_main_image::text = 'true' THEN 0 ELSE 1 END,
-                        pi.cell_position
-                    LIMIT 1) as main_image_url
+                   {listing.main_image_url} as main_image_url
             FROM products p
             LEFT JOIN projects pr ON p.project_id = pr.id
+            {listing.join}
             WHERE p.project_id = :project_id
             ORDER BY p.id DESC 
             LIMIT :limit OFFSET :offset
@@ -892,11 +745,12 @@ def project_detail(project_id):
         
         # BATCH LOADING: Загружаем ВСЕ цены одним запросом (вместо N запросов)
         if product_ids:
-            offers_sql = text("""
-                SELECT product_id, id, quantity, price_usd, price_rub, delivery_time_days
-                FROM price_offers
-                WHERE product_id = ANY(:product_ids)
-                ORDER BY product_id, quantity
+            offers_sql = text(f"""
+                SELECT po.product_id, po.id, {listing.offer_quantity}, {listing.offer_price_usd},
+                       {listing.offer_price_rub}, po.delivery_time_days
+                FROM price_offers po
+                WHERE po.product_id = ANY(:product_ids)
+                ORDER BY po.product_id, {listing.offer_quantity}
             """)
             offer_rows = session.execute(offers_sql, {"product_ids": product_ids}).fetchall()
             
@@ -935,30 +789,6 @@ def project_detail(project_id):
             'total': total
         }
         
-        # Статистика проекта
-        project_stats = {
-            'products_count': session.execute(
-                text("SELECT COUNT(*) FROM products WHERE project_id = :project_id"),
-                {"project_id": project_id}
-            ).scalar(),
-            'offers_count': session.execute(
-                text("""
-                    SELECT COUNT(*) FROM price_offers po
-                    JOIN products p ON po.product_id = p.id
-                    WHERE p.project_id = :project_id
-                """),
-                {"project_id": project_id}
-            ).scalar(),
-            'images_count': session.execute(
-                text("""
-                    SELECT COUNT(*) FROM product_images pi
-                    JOIN products p ON pi.product_id = p.id
-                    WHERE p.project_id = :project_id
-                """),
-                {"project_id": project_id}
-            ).scalar()
-        }
-        
         return render_template('project_detail.html', 
                              project=project, 
                              products=products, 
@@ -1008,12 +838,14 @@ def product_detail(product_id):
             product.project.offer_created_at = project_row_data[3]  # TIMESTAMP
             product.project.manager_name = project_row_data[4]
         
-        # Получаем все ценовые предложения
-        offers_sql = text("""
-            SELECT id, quantity, price_usd, price_rub, delivery_time_days, route
-            FROM price_offers 
-            WHERE product_id = :product_id 
-            ORDER BY quantity
+        # Получаем все ценовые предложения (числовые колонки, если есть)
+        listing = ListingColumns(session)
+        offers_sql = text(f"""
+            SELECT po.id, {listing.offer_quantity}, {listing.offer_price_usd}, {listing.offer_price_rub},
+                   po.delivery_time_days, po.route
+            FROM price_offers po
+            WHERE po.product_id = :product_id 
+            ORDER BY {listing.offer_quantity}
         """)
         offer_rows = session.execute(offers_sql, {"product_id": product_id}).fetchall()
         
@@ -1077,8 +909,12 @@ def kp_page():
 
 @app.route('/images/<path:filename>')
 def serve_image(filename):
-    """Отдача изображений из облачного хранилища или локальной папки"""
+    """Отдача изображений из облачного хранилища (прокси с дисковым кэшем) или локальной папки"""
     if CLOUD_STORAGE_ENABLED:
+        if IMAGE_PROXY_ENABLED:
+            # Дисковый кэш + превью ?w=320 (см. image_proxy.py)
+            from image_proxy import serve_image_proxy
+            return serve_image_proxy(filename, request.args.get('w', type=int))
         # Перенаправляем на облачное хранилище
         from flask import redirect
         cloud_url = f"{S3_BASE_URL}/{CLOUD_IMAGES_PREFIX}{filename}"
@@ -1090,23 +926,16 @@ def serve_image(filename):
 @app.route('/api/stats')
 @login_required
 def api_stats():
-    """API для получения статистики"""
+    """API для получения статистики (общий кэш воркеров, см. dashboard_stats.py)"""
     with db_manager.get_session() as session:
-        stats = {
-            'projects': session.query(Project).count(),
-            'products': session.query(Product).count(),
-            'offers': session.query(PriceOffer).count(),
-            'images': session.query(ProductImage).count(),
-            'completed_projects': session.query(Project).filter(
-                Project.parsing_status == 'complete'
-            ).count()
-        }
-        return jsonify(stats)
+        return jsonify(get_dashboard_stats(session))
 
 @app.route('/api/search')
 @login_required
 def api_search():
     """API для поиска товаров"""
+    from sqlalchemy import text
+    
     query = request.args.get('q', '', type=str)
     limit = request.args.get('limit', 10, type=int)
     
@@ -1114,33 +943,52 @@ def api_search():
         return jsonify([])
     
     with db_manager.get_session() as session:
-        search_term = f"%{query.strip()}%"
-        products = session.query(Product).filter(
-            or_(
-                Product.name.ilike(search_term),
-                Product.description.ilike(search_term)
-            )
-        ).limit(limit).all()
+        listing = ListingColumns(session)
+        
+        # ОДИН запрос: товары + первое изображение + первое предложение (LATERAL)
+        # Раньше: 1 запрос товаров + по 2 запроса на каждый товар (N+1)
+        # ILIKE по name/description идет по триграммным индексам (create_search_indexes.py)
+        search_sql = text(f"""
+            SELECT p.id, p.name, p.description,
+                   img.image_filename,
+                   offer.price_usd,
+                   offer.quantity
+            FROM products p
+            LEFT JOIN LATERAL (
+                SELECT pi.image_filename
+                FROM product_images pi
+                WHERE pi.product_id = p.id
+                ORDER BY 
+                    CASE WHEN pi.is_main_image::text = 'true' THEN 0 ELSE 1 END,
+                    pi.cell_position
+                LIMIT 1
+            ) img ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT {listing.offer_price_usd} as price_usd, {listing.offer_quantity} as quantity
+                FROM price_offers po
+                WHERE po.product_id = p.id
+                ORDER BY {listing.offer_quantity}
+                LIMIT 1
+            ) offer ON TRUE
+            WHERE p.name ILIKE :search OR p.description ILIKE :search
+            ORDER BY CASE WHEN p.name ILIKE :search THEN 0 ELSE 1 END, p.id DESC
+            LIMIT :limit
+        """)
+        rows = session.execute(search_sql, {
+            "search": f"%{query.strip()}%",
+            "limit": limit
+        }).fetchall()
         
         results = []
-        for product in products:
-            # Получаем первое изображение
-            first_image = session.query(ProductImage).filter(
-                ProductImage.product_id == product.id
-            ).first()
-            
-            # Получаем первое ценовое предложение
-            first_offer = session.query(PriceOffer).filter(
-                PriceOffer.product_id == product.id
-            ).order_by(PriceOffer.quantity).first()
-            
+        for row in rows:
+            description = row[2]
             results.append({
-                'id': product.id,
-                'name': product.name,
-                'description': product.description[:100] + '...' if product.description and len(product.description) > 100 else product.description,
-                'image': first_image.image_filename if first_image else None,
-                'price': first_offer.price_usd if first_offer else None,
-                'quantity': first_offer.quantity if first_offer else None
+                'id': row[0],
+                'name': row[1],
+                'description': description[:100] + '...' if description and len(description) > 100 else description,
+                'image': row[3],
+                'price': parse_price(row[4]),
+                'quantity': int(row[5]) if row[5] is not None else None
             })
         
         return jsonify(results)
@@ -1242,72 +1090,26 @@ def api_kp_get():
         db_session = db_manager.get_session_direct()
         
         try:
-            result = db_session.execute(text("""
-                SELECT 
-                    ki.id as kp_item_id,
-                    ki.quantity,
-                    ki.added_at,
-                    p.id as product_id,
-                    p.name as product_name,
-                    p.description,
-                    po.id as price_offer_id,
-                    po.quantity as offer_quantity,
-                    po.route,
-                    po.price_usd,
-                    po.price_rub,
-                    po.delivery_time_days,
-                    (SELECT image_url 
-                     FROM product_images pi 
-                     WHERE pi.product_id = p.id 
-                     AND pi.image_url IS NOT NULL
-                     ORDER BY CASE WHEN pi.column_number = 1 THEN 0 ELSE 1 END, pi.id
-                     LIMIT 1) as image_url,
-                    (SELECT image_filename 
-                     FROM product_images pi 
-                     WHERE pi.product_id = p.id 
-                     AND pi.image_filename IS NOT NULL
-                     ORDER BY CASE WHEN pi.column_number = 1 THEN 0 ELSE 1 END, pi.id
-                     LIMIT 1) as image_filename
-                FROM kp_items ki
-                JOIN products p ON p.id = ki.product_id
-                JOIN price_offers po ON po.id = ki.price_offer_id
-                WHERE ki.session_id = :session_id
-                ORDER BY ki.added_at DESC
-            """), {'session_id': session_id})
-            
+            # Строки КП + первое изображение товара одним запросом (см. kp_data.py)
             kp_items = []
-            for row in result:
-                # Формируем URL изображения
-                image_url = row[12]
-                if not image_url and row[13]:
-                    image_url = f"https://s3.ru1.storage.beget.cloud/73d16f7545b3-promogoods/images/{row[13]}"
-                
-                # ИСПРАВЛЕНИЕ: Заменяем FTP на S3 (как в kp_generator_google_sheets.py)
-                if image_url:
-                    # Проверка домена: ftp.ru1.storage.beget.cloud → s3.ru1.storage.beget.cloud
-                    if 'ftp.ru1.storage.beget.cloud' in image_url:
-                        image_url = image_url.replace('ftp.ru1.storage.beget.cloud', 's3.ru1.storage.beget.cloud')
-                    # Проверка протокола: ftp://
-                    elif image_url.lower().startswith('ftp://'):
-                        image_url = image_url.replace('ftp://', 'https://s3.ru1.storage.beget.cloud/73d16f7545b3-promogoods/')
-                
+            for row in fetch_kp_rows(db_session, session_id, image_limit=1, order='added'):
                 kp_items.append({
-                    'kp_item_id': row[0],
-                    'quantity': row[1],
-                    'added_at': row[2].isoformat() if row[2] else None,
+                    'kp_item_id': row['kp_item_id'],
+                    'quantity': row['kp_quantity'],
+                    'added_at': row['added_at'].isoformat() if row['added_at'] else None,
                     'product': {
-                        'id': row[3],
-                        'name': row[4],
-                        'description': row[5],
-                        'image_url': image_url
+                        'id': row['product_id'],
+                        'name': row['product_name'],
+                        'description': row['description'],
+                        'image_url': row['images'][0] if row['images'] else None
                     },
                     'price_offer': {
-                        'id': row[6],
-                        'quantity': row[7],
-                        'route': row[8],
-                        'price_usd': float(row[9]) if row[9] else None,
-                        'price_rub': float(row[10]) if row[10] else None,
-                        'delivery_days': row[11]
+                        'id': row['price_offer_id'],
+                        'quantity': row['quantity'],
+                        'route': row['route'],
+                        'price_usd': float(row['price_usd']) if row['price_usd'] else None,
+                        'price_rub': float(row['price_rub']) if row['price_rub'] else None,
+                        'delivery_days': row['delivery_time_days']
                     }
                 })
             
@@ -1372,91 +1174,73 @@ def api_kp_check():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/kp/generate/excel', methods=['POST'])
+@app.route('/api/kp/generate/<job_format>', methods=['POST'])
 @login_required
-def api_kp_generate_excel():
-    """Генерирует Excel файл коммерческого предложения"""
-    
+def api_kp_generate(job_format):
+    """
+    Ставит генерацию КП (excel / pdf / google-sheets) в фоновую очередь (kp_jobs.py)
+    202 + job_id - задача в очереди; 200 - готовый результат того же содержимого из кэша
+    """
+    if job_format not in KP_JOB_FORMATS:
+        return jsonify({'success': False, 'error': f'Неизвестный формат: {job_format}'}), 404
+
     try:
         session_id = get_session_id()
-        
-        # Импортируем генератор
-        from kp_generator_excel import KPExcelGenerator
-        
-        generator = KPExcelGenerator()
-        output_path = generator.generate(session_id)
-        
-        # Отправляем файл клиенту
-        from flask import send_file
-        return send_file(
-            output_path,
-            as_attachment=True,
-            download_name=f'КП_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-    except ValueError as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
+        db_session = db_manager.get_session_direct()
+        try:
+            rows = fetch_kp_rows(db_session, session_id)
+        finally:
+            db_session.close()
+
+        if not rows:
+            return jsonify({'success': False, 'error': 'КП пусто. Добавьте товары в КП.'}), 400
+
+        job = submit_job(session_id, job_format, rows)
+        response = job_response(job)
+        return jsonify(response), 200 if response['status'] == 'done' else 202
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return jsonify({'success': False, 'error': f'Ошибка генерации: {str(e)}'}), 500
+        return jsonify({'success': False, 'error': f'Ошибка постановки задачи: {str(e)}'}), 500
 
-@app.route('/api/kp/generate/pdf', methods=['POST'])
+def _get_own_job(job_id):
+    """Задача КП текущей сессии или None"""
+    job = get_job(job_id)
+    if job is None or job['session_id'] != get_session_id():
+        return None
+    return job
+
+@app.route('/api/kp/jobs/<job_id>')
 @login_required
-def api_kp_generate_pdf():
-    """Генерирует PDF файл коммерческого предложения"""
-    
+def api_kp_job_status(job_id):
+    """Статус задачи генерации КП (опрашивается страницей КП)"""
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Задача не найдена'}), 404
+    return jsonify(job_response(job))
+
+@app.route('/api/kp/jobs/<job_id>/download')
+@login_required
+def api_kp_job_download(job_id):
+    """Скачивание готового файла КП"""
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Задача не найдена'}), 404
+    if job['status'] != 'done' or not job['result_path']:
+        return jsonify({'success': False, 'error': 'Файл еще не готов'}), 409
+
+    extension, mimetype = KP_JOB_FORMATS[job['format']]
+    created = datetime.fromtimestamp(job['created_at'])
+    from flask import send_file
     try:
-        session_id = get_session_id()
-        
-        # Импортируем генератор
-        from kp_generator_pdf import KPPDFGenerator
-        
-        generator = KPPDFGenerator()
-        output_path = generator.generate(session_id)
-        
-        # Отправляем файл клиенту
-        from flask import send_file
         return send_file(
-            output_path,
+            job['result_path'],
             as_attachment=True,
-            download_name=f'КП_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf',
-            mimetype='application/pdf'
+            download_name=f'КП_{created.strftime("%Y%m%d_%H%M%S")}.{extension}',
+            mimetype=mimetype
         )
-    except ValueError as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'success': False, 'error': f'Ошибка генерации PDF: {str(e)}'}), 500
-
-@app.route('/api/kp/generate/google-sheets', methods=['POST'])
-@login_required
-def api_kp_generate_google_sheets():
-    """Генерирует Google Sheets коммерческого предложения"""
-    
-    try:
-        session_id = get_session_id()
-        
-        # Импортируем генератор
-        from kp_generator_google_sheets import KPGoogleSheetsGenerator
-        
-        generator = KPGoogleSheetsGenerator()
-        result = generator.generate(session_id)
-        
-        return jsonify({
-            'success': True,
-            'spreadsheet_url': result['spreadsheet_url'],
-            'spreadsheet_id': result['spreadsheet_id'],
-            'title': result['title']
-        })
-        
-    except ValueError as e:
-        return jsonify({'success': False, 'error': str(e)}), 400
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'success': False, 'error': f'Ошибка генерации Google Sheets: {str(e)}'}), 500
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'Файл удален, сформируйте КП заново'}), 410
 
 print("✅ [APP] API КП зарегистрирован (/api/kp/*)")
 
@@ -1465,7 +1249,7 @@ print("✅ [APP] API КП зарегистрирован (/api/kp/*)")
 @app.route('/api/search-by-image', methods=['POST'])
 @login_required
 def api_search_by_image():
-    """Поиск товаров по загруженному изображению через Hugging Face CLIP API"""
+    """Поиск товаров по загруженному изображению (CLIP embeddings + pgvector)"""
     
     print(f"📸 [IMAGE SEARCH] Получен запрос на поиск по изображению")
     
@@ -1495,159 +1279,36 @@ def api_search_by_image():
         # Загружаем изображение
         image_bytes = file.read()
         
-        # Генерируем image embedding через Hugging Face CLIP API
-        print(f"🔍 [IMAGE SEARCH] Генерация image embedding через Hugging Face...")
-        
-        HF_API_TOKEN = os.getenv('HUGGINGFACE_API_TOKEN')
-        if not HF_API_TOKEN:
+        # Генерируем image embedding (локальный CLIP или HF API, кэш по хэшу файла)
+        if not IMAGE_EMBEDDER:
             return jsonify({
                 'success': False,
-                'error': 'Не настроен HUGGINGFACE_API_TOKEN. Добавьте в переменные окружения.'
+                'error': 'Поиск по изображениям отключен (IMAGE_EMBEDDING_BACKEND).'
             }), 503
         
-        import requests
-        import base64
-        
-        # Используем модель которая дает embeddings размером 512 (как в БД)
-        # sentence-transformers/clip-ViT-B-32 = 512 dimensions
-        api_url = "https://api-inference.huggingface.co/models/sentence-transformers/clip-ViT-B-32"
-        headers = {"Authorization": f"Bearer {HF_API_TOKEN}"}
-        
+        print(f"🔍 [IMAGE SEARCH] Генерация image embedding ({IMAGE_EMBEDDER.backend.name})...")
         try:
-            # Отправляем изображение как binary data
-            print(f"   Отправка изображения в HF API...")
-            
-            # Кодируем изображение в base64 для JSON запроса
-            import io
-            from PIL import Image
-            
-            # Загружаем изображение
-            img = Image.open(io.BytesIO(image_bytes))
-            # Конвертируем в RGB если нужно
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Сохраняем обратно в bytes
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            # Пробуем отправить как data (не files)
-            print(f"   Попытка получить embedding (попытка 1 - data)...")
-            response = requests.post(
-                api_url,
-                headers=headers,
-                data=img_byte_arr,
-                timeout=60
-            )
-            
-            # Если 404, пробуем другой формат
-            if response.status_code == 404:
-                print(f"   Попытка 2 - json с base64...")
-                img_b64 = base64.b64encode(img_byte_arr).decode('utf-8')
-                response = requests.post(
-                    api_url,
-                    headers={**headers, "Content-Type": "application/json"},
-                    json={"inputs": img_b64},
-                    timeout=60
-                )
-            
-            print(f"   Статус ответа: {response.status_code}")
-            
-            if response.status_code == 503:
-                # Модель загружается (cold start)
-                return jsonify({
-                    'success': False,
-                    'error': 'Модель загружается. Подождите 20-30 секунд и попробуйте снова.',
-                    'retry': True
-                }), 503
-            
-            if response.status_code != 200:
-                print(f"   Ошибка HF API: {response.text}")
-                return jsonify({
-                    'success': False,
-                    'error': f'Ошибка Hugging Face API: {response.status_code}'
-                }), 503
-            
-            # Парсим ответ
-            result = response.json()
-            print(f"   Формат ответа: {type(result)}")
-            
-            # Обрабатываем разные форматы ответа
-            if isinstance(result, list):
-                # Формат: [[embedding]]
-                if isinstance(result[0], list):
-                    query_embedding = result[0]
-                else:
-                    query_embedding = result
-            elif isinstance(result, dict):
-                # Проверяем разные ключи
-                if 'embeddings' in result:
-                    query_embedding = result['embeddings'][0] if isinstance(result['embeddings'], list) else result['embeddings']
-                elif 'data' in result:
-                    query_embedding = result['data']
-                else:
-                    print(f"❌ Неожиданный формат dict: {result.keys()}")
-                    return jsonify({
-                        'success': False,
-                        'error': 'Неожиданный формат ответа от API'
-                    }), 500
-            else:
-                print(f"❌ Неожиданный тип ответа: {type(result)}")
-                return jsonify({
-                    'success': False,
-                    'error': 'Неожиданный формат ответа от API'
-                }), 500
-            
-            # Проверяем что получили список чисел
-            if not isinstance(query_embedding, list) or len(query_embedding) == 0:
-                print(f"❌ Неверный формат embedding: {type(query_embedding)}")
-                return jsonify({
-                    'success': False,
-                    'error': f'Неверный формат embedding от API'
-                }), 500
-            
-            embedding_size = len(query_embedding)
-            print(f"✅ [IMAGE SEARCH] Embedding получен успешно (размер: {embedding_size})")
-            
-            # CLIP модели могут выдавать 512 или 768 размерность
-            if embedding_size not in [512, 768]:
-                print(f"⚠️  [IMAGE SEARCH] Неожиданный размер embedding: {embedding_size}")
-                # Но продолжаем, возможно это правильный размер для этой модели
-            
-        except requests.exceptions.Timeout:
-            return jsonify({
-                'success': False,
-                'error': 'Timeout: модель не ответила вовремя. Попробуйте позже.',
-                'retry': True
-            }), 503
-        except Exception as e:
-            print(f"❌ [IMAGE SEARCH] Ошибка: {e}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({
-                'success': False,
-                'error': f'Ошибка при генерации embedding: {str(e)}'
-            }), 500
+            query_embedding = IMAGE_EMBEDDER.embed(image_bytes)
+        except ImageEmbeddingError as e:
+            print(f"❌ [IMAGE SEARCH] {e.message}")
+            response = {'success': False, 'error': e.message}
+            if e.retry:
+                response['retry'] = True
+            return jsonify(response), 503
         
-        # Ищем похожие ИЗОБРАЖЕНИЯ в pgvector БД
-        query_vector_str = '[' + ','.join(map(str, query_embedding)) + ']'
+        print(f"✅ [IMAGE SEARCH] Embedding получен успешно (размер: {len(query_embedding)})")
         
+        # Ищем похожие ИЗОБРАЖЕНИЯ в pgvector БД (см. vector_queries.py)
         with PGVECTOR_ENGINE.connect() as conn:
-            from sqlalchemy import text
-            sql_query = f"""
-                SELECT 
-                    ie.product_id,
-                    1 - (ie.image_embedding <=> '{query_vector_str}'::vector) as similarity
-                FROM image_embeddings ie
-                WHERE 1 - (ie.image_embedding <=> '{query_vector_str}'::vector) >= 0.3
-                ORDER BY ie.image_embedding <=> '{query_vector_str}'::vector
-                LIMIT 50
-            """
-            results = conn.execute(text(sql_query)).fetchall()
-        
-        # Извлекаем product_ids
-        product_ids = [row[0] for row in results]
+            results = nearest_products(conn, PRODUCT_IMAGE_INDEX, query_embedding, 50,
+                                       min_similarity=0.3)
+        
+        # У товара может быть несколько похожих изображений - берем лучшее (результаты по убыванию)
+        best = {}
+        for product_id, similarity in results:
+            best.setdefault(product_id, similarity)
+        ranked = list(best.items())
+        product_ids = list(best)
         
         print(f"✅ [IMAGE SEARCH] Найдено {len(product_ids)} похожих товаров")
         
@@ -1657,9 +1318,8 @@ def api_search_by_image():
                 'error': 'Не найдено похожих товаров. Попробуйте другое изображение.'
             }), 404
         
-        # Сохраняем product_ids в сессии
-        search_id = str(uuid.uuid4())
-        flask_session[f'image_search_{search_id}'] = product_ids
+        # Ранжирование - в серверный кэш (в cookie только search_id в ссылке)
+        search_id = save_image_search(ranked)
         
         return jsonify({
             'success': True, 
@@ -1674,7 +1334,8 @@ def api_search_by_image():
 
 print("✅ [APP] API поиска по изображению зарегистрирован (/api/search-by-image)")
 
-if __name__ == '__main__':
+def run_server():
+    """Waitress (или Flask dev server); запускается из server.py"""
     # Получаем порт из переменной окружения (Railway использует PORT)
     port = int(os.getenv('PORT', 5000))
     
@@ -1690,3 +1351,10 @@ if __name__ == '__main__':
     except ImportError:
         print("⚠️ Waitress не найден, используем Flask dev server")
         app.run(debug=False, host='0.0.0.0', port=port)
+
+
+if __name__ == '__main__':
+    # Воркеры генерации КП (spawn) импортируют __main__ заново - с app.py это
+    # повторный запуск всего приложения в каждом воркере, запускайте server.py
+    print("⚠️  [APP] Запуск через app.py: воркеры КП повторят запуск приложения - используйте server.py")
+    run_server()
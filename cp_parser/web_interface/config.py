@@ -5,7 +5,9 @@
 Конфигурация для веб-интерфейса парсера коммерческих предложений
 """
 
+import importlib.util
 import os
+import tempfile
 from pathlib import Path
 
 # Базовые настройки
@@ -17,15 +19,85 @@ PORT = int(os.getenv('PORT', 5000))
 PRODUCTS_PER_PAGE = int(os.getenv('PRODUCTS_PER_PAGE', 48))
 PROJECTS_PER_PAGE = int(os.getenv('PROJECTS_PER_PAGE', 20))
 
+# Кэш количества результатов списков (секунды) и закладок страниц для keyset-пагинации
+LISTING_COUNT_CACHE_TTL = int(os.getenv('LISTING_COUNT_CACHE_TTL', 60))
+LISTING_BOOKMARK_CACHE_TTL = int(os.getenv('LISTING_BOOKMARK_CACHE_TTL', 600))
+
+# Статистика главной страницы / /api/stats в общем кэше воркеров (секунды)
+# Парсеры сбрасывают ее сами после записи проекта
+DASHBOARD_STATS_CACHE_TTL = int(os.getenv('DASHBOARD_STATS_CACHE_TTL', 300))
+
+# Embeddings поисковых запросов (векторный поиск)
+# EMBEDDING_API_BASE_URL - OpenAI-совместимый сервер (пусто = api.openai.com,
+# для тестов - embedding_stub_server.py: http://127.0.0.1:8765/v1)
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+EMBEDDING_API_BASE_URL = os.getenv('EMBEDDING_API_BASE_URL', '')
+EMBEDDING_TIMEOUT = float(os.getenv('EMBEDDING_TIMEOUT', 3.0))
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 5000))
+EMBEDDING_CACHE_PATH = os.getenv(
+    'EMBEDDING_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'cp_parser_embeddings.sqlite3')
+)
+
+# Точность ANN-поиска pgvector (0 = значение сервера): ivfflat.probes, hnsw.ef_search
+VECTOR_IVFFLAT_PROBES = int(os.getenv('VECTOR_IVFFLAT_PROBES', 0)) or None
+VECTOR_HNSW_EF_SEARCH = int(os.getenv('VECTOR_HNSW_EF_SEARCH', 0)) or None
+
+# Локальный векторный индекс (numpy memmap) - когда pgvector недоступен
+LOCAL_VECTOR_INDEX_ENABLED = os.getenv('LOCAL_VECTOR_INDEX_ENABLED', 'False').lower() == 'true'
+LOCAL_VECTOR_INDEX_REFRESH_SECONDS = int(os.getenv('LOCAL_VECTOR_INDEX_REFRESH_SECONDS', 60))
+
+# Embeddings изображений для поиска по картинке (см. image_embeddings.py)
+# local - CLIP на CPU (sentence-transformers), huggingface - HF Inference API, пусто - выключено
+# По умолчанию: huggingface при HUGGINGFACE_API_TOKEN, local - только если
+# sentence-transformers установлен (в requirements.txt он закомментирован), иначе выключено
+if os.getenv('HUGGINGFACE_API_TOKEN'):
+    _DEFAULT_IMAGE_EMBEDDING_BACKEND = 'huggingface'
+elif importlib.util.find_spec('sentence_transformers') is not None:
+    _DEFAULT_IMAGE_EMBEDDING_BACKEND = 'local'
+else:
+    _DEFAULT_IMAGE_EMBEDDING_BACKEND = ''
+IMAGE_EMBEDDING_BACKEND = os.getenv('IMAGE_EMBEDDING_BACKEND', _DEFAULT_IMAGE_EMBEDDING_BACKEND).lower()
+IMAGE_EMBEDDING_MODEL = os.getenv('IMAGE_EMBEDDING_MODEL', 'clip-ViT-B-32')
+IMAGE_EMBEDDING_TIMEOUT = float(os.getenv('IMAGE_EMBEDDING_TIMEOUT', 20))
+IMAGE_EMBEDDING_CACHE_SIZE = int(os.getenv('IMAGE_EMBEDDING_CACHE_SIZE', 500))
+IMAGE_EMBEDDING_BATCH_SIZE = int(os.getenv('IMAGE_EMBEDDING_BATCH_SIZE', 32))
+
+# Сколько хранятся результаты поиска по изображению (ссылка /products?image_search=...), секунды
+IMAGE_SEARCH_RESULTS_TTL = int(os.getenv('IMAGE_SEARCH_RESULTS_TTL', 3600))
+
 # Настройки облачного хранилища
 CLOUD_STORAGE_ENABLED = os.getenv('CLOUD_STORAGE_ENABLED', 'True').lower() == 'true'
 S3_BASE_URL = os.getenv('S3_BASE_URL', 'https://s3.ru1.storage.beget.cloud/73d16f7545b3-promogoods')
 CLOUD_IMAGES_PREFIX = os.getenv('CLOUD_IMAGES_PREFIX', 'images/')
 
+# /images/<файл> через прокси с дисковым кэшем (image_proxy.py); False - редирект на S3
+IMAGE_PROXY_ENABLED = os.getenv('IMAGE_PROXY_ENABLED', 'True').lower() == 'true'
+IMAGE_PROXY_CACHE_MAX_MB = int(os.getenv('IMAGE_PROXY_CACHE_MAX_MB', 2048))
+# Как часто сверять закэшированный файл с S3 (ETag), секунды
+IMAGE_PROXY_REVALIDATE_SECONDS = int(os.getenv('IMAGE_PROXY_REVALIDATE_SECONDS', 3600))
+# Потоки загрузки из S3 (общий пул соединений) и сколько запрос ждет загрузку
+IMAGE_PROXY_WORKERS = int(os.getenv('IMAGE_PROXY_WORKERS', 8))
+IMAGE_PROXY_TIMEOUT = float(os.getenv('IMAGE_PROXY_TIMEOUT', 10))
+# Допустимые ширины превью (/images/<файл>?w=320), запрошенная округляется вверх
+IMAGE_PROXY_THUMB_WIDTHS = (160, 320, 640, 1280)
+
+# Фоновая генерация КП (kp_jobs.py): процессов на воркер веб-сервера, задач на процесс до перезапуска
+KP_JOB_WORKERS = int(os.getenv('KP_JOB_WORKERS', 2))
+KP_JOB_TASKS_PER_WORKER = int(os.getenv('KP_JOB_TASKS_PER_WORKER', 20))
+# Генерация дольше KP_JOB_TIMEOUT (от старта) или ожидание в очереди дольше
+# KP_JOB_QUEUE_TIMEOUT считается упавшей; готовые файлы хранятся KP_JOB_FILE_TTL, секунды
+KP_JOB_TIMEOUT = int(os.getenv('KP_JOB_TIMEOUT', 900))
+KP_JOB_QUEUE_TIMEOUT = int(os.getenv('KP_JOB_QUEUE_TIMEOUT', 3600))
+KP_JOB_FILE_TTL = int(os.getenv('KP_JOB_FILE_TTL', 86400))
+
 # Локальные пути
 PROJECT_ROOT = Path(__file__).parent.parent
 STORAGE_DIR = PROJECT_ROOT / "storage"
 IMAGES_DIR = STORAGE_DIR / "images"
+LOCAL_VECTOR_INDEX_DIR = Path(os.getenv('LOCAL_VECTOR_INDEX_DIR', STORAGE_DIR / "vector_index"))
+IMAGE_PROXY_CACHE_DIR = Path(os.getenv('IMAGE_PROXY_CACHE_DIR', STORAGE_DIR / "image_cache"))
+KP_JOBS_DIR = Path(os.getenv('KP_JOBS_DIR', STORAGE_DIR / "kp_jobs"))
 
 # Настройки базы данных
 # Railway предоставляет DATABASE_URL или DATABASE_PUBLIC_URL
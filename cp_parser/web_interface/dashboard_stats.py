@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Статистика главной страницы и /api/stats
+
+Раньше /api/stats на каждый запрос делал 5 × session.query(...).count() -
+последовательное сканирование products / price_offers / product_images.
+
+Теперь:
+- значение лежит в общем кэше (database/stats_cache.py, SQLite-файл):
+  один подсчет на все воркеры gunicorn за DASHBOARD_STATS_CACHE_TTL
+- парсеры сбрасывают кэш после записи проекта
+- сам подсчет - один запрос; с project_stats (database/create_project_stats.py)
+  это сумма счетчиков проектов, а не COUNT(*) по большим таблицам
+"""
+
+from sqlalchemy import text
+
+from config import DASHBOARD_STATS_CACHE_TTL
+from database.stats_cache import DASHBOARD_STATS_KEY, stats_cache
+from project_stats import project_stats_available
+
+
+def _count_stats(session):
+    """Считает статистику одним запросом"""
+    if project_stats_available(session):
+        row = session.execute(text("""
+            SELECT (SELECT COUNT(*) FROM projects),
+                   (SELECT COUNT(*) FROM projects WHERE parsing_status = 'complete'),
+                   COALESCE(SUM(ps.products_count), 0),
+                   COALESCE(SUM(ps.offers_count), 0),
+                   COALESCE(SUM(ps.images_count), 0)
+            FROM project_stats ps
+        """)).fetchone()
+    else:
+        row = session.execute(text("""
+            SELECT (SELECT COUNT(*) FROM projects),
+                   (SELECT COUNT(*) FROM projects WHERE parsing_status = 'complete'),
+                   (SELECT COUNT(*) FROM products),
+                   (SELECT COUNT(*) FROM price_offers),
+                   (SELECT COUNT(*) FROM product_images)
+        """)).fetchone()
+
+    return {
+        'projects': int(row[0]),
+        'completed_projects': int(row[1]),
+        'products': int(row[2]),
+        'offers': int(row[3]),
+        'images': int(row[4]),
+    }
+
+
+def get_dashboard_stats(session):
+    """Статистика из общего кэша; при промахе - подсчет и запись в кэш"""
+    stats = stats_cache.get(DASHBOARD_STATS_KEY)
+    if stats is None:
+        stats = _count_stats(session)
+        stats_cache.set(DASHBOARD_STATS_KEY, stats, DASHBOARD_STATS_CACHE_TTL)
+    return stats
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Локальная заглушка OpenAI Embeddings API для тестов векторного поиска
+
+Отвечает на POST /v1/embeddings в формате OpenAI. Вектор детерминирован:
+одинаковый текст → одинаковый вектор (единичной длины), без сети и ключа.
+Считает запросы - видно, сколько раз клиент реально ходил в API.
+
+Запуск:
+    python embedding_stub_server.py                # http://127.0.0.1:8765/v1
+    python embedding_stub_server.py --port 9000 --dim 512
+
+В веб-интерфейсе:
+    EMBEDDING_API_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub python app.py
+"""
+
+import hashlib
+import json
+import math
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8765
+DEFAULT_DIM = 1536
+
+
+def stub_embedding(text, dim=DEFAULT_DIM):
+    """Детерминированный единичный вектор для текста"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'big')
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class EmbeddingStubHandler(BaseHTTPRequestHandler):
+    dim = DEFAULT_DIM
+    requests_served = 0
+    inputs_served = 0
+    _lock = threading.Lock()
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ('/v1/embeddings', '/embeddings'):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        inputs = body.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+
+        with self._lock:
+            EmbeddingStubHandler.requests_served += 1
+            EmbeddingStubHandler.inputs_served += len(inputs)
+
+        payload = json.dumps({
+            'object': 'list',
+            'model': body.get('model', 'stub'),
+            'data': [
+                {'object': 'embedding', 'index': i, 'embedding': stub_embedding(str(text), self.dim)}
+                for i, text in enumerate(inputs)
+            ],
+            'usage': {'prompt_tokens': 0, 'total_tokens': 0},
+        }).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        # Счетчики для проверок в тестах
+        payload = json.dumps({
+            'requests': EmbeddingStubHandler.requests_served,
+            'inputs': EmbeddingStubHandler.inputs_served,
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(port=DEFAULT_PORT, dim=DEFAULT_DIM):
+    """Запускает заглушку в фоновом потоке, возвращает сервер (server.shutdown() - стоп)"""
+    EmbeddingStubHandler.dim = dim
+    server = ThreadingHTTPServer(('127.0.0.1', port), EmbeddingStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    port = DEFAULT_PORT
+    dim = DEFAULT_DIM
+    if '--port' in sys.argv:
+        port = int(sys.argv[sys.argv.index('--port') + 1])
+    if '--dim' in sys.argv:
+        dim = int(sys.argv[sys.argv.index('--dim') + 1])
+
+    EmbeddingStubHandler.dim = dim
+    server = ThreadingHTTPServer(('127.0.0.1', port), EmbeddingStubHandler)
+    print(f"🧪 Заглушка embeddings: http://127.0.0.1:{port}/v1 (dim={dim})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Остановлено")
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Embeddings поисковых запросов: кэш + один HTTP-клиент на процесс
+
+Раньше generate_search_embedding / vector_search_pgvector на каждый вызов
+создавали новый OpenAI-клиент (новое TLS-соединение) и заново считали
+embedding одинаковых запросов - из-за этого векторный поиск и отключили.
+
+Теперь:
+- ключ кэша = (модель, нормализованный запрос: регистр и пробелы не важны)
+- уровень 1: LRU в памяти процесса
+- уровень 2: SQLite-файл на диске (общий для воркеров gunicorn, переживает рестарт)
+- промахи считаются ОДНИМ запросом к API (embed_many), клиент httpx с пулом
+  соединений создается один раз на процесс
+- EMBEDDING_API_BASE_URL - OpenAI-совместимый сервер вместо api.openai.com
+  (для тестов: embedding_stub_server.py)
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from config import (
+    EMBEDDING_MODEL, EMBEDDING_API_BASE_URL, EMBEDDING_TIMEOUT,
+    EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH
+)
+
+# Ограничение API на длину одного входа (символы, с запасом)
+MAX_INPUT_CHARS = 8000
+# Сколько запросов отправлять в одном вызове API
+MAX_BATCH_SIZE = 256
+
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_query(query):
+    """'  Кружка  ЭМАЛИРОВАННАЯ ' → 'кружка эмалированная'"""
+    return _SPACES.sub(' ', (query or '').strip().lower())[:MAX_INPUT_CHARS]
+
+
+def cache_key(model, normalized_query):
+    return hashlib.sha1(f"{model}\n{normalized_query}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Двухуровневый кэш: LRU в памяти + SQLite на диске"""
+
+    def __init__(self, maxsize=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH):
+        self.maxsize = maxsize
+        self.path = path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Соединение на каждый вызов: безопасно после fork воркеров gunicorn
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        return conn
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """{key: vector} для найденных ключей (память, затем диск)"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.path:
+            try:
+                conn = self._connect()
+                try:
+                    placeholders = ','.join('?' * len(missing))
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                        missing
+                    ).fetchall()
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"⚠️  [EMBEDDINGS] Чтение кэша {self.path}: {e}")
+                rows = []
+
+            for key, blob in rows:
+                vector = array('f', blob).tolist()
+                self._remember(key, vector)
+                found[key] = vector
+
+        return found
+
+    def set_many(self, vectors):
+        """vectors: {key: vector}"""
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+
+        if not vectors or not self.path:
+            return
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                        [(key, array('f', vector).tobytes(), time.time())
+                         for key, vector in vectors.items()]
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️  [EMBEDDINGS] Запись кэша {self.path}: {e}")
+
+
+class EmbeddingClient:
+    """
+    Embeddings запросов через OpenAI-совместимый API с кэшем
+
+    Использование:
+        client = EmbeddingClient(api_key)
+        vector = client.embed('кружка')                 # list[float] или None
+        vectors = client.embed_many(['кружка', 'ручка'])  # в порядке запросов
+    """
+
+    def __init__(self, api_key, base_url=EMBEDDING_API_BASE_URL, model=EMBEDDING_MODEL,
+                 timeout=EMBEDDING_TIMEOUT, cache=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.cache = cache or EmbeddingCache()
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _openai(self):
+        """Один клиент (и пул соединений httpx) на процесс, создается при первом запросе"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import httpx
+                    from openai import OpenAI
+
+                    self._client = OpenAI(
+                        api_key=self.api_key,
+                        base_url=self.base_url or None,
+                        max_retries=1,
+                        http_client=httpx.Client(
+                            timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+                        ),
+                    )
+        return self._client
+
+    def embed(self, query):
+        return self.embed_many([query])[0]
+
+    def embed_many(self, queries):
+        """Embeddings для списка запросов; None на месте пустых и при ошибке API"""
+        normalized = [normalize_query(query) for query in queries]
+        keys = [cache_key(self.model, text) if text else None for text in normalized]
+
+        vectors = self.cache.get_many([key for key in keys if key])
+
+        # Промахи: каждый уникальный текст - один раз
+        missing = OrderedDict()
+        for key, text in zip(keys, normalized):
+            if key and key not in vectors:
+                missing[key] = text
+
+        if missing:
+            cached = len(vectors)
+            started = time.time()
+            computed = {}
+            try:
+                items = list(missing.items())
+                for start in range(0, len(items), MAX_BATCH_SIZE):
+                    batch = items[start:start + MAX_BATCH_SIZE]
+                    response = self._openai().embeddings.create(
+                        model=self.model,
+                        input=[text for _, text in batch]
+                    )
+                    for item in response.data:
+                        computed[batch[item.index][0]] = item.embedding
+            except Exception as e:
+                print(f"⚠️  [EMBEDDINGS] Ошибка API: {e}")
+
+            self.cache.set_many(computed)
+            vectors.update(computed)
+            print(f"🧮 [EMBEDDINGS] Посчитано {len(computed)}/{len(missing)} "
+                  f"(из кэша {cached}) за {time.time() - started:.2f}с")
+
+        return [vectors.get(key) if key else None for key in keys]
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Embeddings изображений для поиска по картинке (/api/search-by-image)
+
+Раньше каждая загрузка уходила в Hugging Face Inference API (таймаут 60с,
+повтор с base64 на 404, 503 на холодном старте модели) - задержка
+непредсказуемая, без интернета поиск не работает.
+
+Теперь бэкенд выбирается в IMAGE_EMBEDDING_BACKEND:
+    local       - CLIP (sentence-transformers clip-ViT-B-32, 512) на CPU,
+                  модель загружается один раз на воркер
+    huggingface - прежний HF Inference API (нужен HUGGINGFACE_API_TOKEN)
+    (пусто)     - поиск по картинке выключен
+Без явного значения: huggingface при HUGGINGFACE_API_TOKEN, local - если
+установлен sentence-transformers, иначе выключено.
+
+Общее для бэкендов:
+- preprocess_image(): декодирование + RGB + уменьшение до размера модели
+  (чистая функция - ее же использует пакетный индексатор в пуле процессов)
+- embed_many(): пачка изображений за один вызов модели
+- кэш по sha256 байтов файла: повторная загрузка той же картинки не
+  декодируется и не считается заново
+- warm_up(): загрузка модели в фоне при старте воркера; запрос ждет ее
+  не дольше IMAGE_EMBEDDING_TIMEOUT, а не блокирует запуск приложения
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    IMAGE_EMBEDDING_BACKEND, IMAGE_EMBEDDING_MODEL, IMAGE_EMBEDDING_TIMEOUT,
+    IMAGE_EMBEDDING_CACHE_SIZE, IMAGE_EMBEDDING_BATCH_SIZE
+)
+
+# CLIP ViT-B-32 работает с 224×224 - больше декодировать незачем
+MODEL_IMAGE_SIZE = 224
+
+HF_API_URL = "https://api-inference.huggingface.co/models/sentence-transformers/clip-ViT-B-32"
+
+
+class ImageEmbeddingError(Exception):
+    """Embedding не получен; message - для пользователя, retry - имеет смысл повторить"""
+
+    def __init__(self, message, retry=False):
+        super().__init__(message)
+        self.message = message
+        self.retry = retry
+
+
+def image_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def preprocess_image(image_bytes, size=MODEL_IMAGE_SIZE):
+    """Байты файла → PIL.Image RGB, короткая сторона ~size (draft для JPEG)"""
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(image_bytes))
+    # JPEG декодируется сразу в уменьшенном масштабе - в разы быстрее полного
+    img.draft('RGB', (size * 2, size * 2))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    scale = size / min(img.size)
+    if scale < 1:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                         Image.BICUBIC)
+    return img
+
+
+class LocalClipBackend:
+    """CLIP на CPU через sentence-transformers"""
+
+    name = 'local'
+
+    def __init__(self, model_name=IMAGE_EMBEDDING_MODEL):
+        self.model_name = model_name
+        self.model = None
+
+    def load(self):
+        from sentence_transformers import SentenceTransformer
+
+        started = time.time()
+        self.model = SentenceTransformer(self.model_name, device='cpu')
+        print(f"✅ [IMAGE EMBEDDINGS] CLIP {self.model_name} загружена за {time.time() - started:.1f}с")
+
+    def embed_images(self, images):
+        vectors = self.model.encode(
+            images, batch_size=IMAGE_EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+        )
+        return [vector.tolist() for vector in vectors]
+
+
+class HuggingFaceBackend:
+    """Hugging Face Inference API (по одному изображению на запрос)"""
+
+    name = 'huggingface'
+
+    def __init__(self):
+        self.token = os.getenv('HUGGINGFACE_API_TOKEN')
+        self.http = None
+
+    def load(self):
+        import requests
+
+        if not self.token:
+            raise ImageEmbeddingError('Не настроен HUGGINGFACE_API_TOKEN. Добавьте в переменные окружения.')
+        # Одна сессия - keep-alive к HF между запросами
+        self.http = requests.Session()
+        self.http.headers['Authorization'] = f"Bearer {self.token}"
+
+    def embed_images(self, images):
+        import requests
+
+        vectors = []
+        for img in images:
+            buffer = io.BytesIO()
+            img.save(buffer, format='PNG')
+            try:
+                response = self.http.post(HF_API_URL, data=buffer.getvalue(),
+                                          timeout=IMAGE_EMBEDDING_TIMEOUT)
+            except requests.exceptions.Timeout:
+                raise ImageEmbeddingError('Timeout: модель не ответила вовремя. Попробуйте позже.', retry=True)
+
+            if response.status_code == 503:
+                raise ImageEmbeddingError('Модель загружается. Подождите 20-30 секунд и попробуйте снова.',
+                                          retry=True)
+            if response.status_code != 200:
+                print(f"   Ошибка HF API: {response.text[:500]}")
+                raise ImageEmbeddingError(f'Ошибка Hugging Face API: {response.status_code}')
+
+            result = response.json()
+            # Форматы ответа: [[embedding]], [embedding], {'embeddings': [...]}
+            if isinstance(result, dict):
+                result = result.get('embeddings') or result.get('data')
+            if isinstance(result, list) and result and isinstance(result[0], list):
+                result = result[0]
+            if not isinstance(result, list) or not result:
+                raise ImageEmbeddingError('Неожиданный формат ответа от API')
+            vectors.append(result)
+        return vectors
+
+
+BACKENDS = {
+    'local': LocalClipBackend,
+    'huggingface': HuggingFaceBackend,
+}
+
+
+class ImageEmbedder:
+    """
+    Бэкенд + кэш по хэшу изображения
+
+    Использование:
+        embedder = get_image_embedder()          # None - поиск по картинке выключен
+        vector = embedder.embed(image_bytes)     # ImageEmbeddingError при ошибке
+        vectors = embedder.embed_many([bytes1, bytes2])
+    """
+
+    def __init__(self, backend, cache_size=IMAGE_EMBEDDING_CACHE_SIZE):
+        self.backend = backend
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._load_started = False
+        self._start_lock = threading.Lock()
+        self._load_error = None
+
+    # ===== ЗАГРУЗКА МОДЕЛИ =====
+
+    def _load(self):
+        try:
+            self.backend.load()
+            # Первый прогон прогревает веса и пулы потоков
+            if isinstance(self.backend, LocalClipBackend):
+                from PIL import Image
+                self.backend.embed_images([Image.new('RGB', (MODEL_IMAGE_SIZE, MODEL_IMAGE_SIZE))])
+        except Exception as e:
+            print(f"⚠️  [IMAGE EMBEDDINGS] Бэкенд {self.backend.name} недоступен: {e}")
+            self._load_error = e
+        finally:
+            self._loaded.set()
+
+    def warm_up(self):
+        """Загрузка модели в фоновом потоке (не блокирует старт воркера), один раз"""
+        with self._start_lock:
+            if self._load_started:
+                return
+            self._load_started = True
+        threading.Thread(target=self._load, daemon=True, name='image-embeddings-warmup').start()
+
+    def _ready(self):
+        """Ждет загрузку модели не дольше IMAGE_EMBEDDING_TIMEOUT"""
+        if not self._loaded.is_set():
+            self.warm_up()
+            if not self._loaded.wait(IMAGE_EMBEDDING_TIMEOUT):
+                raise ImageEmbeddingError('Модель поиска по изображениям загружается. '
+                                          'Попробуйте через несколько секунд.', retry=True)
+        if self._load_error is not None:
+            if isinstance(self._load_error, ImageEmbeddingError):
+                raise self._load_error
+            raise ImageEmbeddingError(f'Поиск по изображениям недоступен: {self._load_error}')
+
+    # ===== EMBEDDINGS =====
+
+    def embed(self, image_bytes):
+        return self.embed_many([image_bytes])[0]
+
+    def embed_many(self, images_bytes):
+        """Embeddings в порядке входа; кэш по sha256, промахи - одним вызовом бэкенда"""
+        keys = [image_hash(data) for data in images_bytes]
+
+        vectors = {}
+        with self._cache_lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    vectors[key] = self._cache[key]
+
+        missing = OrderedDict((key, data) for key, data in zip(keys, images_bytes) if key not in vectors)
+        if missing:
+            self._ready()
+
+            images = []
+            for data in missing.values():
+                try:
+                    images.append(preprocess_image(data))
+                except Exception as e:
+                    raise ImageEmbeddingError(f'Не удалось прочитать изображение: {e}')
+
+            started = time.time()
+            computed = self.backend.embed_images(images)
+            print(f"🖼️  [IMAGE EMBEDDINGS] {len(computed)} шт. ({self.backend.name}) "
+                  f"за {(time.time() - started) * 1000:.0f}мс")
+
+            with self._cache_lock:
+                for key, vector in zip(missing, computed):
+                    vectors[key] = vector
+                    self._cache[key] = vector
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return [vectors[key] for key in keys]
+
+
+_embedder = None
+
+
+def get_image_embedder():
+    """Embedder процесса по IMAGE_EMBEDDING_BACKEND или None (выключен)"""
+    global _embedder
+    if _embedder is None and IMAGE_EMBEDDING_BACKEND:
+        backend_class = BACKENDS.get(IMAGE_EMBEDDING_BACKEND)
+        if backend_class is None:
+            print(f"⚠️  [IMAGE EMBEDDINGS] Неизвестный IMAGE_EMBEDDING_BACKEND={IMAGE_EMBEDDING_BACKEND}")
+            return None
+        _embedder = ImageEmbedder(backend_class())
+    return _embedder
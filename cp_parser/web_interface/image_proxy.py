@@ -2,100 +2,309 @@
 # -*- coding: utf-8 -*-
 
 """
-Прокси для изображений из S3 хранилища с аутентификацией
+Прокси для изображений из S3 хранилища (/images/<файл>) с дисковым кэшем
+
+Раньше каждый запрос синхронно читал объект из S3 внутри sync-воркера
+gunicorn (4 воркера, таймаут 120с): страница из 24 превью занимала все воркеры.
+
+Теперь:
+- файлы лежат в дисковом LRU-кэше (database/disk_cache.py,
+  IMAGE_PROXY_CACHE_DIR, не больше IMAGE_PROXY_CACHE_MAX_MB) - повторные
+  запросы не ходят в S3 и отдаются send_file с ETag / Last-Modified (304)
+- раз в IMAGE_PROXY_REVALIDATE_SECONDS файл сверяется с S3 условным
+  запросом (IfNoneMatch): не изменился - 304 без тела; S3 недоступен -
+  отдаем то, что в кэше
+- загрузка из S3 - в общем пуле потоков (IMAGE_PROXY_WORKERS) с одним
+  boto3-клиентом и пулом соединений; одновременные запросы одного файла
+  ждут одну загрузку; запрос ждет не дольше IMAGE_PROXY_TIMEOUT, потом
+  редирект на публичный URL S3 (загрузка в кэш продолжается в фоне)
+- превью: /images/<файл>?w=320 - уменьшенная копия создается при первом
+  запросе и кэшируется (ширина округляется до IMAGE_PROXY_THUMB_WIDTHS)
 """
 
-import boto3
-from botocore.exceptions import ClientError
 import io
-from flask import Response, abort
+import os
+import sys
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from email.utils import parsedate_to_datetime, format_datetime
+
+from flask import abort, redirect, send_file
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (
+    S3_BASE_URL, CLOUD_IMAGES_PREFIX, IMAGE_PROXY_CACHE_DIR, IMAGE_PROXY_CACHE_MAX_MB,
+    IMAGE_PROXY_REVALIDATE_SECONDS, IMAGE_PROXY_WORKERS, IMAGE_PROXY_TIMEOUT,
+    IMAGE_PROXY_THUMB_WIDTHS
+)
+from database.disk_cache import DiskLRUCache
 
 # Настройки S3
-S3_ACCESS_KEY = 'RECD00AQJIM4300MLJ0W'
-S3_SECRET_KEY = 'FIucJ3i9iIWZ5ieJvabvI0OxEn2Yv4gG5XRUeSNf'
-S3_BUCKET = '73d16f7545b3-promogoods'
+S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', 'RECD00AQJIM4300MLJ0W')
+S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', 'FIucJ3i9iIWZ5ieJvabvI0OxEn2Yv4gG5XRUeSNf')
+S3_BUCKET = os.getenv('S3_BUCKET', '73d16f7545b3-promogoods')
 S3_REGION = 'ru1'
 S3_ENDPOINT = 'https://s3.ru1.storage.beget.cloud'
 
-# Создаем S3 клиент
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=S3_ACCESS_KEY,
-    aws_secret_access_key=S3_SECRET_KEY,
-    region_name=S3_REGION,
-    endpoint_url=S3_ENDPOINT,
-    config=boto3.session.Config(
-        signature_version='s3v4',
-        s3={'addressing_style': 'path'}
-    )
-)
+# Сколько браузер может не перепроверять файл
+BROWSER_MAX_AGE = 86400
+
+image_cache = DiskLRUCache(IMAGE_PROXY_CACHE_DIR, IMAGE_PROXY_CACHE_MAX_MB * 1024 * 1024)
+
+_s3_client = None
+_s3_lock = threading.Lock()
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_PROXY_WORKERS, thread_name_prefix='s3-image')
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def get_s3_client():
+    """Один boto3-клиент на процесс: пул соединений на все потоки загрузки"""
+    global _s3_client
+    with _s3_lock:
+        if _s3_client is None:
+            import boto3
+            from botocore.config import Config
+
+            _s3_client = boto3.client(
+                's3',
+                aws_access_key_id=S3_ACCESS_KEY,
+                aws_secret_access_key=S3_SECRET_KEY,
+                region_name=S3_REGION,
+                endpoint_url=S3_ENDPOINT,
+                config=Config(
+                    signature_version='s3v4',
+                    s3={'addressing_style': 'path'},
+                    max_pool_connections=IMAGE_PROXY_WORKERS,
+                    connect_timeout=5,
+                    read_timeout=IMAGE_PROXY_TIMEOUT,
+                    retries={'max_attempts': 2}
+                )
+            )
+    return _s3_client
+
+
+def _s3_key(filename):
+    return f"{CLOUD_IMAGES_PREFIX}{filename}"
+
+
+# ===== ЗАГРУЗКА (в потоках пула) =====
+
+def _fetch_original(filename):
+    """(путь в кэше, метаданные) оригинала или None; ревалидация по ETag"""
+    from botocore.exceptions import ClientError, BotoCoreError
+
+    key = _s3_key(filename)
+    cached = image_cache.get(key)
+    if cached and time.time() - cached[1].get('checked_at', 0) < IMAGE_PROXY_REVALIDATE_SECONDS:
+        return cached
+
+    request = {'Bucket': S3_BUCKET, 'Key': key}
+    if cached and cached[1].get('etag'):
+        request['IfNoneMatch'] = cached[1]['etag']
 
-def get_image_from_s3(filename):
-    """Получает изображение из S3 хранилища"""
     try:
-        # Формируем ключ файла
-        s3_key = f"images/{filename}"
-        
-        # Получаем объект из S3
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)
-        
-        # Читаем содержимое
-        image_data = response['Body'].read()
-        
-        # Получаем метаданные
-        content_type = response.get('ContentType', 'image/jpeg')
-        content_length = response.get('ContentLength', len(image_data))
-        
-        return image_data, content_type, content_length
-        
+        response = get_s3_client().get_object(**request)
     except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'NoSuchKey':
+        code = str(e.response.get('Error', {}).get('Code'))
+        if cached and code in ('304', 'NotModified'):
+            meta = dict(cached[1], checked_at=time.time())
+            image_cache.update_meta(key, meta)
+            return cached[0], meta
+        if code in ('NoSuchKey', '404'):
             logging.warning(f"Файл не найден в S3: {filename}")
-            return None, None, None
-        else:
-            logging.error(f"Ошибка S3 для файла {filename}: {e}")
-            return None, None, None
+            image_cache.delete(key)
+            return None
+        logging.error(f"Ошибка S3 для файла {filename}: {e}")
+        return cached
+    except (BotoCoreError, OSError) as e:
+        # Сеть / таймаут: лучше устаревший файл, чем ошибка
+        logging.error(f"S3 недоступен для файла {filename}: {e}")
+        return cached
+
+    data = response['Body'].read()
+    last_modified = response.get('LastModified')
+    meta = {
+        'content_type': response.get('ContentType') or 'image/jpeg',
+        'etag': response.get('ETag'),
+        'last_modified': format_datetime(last_modified, usegmt=True) if last_modified else None,
+        'checked_at': time.time(),
+    }
+    path = image_cache.put(key, data, meta)
+    if path is None:
+        return None
+    return path, meta
+
+
+def _thumbnail_width(width):
+    """Запрошенная ширина → ближайшая допустимая сверху (None - оригинал)"""
+    if not width or width <= 0:
+        return None
+    for allowed in IMAGE_PROXY_THUMB_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return None
+
+
+def _fetch_thumbnail(filename, width):
+    """(путь в кэше, метаданные) превью; пересоздается, если оригинал изменился"""
+    from PIL import Image
+
+    original = _fetch_original(filename)
+    if original is None:
+        return None
+    source_path, source_meta = original
+
+    key = f"{_s3_key(filename)}?w={width}"
+    cached = image_cache.get(key)
+    if cached and cached[1].get('source_etag') == source_meta.get('etag'):
+        return cached
+
+    try:
+        buffer = io.BytesIO()
+        with Image.open(source_path) as img:
+            # JPEG декодируется сразу в уменьшенном масштабе
+            img.draft('RGB', (width, width * 4))
+            if img.width > width:
+                img.thumbnail((width, width * 4), Image.LANCZOS)
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img.save(buffer, format='PNG', optimize=True)
+                content_type = 'image/png'
+            else:
+                img.convert('RGB').save(buffer, format='JPEG', quality=82, optimize=True)
+                content_type = 'image/jpeg'
     except Exception as e:
-        logging.error(f"Критическая ошибка для файла {filename}: {e}")
+        # Не картинка / битый файл - отдаем оригинал
+        logging.warning(f"Превью {filename} (w={width}) не создано: {e}")
+        return original
+
+    meta = {
+        'content_type': content_type,
+        'etag': f'"{(source_meta.get("etag") or "").strip(chr(34))}-w{width}"',
+        'last_modified': source_meta.get('last_modified'),
+        'source_etag': source_meta.get('etag'),
+    }
+    path = image_cache.put(key, buffer.getvalue(), meta)
+    return (path, meta) if path else original
+
+
+def _load(filename, width):
+    if width:
+        return _fetch_thumbnail(filename, width)
+    return _fetch_original(filename)
+
+
+def _cached_fresh(filename, width):
+    """Свежий файл из кэша без похода в пул (обычный случай) или None"""
+    original = image_cache.get(_s3_key(filename))
+    if not original or time.time() - original[1].get('checked_at', 0) >= IMAGE_PROXY_REVALIDATE_SECONDS:
+        return None
+    if not width:
+        return original
+    thumbnail = image_cache.get(f"{_s3_key(filename)}?w={width}")
+    if thumbnail and thumbnail[1].get('source_etag') == original[1].get('etag'):
+        return thumbnail
+    return None
+
+
+def load_image(filename, width=None, timeout=IMAGE_PROXY_TIMEOUT):
+    """
+    (путь в кэше, метаданные) или None (нет в S3)
+    Загрузка - в пуле; одна на (файл, ширина), сколько бы запросов ее ни ждали.
+    FutureTimeout - не успели за timeout (загрузка продолжается).
+    """
+    cached = _cached_fresh(filename, width)
+    if cached is not None:
+        return cached
+
+    key = (filename, width)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _executor.submit(_load, filename, width)
+            _inflight[key] = future
+            future.add_done_callback(lambda _: _drop_inflight(key))
+    return future.result(timeout=timeout)
+
+
+def _drop_inflight(key):
+    with _inflight_lock:
+        _inflight.pop(key, None)
+
+
+def get_image_from_s3(filename):
+    """Байты изображения (через кэш): (data, content_type, content_length) или (None, None, None)"""
+    try:
+        loaded = load_image(filename)
+    except FutureTimeout:
+        loaded = None
+    if loaded is None:
         return None, None, None
+    path, meta = loaded
+    try:
+        with open(path, 'rb') as f:
+            image_data = f.read()
+    except OSError:
+        return None, None, None
+    return image_data, meta.get('content_type', 'image/jpeg'), len(image_data)
+
+
+def serve_image_proxy(filename, width=None):
+    """Отдает изображение (или превью ?w=) из дискового кэша"""
+    width = _thumbnail_width(width)
+    try:
+        loaded = load_image(filename, width)
+    except FutureTimeout:
+        print(f"⚠️  [IMAGE PROXY] {filename}: S3 не ответил за {IMAGE_PROXY_TIMEOUT}с - редирект")
+        return redirect(f"{S3_BASE_URL}/{_s3_key(filename)}")
 
-def serve_image_proxy(filename):
-    """Отдает изображение через прокси с аутентификацией"""
-    # Получаем изображение из S3
-    image_data, content_type, content_length = get_image_from_s3(filename)
-    
-    if image_data is None:
+    if loaded is None:
         abort(404)
-    
-    # Создаем ответ
-    response = Response(
-        image_data,
-        mimetype=content_type,
-        headers={
-            'Content-Length': str(content_length),
-            'Cache-Control': 'public, max-age=3600',  # Кэшируем на 1 час
-            'ETag': f'"{filename}"'
-        }
-    )
-    
+
+    path, meta = loaded
+    last_modified = None
+    if meta.get('last_modified'):
+        try:
+            last_modified = parsedate_to_datetime(meta['last_modified'])
+        except (TypeError, ValueError):
+            pass
+
+    try:
+        response = send_file(
+            path,
+            mimetype=meta.get('content_type', 'image/jpeg'),
+            conditional=True,
+            etag=(meta.get('etag') or '').strip('"') or True,
+            last_modified=last_modified,
+            max_age=BROWSER_MAX_AGE
+        )
+    except FileNotFoundError:
+        # Файл вытеснен другим процессом между поиском и отдачей
+        return redirect(f"{S3_BASE_URL}/{_s3_key(filename)}")
+    response.headers['Cache-Control'] = f'public, max-age={BROWSER_MAX_AGE}'
     return response
 
+
 def generate_presigned_url(filename, expiration=3600):
     """Генерирует подписанный URL для изображения"""
+    from botocore.exceptions import ClientError
+
     try:
-        s3_key = f"images/{filename}"
-        
+        s3_key = _s3_key(filename)
+
         # Генерируем подписанный URL
-        presigned_url = s3_client.generate_presigned_url(
+        presigned_url = get_s3_client().generate_presigned_url(
             'get_object',
             Params={'Bucket': S3_BUCKET, 'Key': s3_key},
             ExpiresIn=expiration
         )
-        
+
         return presigned_url
-        
+
     except ClientError as e:
         logging.error(f"Ошибка генерации подписанного URL для {filename}: {e}")
         return None
@@ -105,21 +314,23 @@ def generate_presigned_url(filename, expiration=3600):
 
 def test_s3_connection():
     """Тестирует соединение с S3"""
+    from botocore.exceptions import ClientError
+
     try:
         # Пробуем получить список объектов
-        response = s3_client.list_objects_v2(
+        response = get_s3_client().list_objects_v2(
             Bucket=S3_BUCKET,
-            Prefix='images/',
+            Prefix=CLOUD_IMAGES_PREFIX,
             MaxKeys=1
         )
-        
+
         if 'Contents' in response:
             print("✅ S3 соединение работает!")
             return True
         else:
             print("⚠️  S3 соединение работает, но папка images пуста")
             return True
-            
+
     except ClientError as e:
         print(f"❌ Ошибка S3 соединения: {e}")
         return False
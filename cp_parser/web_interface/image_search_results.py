@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Результаты поиска по изображению (/api/search-by-image → /products?image_search=<id>)
+
+Раньше список product_id лежал в flask_session - в подписанной cookie,
+которая ездила в каждом запросе, а /products фильтровал p.id IN :image_ids
+и терял порядок по сходству.
+
+Теперь результаты хранятся на сервере в общем кэше воркеров
+(database/stats_cache.py, SQLite-файл) под ключом search_id с TTL
+IMAGE_SEARCH_RESULTS_TTL: [(product_id, similarity)] по убыванию сходства.
+Листинг берет ранжирование отсюда и листает его по порядку (image_rank).
+"""
+
+import uuid
+
+from config import IMAGE_SEARCH_RESULTS_TTL
+from database.stats_cache import stats_cache
+
+KEY_PREFIX = 'image_search:'
+
+
+def save_image_search(results):
+    """[(product_id, similarity)] по убыванию сходства → search_id"""
+    search_id = str(uuid.uuid4())
+    stats_cache.set(
+        KEY_PREFIX + search_id,
+        [[int(product_id), round(float(similarity), 4)] for product_id, similarity in results],
+        IMAGE_SEARCH_RESULTS_TTL
+    )
+    return search_id
+
+
+def load_image_search(search_id):
+    """[(product_id, similarity)] или None (нет, протух, чужой формат id)"""
+    try:
+        search_id = str(uuid.UUID(search_id))
+    except (ValueError, TypeError):
+        return None
+    results = stats_cache.get(KEY_PREFIX + search_id)
+    if not results:
+        return None
+    return [(product_id, similarity) for product_id, similarity in results]
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Фоновая генерация КП (Excel / PDF / Google Sheets)
+
+Раньше /api/kp/generate/<формат> строил весь документ внутри запроса:
+большой КП занимал sync-воркер на десятки секунд и упирался в таймаут 120с.
+
+Теперь:
+- POST /api/kp/generate/<формат> ставит задачу и сразу отвечает job_id (202)
+- задача выполняется в пуле процессов (KP_JOB_WORKERS на воркер веб-сервера,
+  spawn - без fork потоков gunicorn; процесс пересоздается после
+  KP_JOB_TASKS_PER_WORKER задач, память больших PDF не копится).
+  spawn импортирует в процессе модуль __main__ заново, поэтому сервер
+  запускается через server.py / gunicorn, а не python app.py - иначе каждый
+  процесс пула повторял бы запуск приложения (БД, pgvector, загрузка CLIP)
+- состояние задач - SQLite-файл в KP_JOBS_DIR (видят все воркеры и
+  процессы пула): queued → running → done / failed
+- GET /api/kp/jobs/<job_id> - статус, GET /api/kp/jobs/<job_id>/download - файл
+- результат кэшируется по хэшу содержимого КП (товары, варианты цены,
+  изображения, дата документа): тот же КП в том же формате не генерируется
+  заново, а одинаковые задачи в работе не дублируются
+- файлы и задачи старше KP_JOB_FILE_TTL удаляются
+
+Таблицы:
+    generation_jobs - одна генерация на (формат, хэш содержимого); в очереди или
+                      в работе может быть только одна (уникальный частичный индекс)
+    job_links       - job_id, который видит пользователь: ссылка сессии на общую
+                      генерацию (у каждой сессии своя, доступ проверяется по ней)
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import sys
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from config import (
+    KP_JOBS_DIR, KP_JOB_WORKERS, KP_JOB_TASKS_PER_WORKER, KP_JOB_TIMEOUT,
+    KP_JOB_QUEUE_TIMEOUT, KP_JOB_FILE_TTL
+)
+
+# формат → (расширение файла, mimetype); Google Sheets - без файла (ссылка на таблицу)
+KP_JOB_FORMATS = {
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'pdf': ('pdf', 'application/pdf'),
+    'google-sheets': (None, None),
+}
+
+# Поля строк КП, не влияющие на документ (в хэш содержимого не входят)
+VOLATILE_FIELDS = ('kp_item_id', 'kp_quantity', 'added_at')
+
+JOBS_DB_PATH = os.path.join(str(KP_JOBS_DIR), 'jobs.sqlite3')
+FILES_DIR = os.path.join(str(KP_JOBS_DIR), 'files')
+
+_executor = None
+
+
+# ===== СОСТОЯНИЕ ЗАДАЧ (SQLite) =====
+
+def _connect():
+    # Соединение на каждый вызов: безопасно в воркерах gunicorn и в процессах пула.
+    # Транзакции - явные (BEGIN IMMEDIATE), см. _transaction
+    os.makedirs(FILES_DIR, exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            format TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result_path TEXT,
+            result_json TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_hash ON generation_jobs(format, content_hash)")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_generation_jobs_inflight
+        ON generation_jobs(format, content_hash) WHERE status IN ('queued', 'running')
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS job_links (
+            id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            job_id TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_job_links_job ON job_links(job_id)")
+    return conn
+
+
+class _transaction:
+    """BEGIN IMMEDIATE ... COMMIT / ROLLBACK: запись блокируется на всю транзакцию"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def get_job(link_id):
+    """Задача по job_id пользователя: поля генерации + id / session_id ссылки"""
+    conn = _connect()
+    try:
+        row = conn.execute("""
+            SELECT l.id, l.session_id, j.id as generation_id, j.format, j.content_hash, j.status,
+                   j.result_path, j.result_json, j.error, j.created_at, j.started_at, j.finished_at
+            FROM job_links l
+            JOIN generation_jobs j ON j.id = l.job_id
+            WHERE l.id = ?
+        """, (link_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row else None
+
+
+def _get_generation(generation_id):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM generation_jobs WHERE id = ?", (generation_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row else None
+
+
+def _update_generation(generation_id, **fields):
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    conn = _connect()
+    try:
+        with _transaction(conn):
+            conn.execute(f"UPDATE generation_jobs SET {assignments} WHERE id = ?",
+                         (*fields.values(), generation_id))
+    finally:
+        conn.close()
+
+
+def _is_stale(job, now=None):
+    """
+    Генерация зависла (процесс пула / воркер умер):
+    в работе дольше KP_JOB_TIMEOUT от старта или в очереди дольше KP_JOB_QUEUE_TIMEOUT
+    """
+    now = now or time.time()
+    if job['status'] == 'running':
+        return now - (job['started_at'] or job['created_at']) > KP_JOB_TIMEOUT
+    if job['status'] == 'queued':
+        return now - job['created_at'] > KP_JOB_QUEUE_TIMEOUT
+    return False
+
+
+def purge_old_jobs():
+    """
+    Удаляет ссылки старше KP_JOB_FILE_TTL, генерации без ссылок и их файлы
+    (файл общий для генераций с тем же хэшем - удаляется, когда на него никто не ссылается)
+    """
+    cutoff = time.time() - KP_JOB_FILE_TTL
+    conn = _connect()
+    try:
+        with _transaction(conn):
+            conn.execute("DELETE FROM job_links WHERE created_at < ?", (cutoff,))
+            old = conn.execute("""
+                SELECT id, result_path FROM generation_jobs j
+                WHERE status NOT IN ('queued', 'running')
+                AND NOT EXISTS (SELECT 1 FROM job_links l WHERE l.job_id = j.id)
+            """).fetchall()
+            conn.executemany("DELETE FROM generation_jobs WHERE id = ?", [(row['id'],) for row in old])
+
+            orphaned = set()
+            for path in {row['result_path'] for row in old if row['result_path']}:
+                in_use = conn.execute(
+                    "SELECT 1 FROM generation_jobs WHERE result_path = ? LIMIT 1", (path,)
+                ).fetchone()
+                if not in_use:
+                    orphaned.add(path)
+    finally:
+        conn.close()
+
+    for path in orphaned:
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return len(old)
+
+
+# ===== ХЭШ СОДЕРЖИМОГО =====
+
+def kp_content_hash(rows, job_format):
+    """Хэш того, что попадет в документ: строки КП без служебных полей + дата документа"""
+    payload = [
+        {key: value for key, value in row.items() if key not in VOLATILE_FIELDS}
+        for row in rows
+    ]
+    payload.sort(key=lambda row: (row['product_id'], row['price_offer_id']))
+    raw = json.dumps(
+        [job_format, datetime.now().strftime('%Y-%m-%d'), payload],
+        sort_keys=True, default=str, ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# ===== ВЫПОЛНЕНИЕ (в процессе пула) =====
+
+def run_job(generation_id):
+    """Генерирует документ; статус и результат - в SQLite"""
+    job = _get_generation(generation_id)
+    if job is None or job['status'] != 'queued':
+        return
+    _update_generation(generation_id, status='running', started_at=time.time())
+    started = time.perf_counter()
+    tmp_path = None
+
+    try:
+        extension, _ = KP_JOB_FORMATS[job['format']]
+        if job['format'] == 'google-sheets':
+            from kp_generator_google_sheets import KPGoogleSheetsGenerator
+            result = KPGoogleSheetsGenerator().generate(job['session_id'])
+            _update_generation(generation_id, status='done', finished_at=time.time(), result_json=json.dumps({
+                'spreadsheet_url': result['spreadsheet_url'],
+                'spreadsheet_id': result['spreadsheet_id'],
+                'title': result['title'],
+            }))
+        else:
+            if job['format'] == 'pdf':
+                from kp_generator_pdf import KPPDFGenerator as Generator
+            else:
+                from kp_generator_excel import KPExcelGenerator as Generator
+
+            # Пишем во временный файл: недописанный документ не попадет в кэш
+            final_path = os.path.join(FILES_DIR, f"{job['content_hash']}.{extension}")
+            tmp_path = os.path.join(FILES_DIR, f"{job['content_hash']}.{generation_id}.part.{extension}")
+            Generator().generate(job['session_id'], output_path=tmp_path)
+            os.replace(tmp_path, final_path)
+            _update_generation(generation_id, status='done', finished_at=time.time(), result_path=final_path)
+
+        print(f"✅ [KP JOBS] {job['format']} {generation_id} готов за {time.perf_counter() - started:.1f}с")
+    except Exception as e:
+        traceback.print_exc()
+        error = str(e) if isinstance(e, ValueError) else f'Ошибка генерации: {e}'
+        _update_generation(generation_id, status='failed', finished_at=time.time(), error=error)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _init_worker():
+    """Запуск процесса пула: Ctrl+C обрабатывает сервер, app.py здесь не нужен"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    main_file = getattr(sys.modules.get('__mp_main__'), '__file__', None) or ''
+    if os.path.basename(main_file) == 'app.py':
+        print("⚠️  [KP JOBS] Процесс пула заново выполнил app.py (запуск python app.py) - "
+              "запускайте server.py или gunicorn")
+
+
+# ===== ПОСТАНОВКА (в воркере веб-сервера) =====
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=KP_JOB_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            max_tasks_per_child=KP_JOB_TASKS_PER_WORKER
+        )
+    return _executor
+
+
+def submit_job(session_id, job_format, rows):
+    """
+    Задача генерации для строк КП (kp_data.fetch_kp_rows)
+    Сессия получает свою ссылку на готовую / уже выполняющуюся генерацию с тем же
+    содержимым или на новую. Поиск и постановка - одна транзакция BEGIN IMMEDIATE:
+    два одновременных запроса не поставят одно содержимое дважды.
+    """
+    content_hash = kp_content_hash(rows, job_format)
+    now = time.time()
+    generation_id = None
+    reused = None
+
+    conn = _connect()
+    try:
+        with _transaction(conn):
+            for row in conn.execute("""
+                SELECT * FROM generation_jobs
+                WHERE format = ? AND content_hash = ? AND status IN ('done', 'queued', 'running')
+                ORDER BY created_at DESC
+            """, (job_format, content_hash)).fetchall():
+                job = dict(row)
+                if _is_stale(job, now):
+                    # Освобождаем уникальный индекс для новой генерации
+                    conn.execute("""
+                        UPDATE generation_jobs SET status = 'failed', finished_at = ?,
+                               error = 'Генерация не завершилась вовремя'
+                        WHERE id = ?
+                    """, (now, job['id']))
+                    continue
+                if job['status'] == 'done' and job['result_path'] and not os.path.exists(job['result_path']):
+                    continue
+                generation_id, reused = job['id'], job['status']
+                break
+
+            if generation_id is None:
+                generation_id = str(uuid.uuid4())
+                conn.execute("""
+                    INSERT INTO generation_jobs (id, session_id, format, content_hash, status, created_at)
+                    VALUES (?, ?, ?, ?, 'queued', ?)
+                """, (generation_id, session_id, job_format, content_hash, now))
+
+            link_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO job_links (id, session_id, job_id, created_at) VALUES (?, ?, ?, ?)",
+                (link_id, session_id, generation_id, now)
+            )
+    finally:
+        conn.close()
+
+    if reused:
+        print(f"♻️  [KP JOBS] {job_format}: содержимое не изменилось - генерация {generation_id} ({reused})")
+    else:
+        purge_old_jobs()
+        _get_executor().submit(run_job, generation_id)
+        print(f"📥 [KP JOBS] {job_format} {generation_id} поставлен в очередь ({len(rows)} строк КП)")
+    return get_job(link_id)
+
+
+def job_response(job):
+    """Статус задачи для API (job - из get_job / submit_job)"""
+    status = 'failed' if _is_stale(job) else job['status']
+    response = {
+        'success': status != 'failed',
+        'job_id': job['id'],
+        'format': job['format'],
+        'status': status,
+        'status_url': f"/api/kp/jobs/{job['id']}",
+    }
+    if status == 'failed':
+        response['error'] = job.get('error') or 'Генерация не завершилась вовремя'
+    elif status == 'done':
+        if job.get('result_json'):
+            response.update(json.loads(job['result_json']))
+        else:
+            response['download_url'] = f"/api/kp/jobs/{job['id']}/download"
+    return response
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Локальный векторный индекс товаров (когда pgvector недоступен)
+
+Раньше vector_search_products на каждый запрос загружал 200 последних товаров,
+делал json.loads каждого TEXT embedding и считал косинус циклом Python
+(sum(a*b ...)) под таймаутом 5 секунд - искал только по 200 товарам.
+
+Теперь embeddings всего каталога лежат на диске одной матрицей float32
+(строки уже L2-нормированы) и открываются через np.memmap: воркеры gunicorn
+делят одни и те же страницы в памяти. Поиск = одно умножение матрицы на
+вектор + np.argpartition для top-k - миллисекунды на весь каталог.
+
+Файлы в LOCAL_VECTOR_INDEX_DIR:
+    vectors.f32  - матрица rows × dim (float32)
+    ids.npy      - product_id строки (-1 = товар удален / без embedding)
+    meta.json    - dim, rows, max_product_id, synced_at
+
+Обновление инкрементальное, по id товаров:
+- refresh(session, product_ids) - перечитать конкретные товары
+  (строка перезаписывается на месте, новая - дописывается в конец)
+- refresh_changed(session) - сверка с БД (вызывается сама не чаще
+  LOCAL_VECTOR_INDEX_REFRESH_SECONDS): embeddings пишет отдельный процесс и
+  не по порядку id, поэтому берутся
+    * товары с embedding, которых нет в индексе (новые и досчитанные позже)
+    * товары с updated_at после прошлой сверки (пересчитанные embeddings)
+    * строки индекса, у товаров которых embedding пропал или товар удален
+- rebuild(session) - с нуля (python local_vector_index.py --rebuild)
+
+Требует numpy; без него индекс выключен (None), поиск идет как раньше.
+"""
+
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from sqlalchemy import text
+
+from config import (
+    LOCAL_VECTOR_INDEX_ENABLED, LOCAL_VECTOR_INDEX_DIR, LOCAL_VECTOR_INDEX_REFRESH_SECONDS
+)
+
+# Сколько товаров читать из БД за раз
+FETCH_BATCH_SIZE = 2000
+
+# Запас к updated_at прошлой сверки: транзакции, закоммиченные позже NOW() сверки
+SYNC_OVERLAP_SECONDS = 300
+
+# Колонки с embeddings в products (в порядке предпочтения): имя → SQL для JSON-текста
+EMBEDDING_COLUMNS = (
+    ('name_embedding_text', 'p.name_embedding_text'),
+    ('name_embedding', 'p.name_embedding::text'),
+)
+
+
+def _normalized(matrix):
+    """L2-нормировка строк (нулевые строки остаются нулевыми)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def _embedding_source(session):
+    """(колонка, SQL-выражение JSON-текста) embedding товара или None, если колонок нет"""
+    existing = {row[0] for row in session.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'products' AND column_name IN ('name_embedding_text', 'name_embedding')
+    """))}
+    for column, expression in EMBEDDING_COLUMNS:
+        if column in existing:
+            return f"p.{column}", expression
+    return None
+
+
+def _embedded_ids(session, column):
+    """id всех товаров с embedding (только id - без чтения самих векторов)"""
+    return {row[0] for row in session.execute(text(f"""
+        SELECT p.id FROM products p WHERE {column} IS NOT NULL
+    """))}
+
+
+def _updated_ids(session, since):
+    """id товаров, измененных после since (embedding мог быть пересчитан)"""
+    return {row[0] for row in session.execute(text("""
+        SELECT p.id FROM products p
+        WHERE p.updated_at >= CAST(:since AS TIMESTAMP) - make_interval(secs => :overlap)
+    """), {'since': since, 'overlap': SYNC_OVERLAP_SECONDS})}
+
+
+class LocalVectorIndex:
+    """Матрица embeddings товаров на диске + top-k поиск по косинусу"""
+
+    def __init__(self, directory=LOCAL_VECTOR_INDEX_DIR):
+        self.directory = str(directory)
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.ids_path = os.path.join(self.directory, 'ids.npy')
+        self.meta_path = os.path.join(self.directory, 'meta.json')
+        self.lock_path = os.path.join(self.directory, '.lock')
+
+        self.matrix = None
+        self.ids = None
+        self.row_by_id = {}
+        self.meta = {'dim': None, 'rows': 0, 'max_product_id': 0}
+        self._meta_mtime = None
+        self._last_refresh_check = 0.0
+        self._lock = threading.Lock()
+
+    # ===== ЧТЕНИЕ =====
+
+    def _reload_if_changed(self):
+        """Переоткрывает файлы, если другой процесс их обновил"""
+        try:
+            mtime = os.stat(self.meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime:
+            return
+
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        ids = np.load(self.ids_path)
+        rows = min(meta['rows'], len(ids))
+        matrix = None
+        if rows and meta['dim']:
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                               shape=(rows, meta['dim']))
+
+        with self._lock:
+            self.meta = meta
+            self.ids = ids[:rows]
+            self.matrix = matrix
+            self.row_by_id = {int(pid): row for row, pid in enumerate(self.ids) if pid >= 0}
+            self._meta_mtime = mtime
+
+    def __len__(self):
+        self._reload_if_changed()
+        return len(self.row_by_id)
+
+    def search(self, query_embedding, limit=100, min_similarity=None):
+        """[(product_id, similarity)] по убыванию сходства"""
+        self._reload_if_changed()
+        matrix, ids = self.matrix, self.ids
+        if matrix is None or not len(ids):
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape[0] != matrix.shape[1]:
+            print(f"⚠️  [LOCAL VECTOR] Размерность запроса {query.shape[0]} != индекса {matrix.shape[1]}")
+            return []
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+
+        scores = matrix @ (query / norm)
+        scores[ids < 0] = -np.inf
+
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = [(int(ids[row]), float(scores[row])) for row in top if ids[row] >= 0]
+        if min_similarity is not None:
+            results = [(pid, score) for pid, score in results if score >= min_similarity]
+        return results
+
+    # ===== ЗАПИСЬ (один процесс за раз - flock) =====
+
+    def _fetch(self, session, source, where, params):
+        """[(product_id, vector)] из БД, пачками"""
+        column, expression = source
+        last_id = 0
+        while True:
+            rows = session.execute(text(f"""
+                SELECT p.id, {expression}
+                FROM products p
+                WHERE {where} AND p.id > :last_id AND {column} IS NOT NULL
+                ORDER BY p.id
+                LIMIT :batch
+            """), dict(params, last_id=last_id, batch=FETCH_BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for product_id, embedding in rows:
+                try:
+                    yield product_id, json.loads(embedding)
+                except (TypeError, ValueError):
+                    continue
+            last_id = rows[-1][0]
+
+    def _write_meta(self, meta):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _write_ids(self, ids):
+        tmp_path = self.ids_path + '.tmp.npy'
+        np.save(tmp_path, ids)
+        os.replace(tmp_path, self.ids_path)
+
+    def _apply(self, fetched, requested_ids=None, synced_at=None):
+        """
+        Перезаписывает/дописывает строки; requested_ids без embedding помечаются удаленными.
+        synced_at - время сверки с БД (refresh_changed), сохраняется в meta
+        """
+        self._reload_if_changed()
+        dim = self.meta['dim']
+        base_rows = len(self.ids) if self.ids is not None else 0
+        ids = list(self.ids) if self.ids is not None else []
+        row_by_id = dict(self.row_by_id)
+        stats = {'updated': 0, 'added': 0, 'removed': 0}
+
+        updates, appended = [], []
+
+        def write_appended():
+            with open(self.vectors_path, 'ab') as f:
+                # Строки до meta['rows'] валидны: хвост от прерванной записи отрезаем
+                f.truncate((len(ids) - len(appended)) * dim * 4)
+                f.write(_normalized(np.asarray(appended, dtype=np.float32)).tobytes())
+            stats['added'] += len(appended)
+            appended.clear()
+
+        seen = set()
+        for product_id, vector in fetched:
+            if dim is None:
+                dim = len(vector)
+            if len(vector) != dim or product_id in seen:
+                continue
+            seen.add(product_id)
+            if product_id in row_by_id:
+                updates.append((row_by_id[product_id], vector))
+            else:
+                row_by_id[product_id] = len(ids)
+                ids.append(product_id)
+                appended.append(vector)
+                # Пачками: весь каталог списками float в памяти не держим
+                if len(appended) >= FETCH_BATCH_SIZE:
+                    write_appended()
+        if appended:
+            write_appended()
+
+        if updates:
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(base_rows, dim))
+            matrix[[row for row, _ in updates]] = _normalized(
+                np.asarray([vector for _, vector in updates], dtype=np.float32)
+            )
+            matrix.flush()
+            del matrix
+            stats['updated'] = len(updates)
+
+        ids = np.asarray(ids, dtype=np.int64)
+        removed = [row_by_id[pid] for pid in (requested_ids or ()) if pid in row_by_id and pid not in seen]
+        if removed:
+            ids[removed] = -1
+            stats['removed'] = len(removed)
+
+        if any(stats.values()) or synced_at is not None:
+            self._write_ids(ids)
+            self._write_meta({
+                'dim': dim,
+                'rows': len(ids),
+                'max_product_id': int(max(self.meta['max_product_id'], ids.max(initial=0))),
+                'synced_at': synced_at or self.meta.get('synced_at'),
+            })
+
+        return stats
+
+    def _locked(self, fn):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return fn()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def refresh(self, session, product_ids):
+        """Перечитывает embeddings указанных товаров"""
+        source = _embedding_source(session)
+        if not source or not product_ids:
+            return None
+        product_ids = sorted(set(int(pid) for pid in product_ids))
+        return self._locked(lambda: self._apply(
+            self._fetch(session, source, "p.id = ANY(:ids)", {'ids': product_ids}),
+            requested_ids=product_ids
+        ))
+
+    def refresh_changed(self, session, force=False):
+        """Сверка с БД: недостающие, измененные и пропавшие товары (не чаще раза в N секунд)"""
+        now = time.monotonic()
+        if not force and now - self._last_refresh_check < LOCAL_VECTOR_INDEX_REFRESH_SECONDS:
+            return None
+        self._last_refresh_check = now
+
+        source = _embedding_source(session)
+        if not source:
+            return None
+
+        def apply_changed():
+            self._reload_if_changed()
+            synced_at = str(session.execute(text("SELECT NOW()::TIMESTAMP")).scalar())
+            embedded = _embedded_ids(session, source[0])
+            indexed = set(self.row_by_id)
+
+            changed = embedded - indexed
+            if self.meta.get('synced_at'):
+                changed |= _updated_ids(session, self.meta['synced_at']) & embedded
+            vanished = indexed - embedded
+
+            fetch_ids = sorted(changed)
+            fetched = self._fetch(session, source, "p.id = ANY(:ids)", {'ids': fetch_ids}) if fetch_ids else ()
+            return self._apply(fetched, requested_ids=fetch_ids + sorted(vanished), synced_at=synced_at)
+        return self._locked(apply_changed)
+
+    def rebuild(self, session):
+        """Индекс с нуля"""
+        def clear_and_fill():
+            for path in (self.vectors_path, self.ids_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.matrix, self.ids, self.row_by_id = None, None, {}
+            self.meta = {'dim': None, 'rows': 0, 'max_product_id': 0}
+            self._meta_mtime = None
+            source = _embedding_source(session)
+            if not source:
+                print("⚠️  [LOCAL VECTOR] В products нет колонок с embeddings")
+                return None
+            synced_at = str(session.execute(text("SELECT NOW()::TIMESTAMP")).scalar())
+            return self._apply(self._fetch(session, source, "TRUE", {}), synced_at=synced_at)
+        return self._locked(clear_and_fill)
+
+
+# Индекс процесса (False - выключен), создается при первом обращении
+_index = None
+
+
+def get_local_index():
+    """Индекс процесса или None (выключен в config / нет numpy)"""
+    global _index
+    if _index is None:
+        if not LOCAL_VECTOR_INDEX_ENABLED:
+            _index = False
+        elif np is None:
+            print("⚠️  [LOCAL VECTOR] numpy не установлен - локальный индекс выключен")
+            _index = False
+        else:
+            _index = LocalVectorIndex()
+    return _index if _index is not False else None
+
+
+if __name__ == "__main__":
+    # python local_vector_index.py --rebuild  (из web_interface, нужен DATABASE_URL)
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from database.postgresql_manager import db_manager
+
+    if np is None:
+        print("❌ numpy не установлен")
+        sys.exit(1)
+
+    index = LocalVectorIndex()
+    started = time.perf_counter()
+    with db_manager.get_session() as session:
+        if '--rebuild' in sys.argv:
+            stats = index.rebuild(session)
+        else:
+            stats = index.refresh_changed(session, force=True)
+    print(f"✅ Локальный индекс: {stats} за {time.perf_counter() - started:.1f}с, "
+          f"товаров в индексе: {len(index):,}")
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Keyset-пагинация и кэш количества для списков /products и /projects
+
+Раньше каждая страница:
+- считала COUNT(DISTINCT p.id) по всем товарам с фильтрами
+- листала через LIMIT/OFFSET: на странице 200 PostgreSQL строит и
+  выбрасывает 200 × 48 строк (с подзапросами изображений и КП на каждую)
+
+Теперь:
+- страница начинается ПОСЛЕ ключа последней строки предыдущей страницы
+  (sort key, id) - WHERE вместо OFFSET, стоимость не зависит от номера страницы
+- ссылки ←/→ несут ключ в URL (after= / before=), одинаково для всех воркеров
+- переход по номеру страницы: ключ начала страницы из кэша закладок
+  (запоминается при каждом показе), иначе ближайшая закладка + короткий OFFSET
+- последняя страница - обратной сортировкой от конца (как первая)
+- общее количество - из кэша с коротким TTL по сигнатуре фильтров
+"""
+
+import base64
+import hashlib
+import json
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from config import LISTING_COUNT_CACHE_TTL, LISTING_BOOKMARK_CACHE_TTL
+
+
+class TTLCache:
+    """Потокобезопасный кэш в памяти процесса с временем жизни записей"""
+
+    def __init__(self, ttl, maxsize=1000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.maxsize and key not in self._data:
+                # Переполнение: сначала выкидываем протухшие, потом самые старые
+                now = time.monotonic()
+                for stale in [k for k, (exp, _) in self._data.items() if exp < now]:
+                    del self._data[stale]
+                while len(self._data) >= self.maxsize:
+                    del self._data[next(iter(self._data))]
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def get_or_set(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+
+
+# Количество результатов по сигнатуре фильтров
+COUNT_CACHE = TTLCache(ttl=LISTING_COUNT_CACHE_TTL, maxsize=2000)
+
+# Закладки: (сигнатура + сортировка, номер страницы) → ключ, после которого начинается страница
+BOOKMARK_CACHE = TTLCache(ttl=LISTING_BOOKMARK_CACHE_TTL, maxsize=20000)
+
+
+def filter_signature(*parts):
+    """Стабильный ключ кэша для набора фильтров (SQL условия + параметры)"""
+    normalized = []
+    for part in parts:
+        if isinstance(part, dict):
+            part = sorted((k, repr(v)) for k, v in part.items())
+        normalized.append(repr(part))
+    return hashlib.sha1('|'.join(normalized).encode('utf-8')).hexdigest()
+
+
+def cached_count(signature, count_fn):
+    """Количество из кэша (TTL LISTING_COUNT_CACHE_TTL), иначе count_fn()"""
+    return COUNT_CACHE.get_or_set(signature, count_fn)
+
+
+# ===== Ключи страниц (cursor) =====
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, float):
+        # repr - кратчайшая точная запись, сравнение в SQL совпадет
+        return repr(value)
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_json_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Ключ из URL; None, если он битый или от другой сортировки"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+class KeysetPage:
+    """
+    Одна страница списка с keyset-пагинацией
+
+    sort_keys - колонки внутреннего SELECT (алиасы) с направлением, последней
+    должен идти уникальный id; NULL всегда в конце (как NULLS LAST в списках).
+
+    Использование:
+        page = KeysetPage([('offer_created_at', 'DESC'), ('id', 'DESC')],
+                          per_page, page_num, total, signature,
+                          after=request.args.get('after'), before=request.args.get('before'))
+        sql, page_params = page.query(inner_sql)
+        rows = page.finish(session.execute(text(sql), {**params, **page_params}).fetchall())
+        pagination = page.pagination()
+    """
+
+    def __init__(self, sort_keys, per_page, page, total, signature, after=None, before=None):
+        self.sort_keys = sort_keys
+        self.per_page = per_page
+        self.page = max(page, 1)
+        self.total = total
+        self.total_pages = (total + per_page - 1) // per_page
+        self.signature = signature
+
+        self.after = decode_cursor(after, len(sort_keys))
+        self.before = decode_cursor(before, len(sort_keys)) if self.after is None else None
+
+        self.reverse = False
+        self.seek = None
+        self.offset = 0
+        self.limit = per_page
+        self.rows = []
+
+        if self.page == 1:
+            # Первая страница всегда с начала (каноничная ссылка)
+            self.after = self.before = None
+        elif self.after is not None:
+            self.seek = self.after
+        elif self.before is not None:
+            self.seek = self.before
+            self.reverse = True
+        elif self.page == self.total_pages:
+            # Последняя страница: с конца в обратном порядке
+            self.reverse = True
+            self.limit = self.total - (self.page - 1) * per_page
+        else:
+            # Переход по номеру: ближайшая известная закладка не дальше этой страницы
+            for known_page in range(self.page, 1, -1):
+                bookmark = BOOKMARK_CACHE.get((self.signature, known_page))
+                if bookmark is not None:
+                    self.seek = bookmark
+                    self.offset = (self.page - known_page) * per_page
+                    break
+            else:
+                self.offset = (self.page - 1) * per_page
+                print(f"   📄 [PAGINATION] Страница {self.page}: нет закладки, OFFSET {self.offset}")
+
+    def query(self, inner_sql):
+        """Оборачивает SELECT списка: keyset-условие, сортировка, LIMIT"""
+        params = {'page_limit': self.limit, 'page_offset': self.offset}
+        where = "TRUE"
+        if self.seek is not None:
+            where, seek_params = self._seek_condition(self.seek, forward=not self.reverse)
+            params.update(seek_params)
+
+        order = []
+        for column, direction in self.sort_keys:
+            if self.reverse:
+                direction = 'DESC' if direction == 'ASC' else 'ASC'
+                order.append(f"listing.{column} {direction} NULLS FIRST")
+            else:
+                order.append(f"listing.{column} {direction} NULLS LAST")
+
+        sql = f"""
+            SELECT * FROM ({inner_sql}) listing
+            WHERE {where}
+            ORDER BY {', '.join(order)}
+            LIMIT :page_limit OFFSET :page_offset
+        """
+        return sql, params
+
+    def finish(self, rows):
+        """Строки в порядке показа + закладки для соседних страниц"""
+        rows = list(rows)
+        if self.reverse:
+            rows.reverse()
+        self.rows = rows
+
+        if rows:
+            if self.after is not None:
+                BOOKMARK_CACHE.set((self.signature, self.page), self.after)
+            BOOKMARK_CACHE.set((self.signature, self.page + 1), self._key(rows[-1]))
+
+        return rows
+
+    def pagination(self):
+        """Словарь для шаблона (прежние поля + ключи для ←/→)"""
+        has_prev = self.page > 1
+        has_next = self.page < self.total_pages
+
+        prev_cursor = next_cursor = ''
+        if self.rows:
+            if has_prev and self.page - 1 > 1:
+                prev_cursor = 'before=' + encode_cursor(self._key(self.rows[0]))
+            if has_next:
+                next_cursor = 'after=' + encode_cursor(self._key(self.rows[-1]))
+
+        return {
+            'page': self.page,
+            'per_page': self.per_page,
+            'total_pages': self.total_pages,
+            'has_prev': has_prev,
+            'has_next': has_next,
+            'prev_num': self.page - 1 if has_prev else None,
+            'next_num': self.page + 1 if has_next else None,
+            'prev_cursor': prev_cursor,
+            'next_cursor': next_cursor,
+            'total': self.total
+        }
+
+    def _key(self, row):
+        mapping = row._mapping
+        return [_json_value(mapping[column]) for column, _ in self.sort_keys]
+
+    def _seek_condition(self, values, forward):
+        """
+        (k1, k2, ..., id) строго после (forward) или строго до ключа
+        с учетом направления каждой колонки и NULLS LAST
+        """
+        clauses = []
+        equal = []
+        params = {}
+
+        for i, ((column, direction), value) in enumerate(zip(self.sort_keys, values)):
+            name = f"listing.{column}"
+            param = f"seek_{i}"
+
+            if value is None:
+                # NULL - последняя группа: после нее ничего, до нее - все не-NULL
+                step = None if forward else f"{name} IS NOT NULL"
+            else:
+                params[param] = value
+                after_op = '>' if direction == 'ASC' else '<'
+                before_op = '<' if direction == 'ASC' else '>'
+                if forward:
+                    step = f"({name} {after_op} :{param} OR {name} IS NULL)"
+                else:
+                    step = f"{name} {before_op} :{param}"
+
+            if step:
+                clauses.append("(" + " AND ".join(equal + [step]) + ")")
+            equal.append(f"{name} IS NULL" if value is None else f"{name} = :{param}")
+
+        return (" OR ".join(clauses) or "FALSE"), params
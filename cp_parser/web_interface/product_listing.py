@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Колонки списков товаров из витрины product_listing
+
+product_listing (database/create_product_listing.py) хранит для каждого товара
+уже посчитанные main_image_url, min_price_rub, min_quantity, max_delivery_days,
+offer_count - парсеры обновляют ее при записи проекта.
+
+Списки /products и /project/<id> берут эти значения одним LEFT JOIN по
+первичному ключу вместо коррелированных подзапросов на каждую строку.
+Пока миграция не применена - прежние подзапросы.
+
+Тираж и цены офферов - из числовых колонок price_offers (quantity_num,
+price_usd_num, price_rub_num; database/add_price_offer_numeric_columns.py):
+фильтры идут по индексам, а не через CAST текста.
+"""
+
+from database.schema_features import NUMERIC_OFFERS_SQL, schema_feature
+
+# Прежние коррелированные подзапросы (fallback без product_listing)
+MAIN_IMAGE_SUBQUERY = """(SELECT pi.image_url
+                    FROM product_images pi
+                    WHERE pi.product_id = p.id
+                    AND pi.image_url IS NOT NULL
+                    ORDER BY
+                        CASE WHEN pi.is_main_image::text = 'true' THEN 0 ELSE 1 END,
+                        pi.cell_position
+                    LIMIT 1)"""
+
+MIN_PRICE_SUBQUERY = "(SELECT MIN(CAST(po.price_rub AS NUMERIC)) FROM price_offers po WHERE po.product_id = p.id)"
+
+def listing_available(session):
+    """Применена ли миграция create_product_listing.py"""
+    return schema_feature(
+        session, 'product_listing', "SELECT to_regclass('product_listing') IS NOT NULL",
+        missing="[LISTING] product_listing нет - подзапросы на каждую строку "
+                "(запустите database/create_product_listing.py)"
+    )
+
+
+def numeric_offers_available(session):
+    """Применена ли миграция add_price_offer_numeric_columns.py"""
+    return schema_feature(
+        session, 'price_offers.numeric', NUMERIC_OFFERS_SQL,
+        missing="[LISTING] Числовых колонок price_offers нет - CAST текста "
+                "(запустите database/add_price_offer_numeric_columns.py)"
+    )
+
+
+class ListingColumns:
+    """
+    Фрагменты SQL для запросов по products p
+
+    Использование:
+        listing = ListingColumns(session)
+        SELECT ..., {listing.main_image_url} as main_image_url
+        FROM products p {listing.join}
+
+        SELECT {listing.offer_quantity}, {listing.offer_price_rub} FROM price_offers po
+        WHERE {listing.price_rub_filter} <= :max_price
+    """
+
+    def __init__(self, session):
+        if listing_available(session):
+            self.join = "LEFT JOIN product_listing pl ON pl.product_id = p.id"
+            self.main_image_url = "pl.main_image_url"
+            self.min_price = "pl.min_price_rub"
+        else:
+            self.join = ""
+            self.main_image_url = MAIN_IMAGE_SUBQUERY
+            self.min_price = MIN_PRICE_SUBQUERY
+
+        # offer_* - для SELECT, *_filter - для условий фильтров
+        if numeric_offers_available(session):
+            self.offer_quantity = self.quantity_filter = "po.quantity_num"
+            self.offer_price_usd = "po.price_usd_num"
+            self.offer_price_rub = self.price_rub_filter = "po.price_rub_num"
+        else:
+            self.offer_quantity = "po.quantity"
+            self.offer_price_usd = "po.price_usd"
+            self.offer_price_rub = "po.price_rub"
+            self.quantity_filter = "CAST(po.quantity AS INTEGER)"
+            self.price_rub_filter = "CAST(po.price_rub AS NUMERIC)"
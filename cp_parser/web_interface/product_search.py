@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Текстовый поиск товаров по индексам PostgreSQL
+
+Индексы создает database/create_search_indexes.py:
+- pg_trgm GIN на products.name / custom_field / description и projects.project_name
+- products.search_vector (A - название, B - дизайн/проект, C - описание)
+
+Приоритет выдачи прежний: название (1) → дизайн/проект (2) → описание (3),
+внутри группы - ts_rank по взвешенному вектору, затем новые товары.
+Товары, найденные только векторным поиском (vector_ids из pgvector), - после
+текстовых совпадений (4).
+
+Условие специально без OR через JOIN: проекты с подходящим названием
+находятся отдельным запросом (таблица маленькая), а в условии по товарам
+остается p.project_id = ANY(...) - тогда PostgreSQL объединяет индексы
+(BitmapOr) вместо перебора всех товаров.
+"""
+
+from sqlalchemy import text
+
+from database.schema_features import schema_feature
+
+# Должна совпадать с SEARCH_CONFIG в database/create_search_indexes.py
+SEARCH_CONFIG = 'russian'
+
+
+def search_vector_available(session):
+    """Применена ли миграция create_search_indexes.py"""
+    return schema_feature(session, 'products.search_vector', """
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'products' AND column_name = 'search_vector'
+        )
+    """, missing="[SEARCH] products.search_vector нет - только ILIKE "
+                 "(запустите database/create_search_indexes.py)")
+
+
+class ProductSearch:
+    """
+    Условие и ранжирование поиска для запросов по products p
+
+    Использование:
+        found = ProductSearch(session, search)
+        where_conditions.append(found.where)
+        params.update(found.params)
+        select_fields += ", " + found.rank_select
+        order_by = found.order_by + ", p.id DESC"      # или found.sort_keys
+    """
+
+    def __init__(self, session, search, vector_ids=None):
+        query = search.strip()
+        self.params = {
+            'search': f"%{query}%",
+            'search_query': query,
+        }
+
+        # Проекты с подходящим названием - по триграммному индексу
+        self.params['search_project_ids'] = [
+            row[0] for row in session.execute(text("""
+                SELECT id FROM projects WHERE project_name ILIKE :search
+            """), self.params)
+        ]
+
+        self.full_text = search_vector_available(session)
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', :search_query)"
+
+        by_project = "p.project_id = ANY(CAST(:search_project_ids AS INTEGER[]))"
+        by_name = "p.name ILIKE :search"
+        by_design = f"p.custom_field ILIKE :search OR {by_project}"
+        by_description = "p.description ILIKE :search"
+
+        conditions = [by_name, "p.custom_field ILIKE :search", by_description, by_project]
+
+        if vector_ids:
+            self.params['search_vector_ids'] = list(vector_ids)
+            conditions.append("p.id = ANY(CAST(:search_vector_ids AS INTEGER[]))")
+
+        if self.full_text:
+            conditions.append(f"p.search_vector @@ {tsquery}")
+            # ts_filter оставляет лексемы одного веса - совпадение словоформы в нужном поле
+            by_name += f" OR ts_filter(p.search_vector, '{{a}}') @@ {tsquery}"
+            by_design += f" OR ts_filter(p.search_vector, '{{b}}') @@ {tsquery}"
+            by_description += f" OR ts_filter(p.search_vector, '{{c}}') @@ {tsquery}"
+            text_rank = f"COALESCE(ts_rank(p.search_vector, {tsquery}), 0)"
+        else:
+            text_rank = "0"
+
+        self.where = "(" + " OR ".join(conditions) + ")"
+
+        self.rank_select = f"""
+            CASE
+                WHEN {by_name} THEN 1
+                WHEN {by_design} THEN 2
+                WHEN {by_description} THEN 3
+                ELSE 4
+            END as relevance_rank,
+            {text_rank} as text_rank"""
+
+        self.order_by = "relevance_rank ASC, text_rank DESC"
+        # То же для keyset-пагинации (алиасы SELECT)
+        self.sort_keys = [('relevance_rank', 'ASC'), ('text_rank', 'DESC')]
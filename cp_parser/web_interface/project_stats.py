@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Счетчики проектов из таблицы project_stats
+
+project_stats (database/create_project_stats.py) хранит для каждого проекта
+products_count, offers_count, images_count - парсеры обновляют ее при записи
+проекта.
+
+/projects и /project/<id> берут счетчики одним LEFT JOIN по первичному ключу
+вместе со строкой проекта: без отдельных COUNT(*) на каждый просмотр и без
+подзапроса на каждую строку списка.
+Пока миграция не применена - те же счетчики подзапросами в том же SELECT.
+"""
+
+from database.schema_features import schema_feature
+
+# Прежние подсчеты (fallback без project_stats), p - алиас projects
+PRODUCTS_COUNT_SUBQUERY = "(SELECT COUNT(*) FROM products pc WHERE pc.project_id = p.id)"
+
+OFFERS_COUNT_SUBQUERY = """(SELECT COUNT(*) FROM price_offers po
+                    JOIN products pc ON po.product_id = pc.id
+                    WHERE pc.project_id = p.id)"""
+
+IMAGES_COUNT_SUBQUERY = """(SELECT COUNT(*) FROM product_images pi
+                    JOIN products pc ON pi.product_id = pc.id
+                    WHERE pc.project_id = p.id)"""
+
+def project_stats_available(session):
+    """Применена ли миграция create_project_stats.py"""
+    return schema_feature(
+        session, 'project_stats', "SELECT to_regclass('project_stats') IS NOT NULL",
+        missing="[PROJECT_STATS] project_stats нет - COUNT(*) подзапросами "
+                "(запустите database/create_project_stats.py)"
+    )
+
+
+class ProjectStatsColumns:
+    """
+    Фрагменты SQL для запросов по projects p
+
+    Использование:
+        stats = ProjectStatsColumns(session)
+        SELECT p.id, {stats.products_count} as products_count,
+               {stats.offers_count} as offers_count, {stats.images_count} as images_count
+        FROM projects p {stats.join}
+    """
+
+    def __init__(self, session):
+        if project_stats_available(session):
+            # Проект без строки в project_stats (еще не парсился) - нули
+            self.join = "LEFT JOIN project_stats ps ON ps.project_id = p.id"
+            self.products_count = "COALESCE(ps.products_count, 0)"
+            self.offers_count = "COALESCE(ps.offers_count, 0)"
+            self.images_count = "COALESCE(ps.images_count, 0)"
+        else:
+            self.join = ""
+            self.products_count = PRODUCTS_COUNT_SUBQUERY
+            self.offers_count = OFFERS_COUNT_SUBQUERY
+            self.images_count = IMAGES_COUNT_SUBQUERY
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Точка входа веб-интерфейса без gunicorn (Dockerfile, локальный запуск)
+
+Генерация КП идет в процессах spawn (kp_jobs.py), а spawn импортирует в
+каждом процессе модуль __main__ заново. Если __main__ - app.py, каждый
+воркер КП повторяет весь запуск приложения: подключения к БД и pgvector,
+EmbeddingClient, фоновую загрузку CLIP. Этот модуль ничего не импортирует
+на уровне модуля - воркеры получают пустой __mp_main__.
+
+Запуск:
+    python server.py
+"""
+
+if __name__ == '__main__':
+    from app import run_server
+    run_server()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Запросы ближайших соседей к pgvector БД (VECTOR_DATABASE_URL)
+
+Раньше вектор запроса (1536 / 512 чисел) подставлялся f-строкой в SQL три раза:
+в SELECT, в WHERE и в ORDER BY. Запрос весил десятки килобайт, а условие
+WHERE 1 - (embedding <=> q) >= порог заставляло считать расстояние вне индекса.
+
+Теперь:
+- вектор - один bind-параметр (CAST(:query_vector AS vector)), текст SQL
+  одинаковый для всех запросов
+- ORDER BY по оператору расстояния + LIMIT - это ANN-скан индекса
+  (ivfflat / hnsw), порог сходства применяется уже к найденным LIMIT строкам
+- ivfflat.probes / hnsw.ef_search задаются на запрос (set_config на транзакцию):
+  больше - точнее, но медленнее; по умолчанию - из config.py
+  (бенчмарк точности/скорости: database/benchmark_vector_search.py)
+"""
+
+from sqlalchemy import text
+
+from config import VECTOR_IVFFLAT_PROBES, VECTOR_HNSW_EF_SEARCH
+
+
+class VectorIndex:
+    """Таблица с embeddings и колонка, по которой идет поиск"""
+
+    def __init__(self, table, column, id_column='product_id'):
+        self.table = table
+        self.column = column
+        self.id_column = id_column
+
+
+# Текстовый поиск (text-embedding-3-small, 1536) и поиск по изображению (CLIP, 512)
+PRODUCT_NAME_INDEX = VectorIndex('product_embeddings', 'name_embedding')
+PRODUCT_IMAGE_INDEX = VectorIndex('image_embeddings', 'image_embedding')
+
+
+def vector_literal(embedding):
+    """[0.1, 0.2] → '[0.1,0.2]' (текстовый формат pgvector)"""
+    return '[' + ','.join(map(str, embedding)) + ']'
+
+
+def apply_ann_settings(conn, probes=None, ef_search=None):
+    """ivfflat.probes / hnsw.ef_search до конца текущей транзакции"""
+    for name, value in (('ivfflat.probes', probes), ('hnsw.ef_search', ef_search)):
+        if value:
+            conn.execute(text("SELECT set_config(:name, :value, true)"),
+                         {'name': name, 'value': str(int(value))})
+
+
+def nearest_products(conn, index, embedding, limit, min_similarity=None,
+                     probes=None, ef_search=None):
+    """
+    Ближайшие к embedding строки индекса: [(product_id, similarity)] по убыванию сходства
+
+    Порог min_similarity отсекает строки ПОСЛЕ LIMIT: результатов может быть
+    меньше limit, зато поиск всегда идет по индексу.
+    probes / ef_search = None - значения из config.py.
+    """
+    apply_ann_settings(conn, probes or VECTOR_IVFFLAT_PROBES, ef_search or VECTOR_HNSW_EF_SEARCH)
+
+    params = {'query_vector': vector_literal(embedding), 'limit': limit}
+    threshold = ""
+    if min_similarity is not None:
+        threshold = "WHERE distance <= :max_distance"
+        params['max_distance'] = 1 - min_similarity
+
+    return conn.execute(text(f"""
+        SELECT product_id, 1 - distance as similarity
+        FROM (
+            SELECT {index.id_column} as product_id,
+                   {index.column} <=> CAST(:query_vector AS vector) as distance
+            FROM {index.table}
+            ORDER BY distance
+            LIMIT :limit
+        ) nearest
+        {threshold}
+        ORDER BY distance
+    """), params).fetchall()
@@ -15,12 +15,15 @@
 """
 import sys
 from pathlib import Path
-from openpyxl import load_workbook
 from datetime import datetime
 import re
-import hashlib
 
 sys.path.insert(0, str(Path.cwd()))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.workbook_loader import load_workbook_once
+from utils.image_store import ImageStore
+from utils.image_pipeline import ImagePipeline
+from utils.bulk_writer import ProjectBulkWriter, format_throughput
 from database.postgresql_manager import PostgreSQLManager
 from sqlalchemy import text
 
@@ -56,8 +59,10 @@ class Template7Parser:
     
     def __init__(self):
         self.db = PostgreSQLManager()
-        self.storage_dir = Path('storage/images')
-        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        # Изображения храним по хешу содержимого (одна картинка = один файл);
+        # если S3 настроен - сразу WebP → S3 без локальных файлов
+        self.image_store = ImageStore('storage/images', pipeline=ImagePipeline.from_env())
+        self.storage_dir = self.image_store.root
         
         # Динамические колонки (определяются для каждого файла!)
         self.columns = {}
@@ -121,6 +126,9 @@ class Template7Parser:
     def parse_project(self, project_id):
         """Парсит один проект"""
         try:
+            # Ошибки загрузок прошлого (прерванного) проекта к этому не относятся
+            self.image_store.begin_project()
+            
             print(f"\n{'='*80}")
             print(f"🔍 Парсинг проекта #{project_id}")
             print(f"{'='*80}")
@@ -136,43 +144,47 @@ class Template7Parser:
             print(f"📁 Файл: {file_path.name}")
             
             # Парсим
-            wb_data = load_workbook(str(file_path), data_only=True)
-            wb_images = load_workbook(str(file_path), data_only=False)
-            
-            ws_data = wb_data.active
-            ws_images = wb_images.active
-            
-            # КРИТИЧЕСКИ ВАЖНО: Определяем структуру ДИНАМИЧЕСКИ
-            print("\n🔎 Определение структуры...")
-            if not self._find_header_and_detect_structure(ws_data):
-                wb_data.close()
-                wb_images.close()
-                return {'success': False, 'error': 'Не удалось определить структуру Template 7'}
-            
-            # Получаем table_id из БД
-            with self.db.get_session() as session:
-                result = session.execute(
-                    text("SELECT table_id FROM projects WHERE id = :pid"),
-                    {'pid': project_id}
-                ).fetchone()
+            # Один проход: значения (read_only) + изображения из zip
+            wb = load_workbook_once(file_path)
+            try:
+                ws_data = ws_images = wb.active
                 
-                if not result:
-                    return {'success': False, 'error': 'Project not in DB'}
+                # КРИТИЧЕСКИ ВАЖНО: Определяем структуру ДИНАМИЧЕСКИ
+                print("\n🔎 Определение структуры...")
+                if not self._find_header_and_detect_structure(ws_data):
+                    return {'success': False, 'error': 'Не удалось определить структуру Template 7'}
                 
-                table_id = result[0]
-            
-            # Парсим товары
-            print(f"\n📦 Парсинг товаров (начало со строки {self.data_start_row})...")
-            products = self._parse_products(ws_data, ws_images, project_id, table_id)
+                # Получаем table_id из БД
+                with self.db.get_session() as session:
+                    result = session.execute(
+                        text("SELECT table_id FROM projects WHERE id = :pid"),
+                        {'pid': project_id}
+                    ).fetchone()
+                    
+                    if not result:
+                        return {'success': False, 'error': 'Project not in DB'}
+                    
+                    table_id = result[0]
+                
+                # Парсим товары
+                print(f"\n📦 Парсинг товаров (начало со строки {self.data_start_row})...")
+                self.writer = ProjectBulkWriter(self.db)
+                products = self._parse_products(ws_data, ws_images, project_id, table_id)
+            finally:
+                wb.close()
             
-            wb_data.close()
-            wb_images.close()
+            # Записываем проект одной транзакцией
+            # Все изображения проекта должны быть на S3 до записи image_url
+            self.image_store.drain()
+            db_stats = self.writer.flush()
+            print(format_throughput(db_stats))
             
             return {
                 'success': True,
                 'products': len(products),
                 'total_offers': sum(len(p['offers']) for p in products),
-                'total_images': sum(len(p['images']) for p in products)
+                'total_images': sum(len(p['images']) for p in products),
+                'db_stats': db_stats
             }
             
         except Exception as e:
@@ -337,41 +349,19 @@ class Template7Parser:
         try:
             col_letter = chr(64 + col)
             cell_pos = f"{col_letter}{row}"
-            img_index = 0
             
-            for image in ws._images:
-                if not hasattr(image, 'anchor') or not hasattr(image.anchor, '_from'):
-                    continue
+            for image in ws.images_at(row, col):
+                # Сохраняем изображение (файл = хеш содержимого, дубли не пишутся)
+                img_hash, filename = self.image_store.put(image.data())
                 
-                img_row = image.anchor._from.row + 1
-                img_col = image.anchor._from.col + 1
-                
-                if img_row == row and img_col == col:
-                    img_data = image._data()
-                    img_hash = hashlib.md5(img_data).hexdigest()[:8]
-                    
-                    # Для первого изображения используем существующее имя (не дублируем)
-                    if img_index == 0:
-                        filename = f"{table_id}_{cell_pos}_{img_hash}.png"
-                    else:
-                        # Для остальных добавляем суффикс
-                        filename = f"{table_id}_{cell_pos}_{img_index}_{img_hash}.png"
-                    
-                    filepath = self.storage_dir / filename
-                    
-                    # Сохраняем изображение
-                    with open(filepath, 'wb') as f:
-                        f.write(img_data)
-                    
-                    images.append({
-                        'filename': filename,
-                        'cell_position': cell_pos,
-                        'row_number': row,
-                        'column_number': col,
-                        'is_main': False  # Дополнительные фото не главные
-                    })
-                    
-                    img_index += 1
+                images.append({
+                    'filename': filename,
+                    'image_hash': img_hash,
+                    'cell_position': cell_pos,
+                    'row_number': row,
+                    'column_number': col,
+                    'is_main': False  # Дополнительные фото не главные
+                })
         except Exception as e:
             pass
         
@@ -380,118 +370,54 @@ class Template7Parser:
     def _extract_image_from_cell(self, ws, row, col, table_id):
         """Извлекает изображение из конкретной ячейки"""
         try:
-            for image in ws._images:
-                if not hasattr(image, 'anchor') or not hasattr(image.anchor, '_from'):
-                    continue
+            for image in ws.images_at(row, col):
+                # Генерируем имя файла
+                col_letter = chr(64 + col)
+                cell_pos = f"{col_letter}{row}"
                 
-                img_row = image.anchor._from.row + 1
-                img_col = image.anchor._from.col + 1
+                # Сохраняем изображение (файл = хеш содержимого, дубли не пишутся)
+                img_hash, filename = self.image_store.put(image.data())
                 
-                if img_row == row and img_col == col:
-                    # Генерируем имя файла
-                    col_letter = chr(64 + col)
-                    cell_pos = f"{col_letter}{row}"
-                    
-                    img_data = image._data()
-                    img_hash = hashlib.md5(img_data).hexdigest()[:8]
-                    
-                    filename = f"{table_id}_{cell_pos}_{img_hash}.png"
-                    filepath = self.storage_dir / filename
-                    
-                    # Сохраняем изображение
-                    with open(filepath, 'wb') as f:
-                        f.write(img_data)
-                    
-                    return {
-                        'filename': filename,
-                        'cell_position': cell_pos,
-                        'row_number': row,
-                        'column_number': col,
-                        'is_main': col == self.COLUMNS['photo']
-                    }
+                return {
+                    'filename': filename,
+                    'image_hash': img_hash,
+                    'cell_position': cell_pos,
+                    'row_number': row,
+                    'column_number': col,
+                    'is_main': col == self.COLUMNS['photo']
+                }
         except Exception as e:
             pass
         
         return None
     
     def _save_product(self, product, project_id, table_id):
-        """Сохраняет товар в БД"""
-        try:
-            with self.db.get_session() as session:
-                # Вставка товара
-                result = session.execute(text("""
-                    INSERT INTO products (
-                        project_id, table_id, name, description, custom_field, 
-                        sample_price, sample_delivery_time,
-                        row_number, created_at, updated_at
-                    ) VALUES (
-                        :project_id, :table_id, :name, :description, :custom_field,
-                        :sample_price, :sample_delivery_time,
-                        :row_number, :created_at, :updated_at
-                    ) RETURNING id
-                """), {
-                    'project_id': project_id,
-                    'table_id': table_id,
-                    'name': product['name'],
-                    'description': product['description'],
-                    'custom_field': product['custom_field'],
-                    'sample_price': product.get('sample_price'),
-                    'sample_delivery_time': product.get('sample_delivery_time'),
-                    'row_number': product['row_number'],
-                    'created_at': datetime.now().isoformat(),
-                    'updated_at': datetime.now().isoformat()
-                })
-                
-                product_id = result.fetchone()[0]
-                session.commit()
-                
-                # Вставка предложений
-                for offer in product['offers']:
-                    session.execute(text("""
-                        INSERT INTO price_offers (
-                            product_id, table_id, quantity, price_usd, price_rub,
-                            route, delivery_time_days, created_at, updated_at
-                        ) VALUES (
-                            :product_id, :table_id, :quantity, :price_usd, :price_rub,
-                            :route, :delivery_time_days, :created_at, :updated_at
-                        )
-                    """), {
-                        'product_id': product_id,
-                        'table_id': table_id,
-                        'quantity': offer['quantity'],
-                        'price_usd': offer['price_usd'],
-                        'price_rub': offer['price_rub'],
-                        'route': offer['route'],
-                        'delivery_time_days': offer['delivery_time_days'],
-                        'created_at': datetime.now().isoformat(),
-                        'updated_at': datetime.now().isoformat()
-                    })
-                
-                # Вставка изображений
-                for img in product['images']:
-                    session.execute(text("""
-                        INSERT INTO product_images (
-                            product_id, table_id, image_filename, cell_position,
-                            row_number, column_number, created_at, updated_at
-                        ) VALUES (
-                            :product_id, :table_id, :image_filename, :cell_position,
-                            :row_number, :column_number, :created_at, :updated_at
-                        )
-                    """), {
-                        'product_id': product_id,
-                        'table_id': table_id,
-                        'image_filename': img['filename'],
-                        'cell_position': img['cell_position'],
-                        'row_number': img['row_number'],
-                        'column_number': img['column_number'],
-                        'created_at': datetime.now().isoformat(),
-                        'updated_at': datetime.now().isoformat()
-                    })
-                
-                session.commit()
-                
-        except Exception as e:
-            print(f"      ⚠️ Ошибка сохранения: {str(e)[:100]}")
+        """Добавляет товар в пакетную запись проекта (в БД пишется в parse_project)"""
+        self.writer.add_product({
+            'project_id': project_id,
+            'table_id': table_id,
+            'name': product['name'],
+            'description': product['description'],
+            'custom_field': product['custom_field'],
+            'sample_price': product.get('sample_price'),
+            'sample_delivery_time': product.get('sample_delivery_time'),
+            'row_number': product['row_number']
+        }, offers=[{
+            'table_id': table_id,
+            'quantity': offer['quantity'],
+            'price_usd': offer['price_usd'],
+            'price_rub': offer['price_rub'],
+            'route': offer['route'],
+            'delivery_time_days': offer['delivery_time_days']
+        } for offer in product['offers']], images=[{
+            'table_id': table_id,
+            'image_filename': img['filename'],
+            'image_hash': img['image_hash'],
+            'image_url': self.image_store.url_for(img['filename']),
+            'cell_position': img['cell_position'],
+            'row_number': img['row_number'],
+            'column_number': img['column_number']
+        } for img in product['images']])
     
     def _get_cell_value(self, ws, row, col):
         """Получает значение ячейки"""
@@ -632,19 +558,3 @@ class Template7Parser:
 if __name__ == '__main__':
     parser = Template4Parser()
     parser.parse_all_perfect()
-
-
-Парсер для Шаблона 4 (идеальные проекты, confidence 9/9)
-"""
-import sys
-from pathlib import Path
-from openpyxl import load_workbook
-from datetime import datetime
-import re
-import hashlib
-
-sys.path.insert(0, str(Path.cwd()))
-from database.postgresql_manager import PostgreSQLManager
-from sqlalchemy import text
-
-
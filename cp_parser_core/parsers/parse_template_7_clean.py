@@ -15,12 +15,15 @@
 """
 import sys
 from pathlib import Path
-from openpyxl import load_workbook
 from datetime import datetime
 import re
-import hashlib
 
 sys.path.insert(0, str(Path.cwd()))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.workbook_loader import load_workbook_once
+from utils.image_store import ImageStore
+from utils.image_pipeline import ImagePipeline
+from utils.bulk_writer import ProjectBulkWriter, format_throughput
 from database.postgresql_manager import PostgreSQLManager
 from sqlalchemy import text
 
@@ -56,8 +59,10 @@ class Template7Parser:
     
     def __init__(self):
         self.db = PostgreSQLManager()
-        self.storage_dir = Path('storage/images')
-        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        # Изображения храним по хешу содержимого (одна картинка = один файл);
+        # если S3 настроен - сразу WebP → S3 без локальных файлов
+        self.image_store = ImageStore('storage/images', pipeline=ImagePipeline.from_env())
+        self.storage_dir = self.image_store.root
         
         # Динамические колонки (определяются для каждого файла!)
         self.columns = {}
@@ -139,6 +144,9 @@ class Template7Parser:
     def parse_project(self, project_id):
         """Парсит один проект"""
         try:
+            # Ошибки загрузок прошлого (прерванного) проекта к этому не относятся
+            self.image_store.begin_project()
+            
             print(f"\n{'='*80}")
             print(f"🔍 Парсинг проекта #{project_id}")
             print(f"{'='*80}")
@@ -154,43 +162,47 @@ class Template7Parser:
             print(f"📁 Файл: {file_path.name}")
             
             # Парсим
-            wb_data = load_workbook(str(file_path), data_only=True)
-            wb_images = load_workbook(str(file_path), data_only=False)
-            
-            ws_data = wb_data.active
-            ws_images = wb_images.active
-            
-            # КРИТИЧЕСКИ ВАЖНО: Определяем структуру ДИНАМИЧЕСКИ
-            print("\n🔎 Определение структуры...")
-            if not self._find_header_and_detect_structure(ws_data):
-                wb_data.close()
-                wb_images.close()
-                return {'success': False, 'error': 'Не удалось определить структуру Template 7'}
-            
-            # Получаем table_id из БД
-            with self.db.get_session() as session:
-                result = session.execute(
-                    text("SELECT table_id FROM projects WHERE id = :pid"),
-                    {'pid': project_id}
-                ).fetchone()
+            # Один проход: значения (read_only) + изображения из zip
+            wb = load_workbook_once(file_path)
+            try:
+                ws_data = ws_images = wb.active
                 
-                if not result:
-                    return {'success': False, 'error': 'Project not in DB'}
+                # КРИТИЧЕСКИ ВАЖНО: Определяем структуру ДИНАМИЧЕСКИ
+                print("\n🔎 Определение структуры...")
+                if not self._find_header_and_detect_structure(ws_data):
+                    return {'success': False, 'error': 'Не удалось определить структуру Template 7'}
                 
-                table_id = result[0]
-            
-            # Парсим товары
-            print(f"\n📦 Парсинг товаров (начало со строки {self.data_start_row})...")
-            products = self._parse_products(ws_data, ws_images, project_id, table_id)
+                # Получаем table_id из БД
+                with self.db.get_session() as session:
+                    result = session.execute(
+                        text("SELECT table_id FROM projects WHERE id = :pid"),
+                        {'pid': project_id}
+                    ).fetchone()
+                    
+                    if not result:
+                        return {'success': False, 'error': 'Project not in DB'}
+                    
+                    table_id = result[0]
+                
+                # Парсим товары
+                print(f"\n📦 Парсинг товаров (начало со строки {self.data_start_row})...")
+                self.writer = ProjectBulkWriter(self.db)
+                products = self._parse_products(ws_data, ws_images, project_id, table_id)
+            finally:
+                wb.close()
             
-            wb_data.close()
-            wb_images.close()
+            # Записываем проект одной транзакцией
+            # Все изображения проекта должны быть на S3 до записи image_url
+            self.image_store.drain()
+            db_stats = self.writer.flush()
+            print(format_throughput(db_stats))
             
             return {
                 'success': True,
                 'products': len(products),
                 'total_offers': sum(len(p['offers']) for p in products),
-                'total_images': sum(len(p['images']) for p in products)
+                'total_images': sum(len(p['images']) for p in products),
+                'db_stats': db_stats
             }
             
         except Exception as e:
@@ -317,47 +329,23 @@ class Template7Parser:
         
         В БД записываем ПУТЬ к будущему облачному файлу (для последующей загрузки на S3)
         
-        ПРАВИЛЬНЫЙ СПОСОБ (как в Template 4): image.anchor._from.row/col
+        ПРАВИЛЬНЫЙ СПОСОБ (как в Template 4): якорь изображения image.row/col
         """
         images = []
         
         try:
-            # Извлекаем все изображения из листа
-            if not hasattr(ws_images, '_images'):
-                return images
-            
-            img_index = 0
-            for image in ws_images._images:
+            # Берем только изображения текущей строки из индекса якорей
+            for image in ws_images.images_in_row(row):
                 try:
-                    # ПРАВИЛЬНЫЙ СПОСОБ: используем anchor._from
-                    if not hasattr(image, 'anchor') or not hasattr(image.anchor, '_from'):
-                        continue
-                    
-                    img_row = image.anchor._from.row + 1  # +1 потому что openpyxl индексы с 0
-                    img_col = image.anchor._from.col + 1
-                    
-                    # Проверяем принадлежность к текущей строке
-                    if img_row != row:
-                        continue
+                    # Координаты якоря уже 1-based (как anchor._from + 1 в openpyxl)
+                    img_col = image.col
                     
                     # Генерируем позицию и имя файла
                     col_letter = chr(64 + img_col)  # 1=A, 2=B, ...
                     cell_pos = f"{col_letter}{row}"
                     
-                    # Получаем данные изображения из blob
-                    img_data = image._data()
-                    img_hash = hashlib.md5(img_data).hexdigest()[:8]
-                    
-                    # Имя файла (с индексом если несколько изображений в строке)
-                    if img_index == 0:
-                        filename = f"{table_id}_{cell_pos}_{img_hash}.png"
-                    else:
-                        filename = f"{table_id}_{cell_pos}_{img_index}_{img_hash}.png"
-                    
-                    # Сохраняем ЛОКАЛЬНО в storage/images/
-                    file_path = self.storage_dir / filename
-                    with open(file_path, 'wb') as f:
-                        f.write(img_data)
+                    # Сохраняем ЛОКАЛЬНО в storage/images/ (имя = хеш содержимого, дубли не пишутся)
+                    img_hash, filename = self.image_store.put(image.data())
                     
                     # КРИТИЧЕСКИ ВАЖНО: В БД сохраняем путь к БУДУЩЕМУ облачному файлу
                     cloud_path = f"73d16f7545b3-promogoods/images/{filename}"
@@ -365,13 +353,12 @@ class Template7Parser:
                     is_main = len(images) == 0  # первое изображение = главное
                     images.append({
                         'filename': filename,
+                        'image_hash': img_hash,
                         'cloud_path': cloud_path,
                         'position': cell_pos,
                         'is_main': is_main
                     })
                     
-                    img_index += 1
-                    
                 except Exception as img_err:
                     print(f"      ⚠️  Ошибка обработки одного изображения: {img_err}")
                     import traceback
@@ -387,97 +374,44 @@ class Template7Parser:
     
     def _save_product(self, product, project_id, table_id):
         """
-        Сохраняет товар в БД (логика Template 4)
+        Добавляет товар в пакетную запись проекта (логика Template 4)
+        
+        В БД пишется одной транзакцией в parse_project
         """
-        try:
-            with self.db.get_session() as session:
-                # Вставляем товар (с created_at!)
-                product_result = session.execute(
-                    text("""
-                        INSERT INTO products (
-                            project_id, name, description, custom_field,
-                            sample_price, sample_delivery_time, row_number,
-                            created_at, updated_at
-                        )
-                        VALUES (
-                            :project_id, :name, :description, :custom_field,
-                            :sample_price, :sample_delivery_time, :row_number,
-                            NOW(), NOW()
-                        )
-                        RETURNING id
-                    """),
-                    {
-                        'project_id': project_id,
-                        'name': product['name'],
-                        'description': product['description'],
-                        'custom_field': product['custom_field'],
-                        'sample_price': product['sample_price'],
-                        'sample_delivery_time': product['sample_delivery_time'],
-                        'row_number': product['row_number']
-                    }
-                )
-                product_id = product_result.fetchone()[0]
-                
-                # Вставляем офферы
-                for offer in product['offers']:
-                    session.execute(
-                        text("""
-                            INSERT INTO price_offers (
-                                product_id, quantity, price_usd, price_rub,
-                                route, delivery_time_days,
-                                created_at, updated_at
-                            )
-                            VALUES (
-                                :product_id, :quantity, :price_usd, :price_rub,
-                                :route, :delivery_time_days,
-                                NOW(), NOW()
-                            )
-                        """),
-                        {
-                            'product_id': product_id,
-                            'quantity': offer['quantity'],
-                            'price_usd': offer['price_usd'],
-                            'price_rub': offer['price_rub'],
-                            'route': offer['route'],
-                            'delivery_time_days': offer['delivery_time_days']
-                        }
-                    )
-                
-                # Вставляем изображения
-                for img in product['images']:
-                    # КРИТИЧЕСКИ ВАЖНО: 
-                    # image_filename = только имя файла
-                    # image_url = полный URL к облачному файлу (для будущей загрузки на S3)
-                    full_s3_url = f"https://s3.ru1.storage.beget.cloud/{img['cloud_path']}"
-                    
-                    session.execute(
-                        text("""
-                            INSERT INTO product_images (
-                                product_id, table_id, cell_position, image_filename,
-                                image_url, is_main_image,
-                                created_at, updated_at
-                            )
-                            VALUES (
-                                :product_id, :table_id, :cell_position, :image_filename,
-                                :image_url, :is_main_image,
-                                NOW(), NOW()
-                            )
-                        """),
-                        {
-                            'product_id': product_id,
-                            'table_id': table_id,
-                            'cell_position': img['position'],
-                            'image_filename': img['filename'],  # только имя файла
-                            'image_url': full_s3_url,  # полный URL на S3 (для будущей загрузки)
-                            'is_main_image': img['is_main']
-                        }
-                    )
-                
-                session.commit()
-                print(f"   ✅ Товар #{product_id}: {product['name']} ({len(product['offers'])} офферов, {len(product['images'])} изображений)")
-                
-        except Exception as e:
-            print(f"   ❌ Ошибка сохранения товара: {e}")
+        images = []
+        for img in product['images']:
+            # КРИТИЧЕСКИ ВАЖНО: 
+            # image_filename = только имя файла
+            # image_url = полный URL к облачному файлу (для будущей загрузки на S3)
+            full_s3_url = f"https://s3.ru1.storage.beget.cloud/{img['cloud_path']}"
+            
+            images.append({
+                'table_id': table_id,
+                'cell_position': img['position'],
+                'image_filename': img['filename'],  # только имя файла
+                'image_hash': img['image_hash'],
+                # полный URL на S3 (конвейер уже загрузил; иначе - для будущей загрузки)
+                'image_url': self.image_store.url_for(img['filename']) or full_s3_url,
+                'is_main_image': img['is_main']
+            })
+        
+        self.writer.add_product({
+            'project_id': project_id,
+            'name': product['name'],
+            'description': product['description'],
+            'custom_field': product['custom_field'],
+            'sample_price': product['sample_price'],
+            'sample_delivery_time': product['sample_delivery_time'],
+            'row_number': product['row_number']
+        }, offers=[{
+            'quantity': offer['quantity'],
+            'price_usd': offer['price_usd'],
+            'price_rub': offer['price_rub'],
+            'route': offer['route'],
+            'delivery_time_days': offer['delivery_time_days']
+        } for offer in product['offers']], images=images)
+        
+        print(f"   ✅ Товар: {product['name']} ({len(product['offers'])} офферов, {len(product['images'])} изображений)")
     
     # ========================================================================
     # ПРОВЕРЕННЫЕ МЕТОДЫ ПАРСИНГА ИЗ TEMPLATE 4
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк загрузки xlsx: двойной load_workbook (старый способ) vs load_workbook_once
+
+Для каждого файла замеряет:
+- wall time (сек)
+- пиковый RSS процесса (МБ)
+
+Каждый замер выполняется в отдельном процессе (spawn), иначе пиковый RSS
+первого прогона маскирует второй.
+
+Использование:
+    python scripts/benchmark_workbook_loading.py                  # storage/excel_files/*.xlsx
+    python scripts/benchmark_workbook_loading.py file1.xlsx ...   # конкретные файлы
+    python scripts/benchmark_workbook_loading.py --limit 20
+"""
+import sys
+import time
+import resource
+import argparse
+import multiprocessing as mp
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _peak_rss_mb():
+    """Пиковый RSS текущего процесса (ru_maxrss в КБ на Linux, в байтах на macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def _load_double(file_path):
+    """Старый способ: два полных открытия + PIL-декодирование картинок"""
+    from openpyxl import load_workbook
+
+    wb_data = load_workbook(file_path, data_only=True)
+    wb_images = load_workbook(file_path, data_only=False)
+    ws_data = wb_data.active
+    ws_images = wb_images.active
+
+    cells = 0
+    for row in range(1, ws_data.max_row + 1):
+        for col in range(1, ws_data.max_column + 1):
+            if ws_data.cell(row, col).value is not None:
+                cells += 1
+
+    images = 0
+    for image in ws_images._images:
+        if image._data():
+            images += 1
+
+    wb_data.close()
+    wb_images.close()
+    return cells, images
+
+
+def _load_once(file_path):
+    """Новый способ: одно открытие (read_only) + изображения из zip"""
+    from utils.workbook_loader import load_workbook_once
+
+    wb = load_workbook_once(file_path)
+    ws = wb.active
+
+    cells = 0
+    for row in range(1, ws.max_row + 1):
+        for col in range(1, ws.max_column + 1):
+            if ws.cell(row, col).value is not None:
+                cells += 1
+
+    images = 0
+    for image in ws.images:
+        if image.data():
+            images += 1
+
+    wb.close()
+    return cells, images
+
+
+LOADERS = {
+    'double': _load_double,
+    'once': _load_once,
+}
+
+
+def _measure(loader_name, file_path, queue):
+    """Выполняется в дочернем процессе"""
+    try:
+        start = time.perf_counter()
+        cells, images = LOADERS[loader_name](file_path)
+        elapsed = time.perf_counter() - start
+        queue.put({
+            'ok': True,
+            'time': elapsed,
+            'rss_mb': _peak_rss_mb(),
+            'cells': cells,
+            'images': images,
+        })
+    except Exception as e:
+        queue.put({'ok': False, 'error': str(e)})
+
+
+def run_isolated(ctx, loader_name, file_path):
+    """Запускает замер в свежем процессе и возвращает результат"""
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(loader_name, str(file_path), queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк загрузки xlsx')
+    parser.add_argument('files', nargs='*', help='xlsx файлы (по умолчанию storage/excel_files/*.xlsx)')
+    parser.add_argument('--limit', type=int, default=None, help='Максимум файлов')
+    args = parser.parse_args()
+
+    if args.files:
+        files = [Path(f) for f in args.files]
+    else:
+        files = sorted(Path('storage/excel_files').glob('*.xlsx'))
+
+    if args.limit:
+        files = files[:args.limit]
+
+    if not files:
+        print("❌ Нет файлов для бенчмарка")
+        return
+
+    ctx = mp.get_context('spawn')
+
+    print("=" * 100)
+    print("📊 БЕНЧМАРК ЗАГРУЗКИ XLSX: double (2× load_workbook) vs once (load_workbook_once)")
+    print("=" * 100)
+    print(f"{'Файл':<45} {'double, с':>10} {'once, с':>10} {'double, МБ':>11} {'once, МБ':>10} {'изобр.':>7}")
+    print("-" * 100)
+
+    totals = {'double_time': 0.0, 'once_time': 0.0, 'double_rss': 0.0, 'once_rss': 0.0}
+    measured = 0
+
+    for file_path in files:
+        before = run_isolated(ctx, 'double', file_path)
+        after = run_isolated(ctx, 'once', file_path)
+
+        if not before['ok'] or not after['ok']:
+            error = before.get('error') or after.get('error')
+            print(f"{file_path.name[:45]:<45} ❌ {error}")
+            continue
+
+        if before['cells'] != after['cells'] or before['images'] != after['images']:
+            print(f"⚠️  {file_path.name}: расхождение "
+                  f"(ячейки {before['cells']}/{after['cells']}, изображения {before['images']}/{after['images']})")
+
+        print(f"{file_path.name[:45]:<45} "
+              f"{before['time']:>10.2f} {after['time']:>10.2f} "
+              f"{before['rss_mb']:>11.1f} {after['rss_mb']:>10.1f} "
+              f"{after['images']:>7}")
+
+        totals['double_time'] += before['time']
+        totals['once_time'] += after['time']
+        totals['double_rss'] = max(totals['double_rss'], before['rss_mb'])
+        totals['once_rss'] = max(totals['once_rss'], after['rss_mb'])
+        measured += 1
+
+    print("-" * 100)
+    if measured:
+        speedup = totals['double_time'] / totals['once_time'] if totals['once_time'] else 0
+        print(f"📁 Файлов: {measured}")
+        print(f"⏱️  Время: {totals['double_time']:.2f}с → {totals['once_time']:.2f}с (×{speedup:.1f})")
+        print(f"💾 Пиковый RSS: {totals['double_rss']:.1f} МБ → {totals['once_rss']:.1f} МБ")
+    print("=" * 100)
+
+
+if __name__ == "__main__":
+    main()
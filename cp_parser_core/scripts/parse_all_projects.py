@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Параллельный парсинг всех проектов шаблона (ProcessPoolExecutor)
+
+Заменяет последовательные parse_all_perfect() / main() парсеров шаблонов,
+parsing_template_4.pid и watch_*-скрипты мониторинга.
+
+- Каждый воркер - отдельный процесс со СВОИМ парсером и своим engine БД
+  (spawn, соединения не наследуются от родителя)
+- В работе одновременно не больше --max-in-flight проектов
+- Прогресс пишется в checkpoint-файл после каждого проекта:
+  повторный запуск продолжает с места остановки
+- В конце - сводка по всем воркерам
+
+Запуск (из папки cp_parser, где лежат storage/ и списки ID):
+    python ../cp_parser_core/scripts/parse_all_projects.py --template 4
+    python ../cp_parser_core/scripts/parse_all_projects.py --template 7 --workers 8
+    python ../cp_parser_core/scripts/parse_all_projects.py --template 6 --ids ids.txt
+    python ../cp_parser_core/scripts/parse_all_projects.py --template 4 --status   # вместо watch_*
+    python ../cp_parser_core/scripts/parse_all_projects.py --template 4 --reset    # начать заново
+"""
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import importlib
+import multiprocessing as mp
+import multiprocessing.util
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+CORE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path.cwd()))
+sys.path.insert(0, str(CORE_DIR))
+
+
+# Шаблон → (модуль, класс парсера, файл со списком ID по умолчанию)
+TEMPLATES = {
+    4: ('parsers.parse_template_4', 'Template4Parser', 'template_4_perfect_ids.txt'),
+    5: ('parsers.parse_template_5', 'Template5Parser', 'template_5_candidate_ids.txt'),
+    6: ('parsers.parse_template_6', 'Template6Parser', None),
+    7: ('parsers.parse_template_7_clean', 'Template7Parser', 'TEMPLATE7_FILTERED_RESULTS.json'),
+}
+
+# Динамическое состояние, которое парсер Template 7 не сбрасывает сам
+RESET_STATE = {
+    7: {'columns': {}, 'routes': {}, 'header_row': None, 'data_start_row': None},
+}
+
+
+# ===== Воркер (выполняется в дочернем процессе) =====
+
+_worker_parser = None
+_worker_template = None
+
+
+def _init_worker(template):
+    """Создает парсер (и его engine БД) один раз на процесс"""
+    global _worker_parser, _worker_template
+
+    module_name, class_name, _ = TEMPLATES[template]
+    module = importlib.import_module(module_name)
+
+    _worker_template = template
+    _worker_parser = getattr(module, class_name)()
+
+    # При завершении процесса - останавливаем пулы конвейера изображений (если он есть)
+    image_store = getattr(_worker_parser, 'image_store', None)
+    if image_store is not None:
+        mp.util.Finalize(None, image_store.close, exitpriority=10)
+
+
+def _parse_one(project_id):
+    """Парсит один проект в воркере, возвращает компактный результат"""
+    from sqlalchemy import text
+
+    for attr, value in RESET_STATE.get(_worker_template, {}).items():
+        setattr(_worker_parser, attr, copy.copy(value))
+
+    started = time.perf_counter()
+    try:
+        result = _worker_parser.parse_project(project_id)
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+
+    summary = {
+        'project_id': project_id,
+        'success': bool(result.get('success')),
+        'seconds': time.perf_counter() - started,
+        'worker_pid': os.getpid(),
+    }
+
+    if not summary['success']:
+        summary['error'] = str(result.get('error', 'Unknown error'))[:500]
+        return summary
+
+    # Template 6 возвращает images/offers, остальные - total_images/total_offers
+    db_stats = result.get('db_stats') or {}
+    summary.update({
+        'products': result.get('products', 0),
+        'offers': result.get('total_offers', result.get('offers', 0)),
+        'images': result.get('total_images', result.get('images', 0)),
+        'db_rows': db_stats.get('rows', 0),
+    })
+
+    # Как в parse_all_perfect() Шаблона 4: отмечаем проект обработанным
+    if _worker_template == 4:
+        with _worker_parser.db.get_session() as session:
+            session.execute(text("""
+                UPDATE projects
+                SET parsing_status = 'completed',
+                    parsed_at = :parsed_at
+                WHERE id = :pid
+            """), {'pid': project_id, 'parsed_at': datetime.now().isoformat()})
+
+    return summary
+
+
+# ===== Checkpoint =====
+
+class Checkpoint:
+    """
+    Прогресс парсинга в JSON-файле
+
+    done   - {project_id: краткий результат}
+    failed - {project_id: ошибка}
+    """
+
+    def __init__(self, path, template):
+        self.path = Path(path)
+        self.data = {
+            'template': template,
+            'driver_pid': None,
+            'started_at': None,
+            'updated_at': None,
+            'total': 0,
+            'done': {},
+            'failed': {},
+        }
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data.update(json.load(f))
+
+    @property
+    def done(self):
+        return self.data['done']
+
+    @property
+    def failed(self):
+        return self.data['failed']
+
+    def start(self, total):
+        self.data['driver_pid'] = os.getpid()
+        self.data['started_at'] = self.data['started_at'] or datetime.now().isoformat()
+        self.data['total'] = total
+        self.save()
+
+    def record(self, summary):
+        key = str(summary['project_id'])
+        if summary['success']:
+            self.failed.pop(key, None)
+            self.done[key] = {k: v for k, v in summary.items() if k not in ('project_id', 'success')}
+        else:
+            self.failed[key] = summary.get('error')
+        self.save()
+
+    def finish(self):
+        self.data['driver_pid'] = None
+        self.save()
+
+    def save(self):
+        """Атомарная запись: tmp-файл + rename (не бьется при Ctrl+C)"""
+        self.data['updated_at'] = datetime.now().isoformat()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+# ===== Список проектов =====
+
+def load_project_ids(path):
+    """ID проектов из txt (по одному в строке) или JSON Template 7"""
+    path = Path(path)
+    if path.suffix == '.json':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return [int(pid) for pid in data.get('template7_projects', [])]
+
+    with open(path, 'r') as f:
+        return [int(line.strip()) for line in f if line.strip()]
+
+
+# ===== Вывод =====
+
+def _is_running(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def print_summary(checkpoint, run_stats=None):
+    """Сводка по checkpoint (и для --status, и в конце прогона)"""
+    done = checkpoint.done.values()
+    total = checkpoint.data['total'] or 0
+    processed = len(checkpoint.done) + len(checkpoint.failed)
+
+    products = sum(r.get('products', 0) for r in done)
+    offers = sum(r.get('offers', 0) for r in done)
+    images = sum(r.get('images', 0) for r in done)
+
+    print("=" * 80)
+    print(f"📊 ПАРСИНГ ШАБЛОНА {checkpoint.data['template']}")
+    print("=" * 80)
+
+    driver_pid = checkpoint.data.get('driver_pid')
+    if _is_running(driver_pid):
+        print(f"🟢 Выполняется (PID {driver_pid})")
+    elif processed < total:
+        print("⏸️  Остановлен - повторный запуск продолжит с места остановки")
+
+    if total:
+        print(f"✅ Обработано:   {processed:>5} / {total}  ({processed * 100 // total}%)")
+        print(f"   {'▓' * (processed * 60 // total)}{'░' * (60 - processed * 60 // total)}")
+    print(f"✅ Успешно:      {len(checkpoint.done):>5}")
+    print(f"❌ Ошибки:       {len(checkpoint.failed):>5}")
+    print("")
+    print(f"📦 Товары:       {products:,}")
+    print(f"💰 Предложения:  {offers:,}")
+    print(f"🖼️  Изображения:  {images:,}")
+
+    if run_stats and run_stats['elapsed']:
+        elapsed = run_stats['elapsed']
+        print("")
+        print(f"⏱️  Время:        {elapsed:.1f}с (суммарно по воркерам {run_stats['worker_seconds']:.1f}с, "
+              f"воркеров: {len(run_stats['worker_pids'])})")
+        print(f"⚡ Скорость:     {run_stats['projects'] / elapsed * 60:.1f} проектов/мин, "
+              f"{run_stats['db_rows'] / elapsed:,.0f} строк/сек в БД")
+    elif checkpoint.data.get('started_at') and processed:
+        started = datetime.fromisoformat(checkpoint.data['started_at'])
+        updated = datetime.fromisoformat(checkpoint.data['updated_at'])
+        run_seconds = (updated - started).total_seconds()
+        if run_seconds > 0 and total > processed:
+            eta = (total - processed) * run_seconds / processed
+            print(f"\n⏱️  Осталось:     ~{int(eta // 60)} мин")
+
+    if checkpoint.failed:
+        print("\n❌ Ошибки (первые 10):")
+        for pid, error in list(checkpoint.failed.items())[:10]:
+            print(f"   #{pid}: {str(error)[:100]}")
+
+    print("=" * 80)
+
+
+# ===== Драйвер =====
+
+def run(template, project_ids, checkpoint, workers, max_in_flight, retry_failed):
+    """Раздает проекты по процессам, держит не больше max_in_flight в работе"""
+    skip = set(checkpoint.done)
+    if not retry_failed:
+        skip |= set(checkpoint.failed)
+    pending = [pid for pid in project_ids if str(pid) not in skip]
+
+    checkpoint.start(len(project_ids))
+
+    print(f"📋 Всего проектов: {len(project_ids)} | уже обработано: {len(project_ids) - len(pending)} | "
+          f"к обработке: {len(pending)}")
+    print(f"⚙️  Воркеров: {workers} | в работе одновременно: до {max_in_flight}")
+    print(f"💾 Checkpoint: {checkpoint.path}\n")
+
+    started = time.perf_counter()
+    queue = iter(pending)
+    completed = 0
+    run_stats = {'projects': 0, 'db_rows': 0, 'worker_seconds': 0.0, 'worker_pids': set()}
+
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(template,)) as executor:
+        in_flight = set()
+
+        def submit_next():
+            project_id = next(queue, None)
+            if project_id is None:
+                return False
+            in_flight.add(executor.submit(_parse_one, project_id))
+            return True
+
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                in_flight.discard(future)
+                summary = future.result()
+                checkpoint.record(summary)
+                completed += 1
+                run_stats['worker_seconds'] += summary['seconds']
+                run_stats['worker_pids'].add(summary['worker_pid'])
+
+                if summary['success']:
+                    run_stats['projects'] += 1
+                    run_stats['db_rows'] += summary['db_rows']
+                    print(f"   ✅ [{completed}/{len(pending)}] #{summary['project_id']}: "
+                          f"{summary['products']} товаров, {summary['offers']} офферов, "
+                          f"{summary['images']} изображений ({summary['seconds']:.1f}с)")
+                else:
+                    print(f"   ❌ [{completed}/{len(pending)}] #{summary['project_id']}: {summary['error'][:100]}")
+
+                submit_next()
+
+    run_stats['elapsed'] = time.perf_counter() - started
+    checkpoint.finish()
+    return run_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Параллельный парсинг проектов шаблона')
+    parser.add_argument('--template', type=int, required=True, choices=sorted(TEMPLATES))
+    parser.add_argument('--ids', help='Файл со списком ID (txt или JSON Template 7)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Процессов (по умолчанию = ядер)')
+    parser.add_argument('--max-in-flight', type=int, default=None, help='Проектов в работе одновременно (по умолчанию 2 × workers)')
+    parser.add_argument('--checkpoint', help='Файл прогресса (по умолчанию storage/parse_checkpoint_template_N.json)')
+    parser.add_argument('--retry-failed', action='store_true', help='Повторить проекты с ошибками')
+    parser.add_argument('--reset', action='store_true', help='Начать заново (удалить checkpoint)')
+    parser.add_argument('--status', action='store_true', help='Показать прогресс и выйти')
+    args = parser.parse_args()
+
+    checkpoint_path = Path(args.checkpoint or f'storage/parse_checkpoint_template_{args.template}.json')
+
+    if args.status:
+        if not checkpoint_path.exists():
+            print(f"❌ Checkpoint не найден: {checkpoint_path}")
+            return
+        print_summary(Checkpoint(checkpoint_path, args.template))
+        return
+
+    ids_file = args.ids or TEMPLATES[args.template][2]
+    if not ids_file or not Path(ids_file).exists():
+        print(f"❌ Файл со списком ID не найден: {ids_file} (укажите --ids)")
+        return
+
+    if args.reset and checkpoint_path.exists():
+        checkpoint_path.unlink()
+
+    checkpoint = Checkpoint(checkpoint_path, args.template)
+
+    driver_pid = checkpoint.data.get('driver_pid')
+    if driver_pid != os.getpid() and _is_running(driver_pid):
+        print(f"❌ Парсинг уже запущен (PID {driver_pid}). Прогресс: --status")
+        return
+
+    project_ids = load_project_ids(ids_file)
+    workers = max(1, args.workers)
+    max_in_flight = max(workers, args.max_in_flight or workers * 2)
+
+    # Ядра делим между воркерами парсинга и их пулами WebP-кодирования (utils/image_pipeline.py)
+    os.environ.setdefault('IMAGE_ENCODE_WORKERS', str(max(1, (os.cpu_count() or 1) // workers)))
+
+    print("=" * 80)
+    print(f"🚀 ПАРАЛЛЕЛЬНЫЙ ПАРСИНГ ШАБЛОНА {args.template}")
+    print("=" * 80)
+
+    try:
+        run_stats = run(args.template, project_ids, checkpoint, workers, max_in_flight, args.retry_failed)
+    except KeyboardInterrupt:
+        checkpoint.finish()
+        print("\n⏸️  Остановлено. Повторный запуск продолжит с места остановки")
+        return
+
+    print("")
+    print_summary(checkpoint, run_stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Пакетная запись товаров проекта в PostgreSQL
+
+Раньше _save_product делал отдельный INSERT (и часто commit) на КАЖДУЮ строку
+products / price_offers / product_images - один сетевой round trip до Railway
+на строку.
+
+Теперь парсер только складывает товары в буфер, а запись идет одной транзакцией
+на проект:
+1. id товаров резервируются одним запросом (nextval × N)
+2. products, price_offers, product_images - многострочные INSERT (execute_values)
+3. product_listing (витрина для /products) - refresh_product_listing() по
+   товарам проекта, в той же транзакции (триггеры витрины на время записи
+   отключены - иначе каждый INSERT пересчитывал бы те же товары)
+4. project_stats (счетчики /projects и /project/<id>) - refresh_project_stats()
+   по затронутым проектам, в той же транзакции (триггеры счетчиков тоже
+   отключены на время записи)
+5. commit один раз, затем сброс общего кэша статистики главной страницы
+"""
+import time
+
+from psycopg2.extras import execute_values
+from sqlalchemy import text
+
+from database.schema_features import NUMERIC_OFFERS_SQL, schema_feature
+from database.stats_cache import invalidate_dashboard_stats
+from utils.offer_values import NUMERIC_COLUMNS, with_numeric_columns
+
+
+# Сколько строк в одном INSERT ... VALUES (ограничение на размер запроса)
+PAGE_SIZE = 1000
+
+
+class ProjectBulkWriter:
+    """
+    Буфер записи одного проекта
+
+    Использование:
+        writer = ProjectBulkWriter(db)
+        writer.add_product({'project_id': ..., 'name': ...}, offers=[...], images=[...])
+        stats = writer.flush()
+
+    Ключи словарей = имена колонок. product_id для offers/images подставляется сам.
+    created_at / updated_at всегда NOW() (одинаковые для всего проекта).
+    Числовые quantity_num / price_usd_num / price_rub_num офферов заполняются сами.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.products = []
+        self.offers = []
+        self.images = []
+        # Время начала = начало парсинга (для метрики parse-to-DB)
+        self.started_at = time.perf_counter()
+
+    def add_product(self, product_row, offers=None, images=None):
+        """Добавляет товар с офферами и изображениями в буфер"""
+        index = len(self.products)
+        self.products.append(product_row)
+        for offer in offers or []:
+            self.offers.append((index, with_numeric_columns(offer)))
+
+        # Одна и та же картинка (тот же image_hash) в товаре - одна строка
+        seen_hashes = set()
+        for image in images or []:
+            image_hash = image.get('image_hash')
+            if image_hash:
+                if image_hash in seen_hashes:
+                    continue
+                seen_hashes.add(image_hash)
+            self.images.append((index, image))
+
+    def add_images(self, product_id, images):
+        """Добавляет изображения к УЖЕ существующему товару (допарсинг изображений)"""
+        for image in images:
+            self.images.append((None, dict(image, product_id=product_id)))
+
+    def __len__(self):
+        return len(self.products)
+
+    def flush(self):
+        """Записывает буфер одной транзакцией и возвращает статистику"""
+        stats = {
+            'products': len(self.products),
+            'offers': len(self.offers),
+            'images': len(self.images),
+        }
+        stats['rows'] = stats['products'] + stats['offers'] + stats['images']
+
+        write_started = time.perf_counter()
+
+        if stats['rows']:
+            with self.db.get_session() as session:
+                # Витрину и счетчики пересчитают шаги 4-5 - их триггеры не нужны
+                if _listing_function(session):
+                    session.execute(text("SET LOCAL product_listing.deferred = 'on'"))
+                if _project_stats_function(session):
+                    session.execute(text("SET LOCAL project_stats.deferred = 'on'"))
+
+                # 1. Резервируем id товаров одним запросом
+                product_ids = []
+                if self.products:
+                    product_ids = [
+                        row[0] for row in session.execute(text("""
+                            SELECT nextval(pg_get_serial_sequence('products', 'id'))
+                            FROM generate_series(1, :n)
+                        """), {'n': len(self.products)})
+                    ]
+
+                cursor = session.connection().connection.cursor()
+                try:
+                    # 2. Товары с заранее известными id
+                    _insert_rows(cursor, 'products', [
+                        dict(row, id=product_id)
+                        for row, product_id in zip(self.products, product_ids)
+                    ])
+
+                    # 3. Офферы и изображения
+                    numeric_offers = _numeric_offers(session)
+                    _insert_rows(cursor, 'price_offers', [
+                        dict(offer if numeric_offers else _without_numeric(offer),
+                             product_id=product_ids[index])
+                        for index, offer in self.offers
+                    ])
+                    image_hash = _image_hash_column(session)
+                    _insert_rows(cursor, 'product_images', [
+                        dict(image if image_hash else _without_image_hash(image),
+                             **({} if index is None else {'product_id': product_ids[index]}))
+                        for index, image in self.images
+                    ])
+                finally:
+                    cursor.close()
+
+                # 4. Витрина списка товаров: главное изображение, мин. цена, тираж, срок
+                touched_ids = set(product_ids)
+                touched_ids.update(image['product_id'] for index, image in self.images if index is None)
+                stats['listing_rows'] = _refresh_listing(session, sorted(touched_ids))
+
+                # 5. Счетчики проектов этих товаров
+                stats['project_stats_rows'] = _refresh_project_stats(session, sorted(touched_ids))
+            # commit делает get_session()
+
+            # Главная / /api/stats пересчитают статистику при следующем запросе
+            invalidate_dashboard_stats()
+
+            stats['product_ids'] = product_ids
+
+        finished = time.perf_counter()
+        stats['write_seconds'] = finished - write_started
+        stats['total_seconds'] = finished - self.started_at
+        stats['rows_per_sec'] = stats['rows'] / stats['total_seconds'] if stats['total_seconds'] else 0
+        stats['write_rows_per_sec'] = stats['rows'] / stats['write_seconds'] if stats['write_seconds'] else 0
+
+        self.products = []
+        self.offers = []
+        self.images = []
+
+        return stats
+
+
+def _insert_rows(cursor, table, rows):
+    """Многострочный INSERT (колонки берутся из ключей первой строки)"""
+    if not rows:
+        return
+
+    columns = list(rows[0].keys())
+    column_list = ', '.join(columns + ['created_at', 'updated_at'])
+    template = '(' + ', '.join(['%s'] * len(columns)) + ', NOW(), NOW())'
+
+    execute_values(
+        cursor,
+        f"INSERT INTO {table} ({column_list}) VALUES %s",
+        [tuple(row.get(col) for col in columns) for row in rows],
+        template=template,
+        page_size=PAGE_SIZE
+    )
+
+
+def _numeric_offers(session):
+    """Есть ли price_offers.quantity_num / price_usd_num / price_rub_num"""
+    return schema_feature(
+        session, 'price_offers.numeric', NUMERIC_OFFERS_SQL,
+        missing="Числовых колонок price_offers нет - пишу только текст "
+                "(database/add_price_offer_numeric_columns.py)"
+    )
+
+
+def _without_numeric(offer):
+    return {k: v for k, v in offer.items() if k not in NUMERIC_COLUMNS.values()}
+
+
+def _image_hash_column(session):
+    """Есть ли product_images.image_hash"""
+    return schema_feature(session, 'product_images.image_hash', """
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'product_images' AND column_name = 'image_hash'
+        )
+    """, missing="Колонки product_images.image_hash нет - пишу без хеша "
+                 "(database/add_image_hash_column.py)")
+
+
+def _without_image_hash(image):
+    return {k: v for k, v in image.items() if k != 'image_hash'}
+
+
+def _listing_function(session):
+    """Есть ли refresh_product_listing()"""
+    return schema_feature(
+        session, 'refresh_product_listing', "SELECT to_regproc('refresh_product_listing') IS NOT NULL",
+        missing="product_listing не создана - пропускаю (database/create_product_listing.py)"
+    )
+
+
+def _refresh_listing(session, product_ids):
+    """Пересчитывает product_listing для товаров (0, если миграция не применена)"""
+    if not product_ids or not _listing_function(session):
+        return 0
+
+    return session.execute(text(
+        "SELECT refresh_product_listing(CAST(:ids AS INTEGER[]))"
+    ), {'ids': product_ids}).scalar()
+
+
+def _project_stats_function(session):
+    """Есть ли refresh_project_stats()"""
+    return schema_feature(
+        session, 'refresh_project_stats', "SELECT to_regproc('refresh_project_stats') IS NOT NULL",
+        missing="project_stats не создана - пропускаю (database/create_project_stats.py)"
+    )
+
+
+def _refresh_project_stats(session, product_ids):
+    """Пересчитывает project_stats для проектов товаров (0, если миграция не применена)"""
+    if not product_ids or not _project_stats_function(session):
+        return 0
+
+    # Проекты берем по товарам: add_images() знает только product_id
+    return session.execute(text("""
+        SELECT refresh_project_stats(ARRAY(
+            SELECT DISTINCT project_id FROM products WHERE id = ANY(CAST(:ids AS INTEGER[]))
+        ))
+    """), {'ids': product_ids}).scalar()
+
+
+def format_throughput(stats):
+    """Строка для лога: сколько строк записано и с какой скоростью"""
+    return (
+        f"💾 Записано {stats['rows']} строк "
+        f"({stats['products']} товаров, {stats['offers']} офферов, {stats['images']} изображений) "
+        f"за {stats['write_seconds']:.2f}с | parse→DB: {stats['rows_per_sec']:.0f} строк/сек"
+    )
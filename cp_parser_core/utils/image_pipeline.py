@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Потоковый конвейер изображений: извлечение → WebP → S3
+
+Раньше изображения проходили три прохода:
+1. парсер пишет PNG в storage/images
+2. отдельная загрузка на S3
+3. compress_images_parallel.py скачивает их обратно, пережимает в WebP
+   и загружает повторно
+
+Теперь прямо во время парсинга:
+    парсер (байты из xlsx)
+        → пул ПРОЦЕССОВ: resize + WebP
+        → пул ПОТОКОВ: загрузка на S3 (один boto3-клиент с пулом соединений)
+
+- Между стадиями ограниченная очередь (max_pending): если S3 или кодирование
+  не успевают, парсер ждет, память не растет
+- Ключ на S3 = хеш содержимого ({digest}.webp), поэтому итоговый image_url
+  известен сразу и пишется в той же транзакции, что и товар.
+  Перед commit парсер вызывает drain() - все загрузки проекта должны завершиться
+- Временных файлов нет
+
+Включается, если задан S3_ACCESS_KEY (см. ImagePipeline.from_env()).
+"""
+import os
+import io
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image
+
+
+# Настройки сжатия (как в compress_images_parallel.py)
+MAX_DIMENSION = 1920
+WEBP_QUALITY = 85
+WEBP_METHOD = 6
+
+# Сколько изображений одновременно в конвейере (кодирование + загрузка)
+MAX_PENDING = 64
+
+# Сигнатуры для загрузки как есть, если PIL не смог декодировать (EMF и т.п.)
+RAW_CONTENT_TYPES = (
+    (b'\x89PNG', 'image/png'),
+    (b'\xff\xd8', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+)
+
+
+def encode_webp(data, max_dimension=MAX_DIMENSION, quality=WEBP_QUALITY, method=WEBP_METHOD):
+    """Resize + WebP (выполняется в пуле процессов)"""
+    img = Image.open(io.BytesIO(data))
+
+    if max(img.size) > max_dimension:
+        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    # Прозрачность → белый фон
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    output = io.BytesIO()
+    img.save(output, format='WebP', quality=quality, method=method)
+    return output.getvalue()
+
+
+def _raw_content_type(data):
+    for signature, content_type in RAW_CONTENT_TYPES:
+        if data.startswith(signature):
+            return content_type
+    return 'application/octet-stream'
+
+
+class ImagePipeline:
+    """
+    Конвейер extract → WebP → S3 с ограниченными очередями
+
+    Использование:
+        pipeline = ImagePipeline.from_env()
+        pipeline.reset()                               # в начале проекта
+        pipeline.submit(digest, filename, img_bytes)   # не блокирует, пока очередь не полна
+        url = pipeline.url_for(filename)
+        pipeline.drain()                               # перед commit проекта
+        pipeline.close()                               # при завершении процесса
+    """
+
+    extension = 'webp'
+
+    def __init__(self, bucket, endpoint, access_key, secret_key, region='ru1',
+                 prefix='images/', public_base_url=None,
+                 encode_workers=None, upload_workers=8, max_pending=MAX_PENDING):
+        self.bucket = bucket
+        self.endpoint = endpoint.rstrip('/')
+        self.prefix = prefix
+        self.public_base_url = (public_base_url or f"{self.endpoint}/{bucket}").rstrip('/')
+
+        self._access_key = access_key
+        self._secret_key = secret_key
+        self._region = region
+
+        self.encode_workers = encode_workers or os.cpu_count() or 1
+        self.upload_workers = upload_workers
+
+        # Пулы создаются лениво - при первом изображении
+        self._encode_pool = None
+        self._upload_pool = None
+        self._s3 = None
+
+        # Ограниченная очередь: submit() ждет, если в конвейере max_pending изображений
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Condition()
+        self._in_flight = set()
+        self._uploaded = set()
+        self._errors = {}
+
+        self.stats = {'uploaded': 0, 'already_on_s3': 0, 'raw': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    @classmethod
+    def from_env(cls):
+        """Конвейер из переменных окружения, None если S3 не настроен"""
+        access_key = os.getenv('S3_ACCESS_KEY')
+        secret_key = os.getenv('S3_SECRET_KEY')
+        if not access_key or not secret_key:
+            return None
+
+        encode_workers = os.getenv('IMAGE_ENCODE_WORKERS')
+        return cls(
+            bucket=os.getenv('S3_BUCKET', '73d16f7545b3-promogoods'),
+            endpoint=os.getenv('S3_ENDPOINT', 'https://s3.ru1.storage.beget.cloud'),
+            access_key=access_key,
+            secret_key=secret_key,
+            region=os.getenv('S3_REGION', 'ru1'),
+            prefix=os.getenv('CLOUD_IMAGES_PREFIX', 'images/'),
+            public_base_url=os.getenv('S3_BASE_URL'),
+            encode_workers=int(encode_workers) if encode_workers else None,
+            upload_workers=int(os.getenv('IMAGE_UPLOAD_WORKERS', '8')),
+        )
+
+    # ===== Публичный интерфейс =====
+
+    def url_for(self, filename):
+        """Итоговый публичный URL изображения"""
+        return f"{self.public_base_url}/{self.prefix}{filename}"
+
+    def submit(self, digest, filename, data):
+        """
+        Ставит изображение в конвейер (одинаковый digest - один раз)
+        True - поставлено, False - уже загружено или в работе.
+        Digest с ошибкой загрузки не считается загруженным и ставится заново.
+        """
+        with self._lock:
+            if digest in self._uploaded or digest in self._in_flight:
+                return False
+            self._in_flight.add(digest)
+
+        try:
+            self._start()
+        except Exception:
+            with self._lock:
+                self._in_flight.discard(digest)
+                self._lock.notify_all()
+            raise
+
+        # Backpressure: ждем свободное место в конвейере
+        self._slots.acquire()
+
+        try:
+            future = self._encode_pool.submit(encode_webp, data)
+        except Exception as e:
+            self._finish(digest, e)
+            return True
+
+        self._count('bytes_in', len(data))
+        future.add_done_callback(lambda f: self._on_encoded(digest, filename, data, f))
+        return True
+
+    def reset(self):
+        """
+        Начало проекта: ждет загрузки, оставшиеся от прошлого (прерванного)
+        проекта, и забывает его ошибки - drain() этого проекта они не валят
+        """
+        with self._lock:
+            while self._in_flight:
+                self._lock.wait()
+            self._errors = {}
+
+    def drain(self):
+        """Ждет завершения всех изображений; ошибка загрузки = исключение"""
+        with self._lock:
+            while self._in_flight:
+                self._lock.wait()
+
+            errors, self._errors = self._errors, {}
+
+        if errors:
+            digest, error = next(iter(errors.items()))
+            raise RuntimeError(f"Не загружено изображений: {len(errors)} (например {digest}: {error})")
+
+    def close(self):
+        """Останавливает пулы (после drain)"""
+        if self._encode_pool:
+            self._encode_pool.shutdown(wait=True)
+        if self._upload_pool:
+            self._upload_pool.shutdown(wait=True)
+        self._encode_pool = self._upload_pool = None
+
+    # ===== Стадии =====
+
+    def _start(self):
+        if self._encode_pool is not None:
+            return
+
+        import boto3
+        from botocore.config import Config
+
+        # spawn: у парсера уже есть потоки и соединения с БД, fork их не переживет
+        self._encode_pool = ProcessPoolExecutor(max_workers=self.encode_workers,
+                                                mp_context=mp.get_context('spawn'))
+        self._upload_pool = ThreadPoolExecutor(max_workers=self.upload_workers,
+                                               thread_name_prefix='s3-upload')
+        # Клиент boto3 потокобезопасен: один на все потоки, пул соединений по числу потоков
+        self._s3 = boto3.client(
+            's3',
+            aws_access_key_id=self._access_key,
+            aws_secret_access_key=self._secret_key,
+            region_name=self._region,
+            endpoint_url=self.endpoint,
+            config=Config(
+                signature_version='s3v4',
+                s3={'addressing_style': 'path'},
+                max_pool_connections=self.upload_workers,
+                retries={'max_attempts': 5, 'mode': 'standard'},
+            )
+        )
+
+    def _on_encoded(self, digest, filename, data, future):
+        """Кодирование готово → в очередь загрузки"""
+        try:
+            body = future.result()
+            content_type = 'image/webp'
+        except Exception:
+            # PIL не умеет этот формат - загружаем оригинал (имя то же, тип - настоящий)
+            body = data
+            content_type = _raw_content_type(data)
+            self._count('raw')
+
+        try:
+            self._upload_pool.submit(self._upload, digest, filename, body, content_type)
+        except Exception as e:
+            self._finish(digest, e)
+
+    def _upload(self, digest, filename, body, content_type):
+        key = f"{self.prefix}{filename}"
+        try:
+            # Ключ = хеш содержимого: если объект уже есть, он тот же самый
+            try:
+                self._s3.head_object(Bucket=self.bucket, Key=key)
+                self._count('already_on_s3')
+            except self._s3.exceptions.ClientError:
+                self._s3.put_object(
+                    Bucket=self.bucket,
+                    Key=key,
+                    Body=body,
+                    ContentType=content_type,
+                    CacheControl='public, max-age=31536000, immutable'
+                )
+                self._count('uploaded')
+                self._count('bytes_out', len(body))
+            self._finish(digest)
+        except Exception as e:
+            self._finish(digest, e)
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _finish(self, digest, error=None):
+        with self._lock:
+            self._in_flight.discard(digest)
+            if error is None:
+                self._uploaded.add(digest)
+            else:
+                self._errors[digest] = str(error)[:200]
+            self._lock.notify_all()
+        self._slots.release()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Контентно-адресуемое хранилище изображений
+
+Имя файла = BLAKE2b-хеш байтов изображения:
+    storage/images/{digest}.png
+
+- Хеш считается ОДИН раз при парсинге (раньше: abs(hash(img.ref)) - случайный
+  на каждый процесс, плюс отдельный MD5-проход по всем файлам для удаления дублей)
+- Одинаковая картинка из разных ячеек / проектов хранится ОДИН раз,
+  на S3 тоже уходит один раз
+- product_images.image_hash ссылается на blob, image_filename = {digest}.png
+
+Если задан конвейер (ImagePipeline, S3 настроен), локальные файлы не пишутся:
+байты сразу уходят в WebP → S3, image_filename = {digest}.webp,
+а image_url - итоговый URL на S3.
+"""
+import os
+import hashlib
+from pathlib import Path
+
+
+# 16 байт = 32 hex-символа, коллизии на наших объемах исключены
+DIGEST_SIZE = 16
+
+
+def image_digest(data):
+    """BLAKE2b-хеш байтов изображения (hex)"""
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+
+
+class ImageStore:
+    """
+    Хранилище blob'ов изображений по хешу содержимого
+
+    Использование:
+        store = ImageStore()
+        store.begin_project()
+        digest, filename = store.put(img_bytes)
+        store.drain()   # перед commit проекта
+    """
+
+    def __init__(self, root='storage/images', extension='png', pipeline=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.pipeline = pipeline
+        self.extension = pipeline.extension if pipeline else extension
+        # Уже записанные на диск хеши в этом процессе - без лишних stat()
+        # (при конвейере не используется - см. put)
+        self._known = set()
+        self.stats = {'written': 0, 'reused': 0, 'bytes_written': 0, 'bytes_saved': 0}
+
+    def filename_for(self, digest):
+        return f"{digest}.{self.extension}"
+
+    def path_for(self, digest):
+        return self.root / self.filename_for(digest)
+
+    def url_for(self, filename):
+        """Итоговый URL (только при конвейере на S3, иначе None)"""
+        return self.pipeline.url_for(filename) if self.pipeline else None
+
+    def local_path(self, filename):
+        """Путь к локальному файлу (None, если изображения сразу уходят на S3)"""
+        return None if self.pipeline else str(self.root / filename)
+
+    def begin_project(self):
+        """Начало проекта: ошибки загрузок прошлого проекта не относятся к этому"""
+        if self.pipeline:
+            self.pipeline.reset()
+
+    def drain(self):
+        """Дожидается загрузки всех изображений на S3 (перед commit проекта)"""
+        if self.pipeline:
+            self.pipeline.drain()
+
+    def close(self):
+        """Останавливает пулы конвейера (при завершении процесса)"""
+        if self.pipeline:
+            self.pipeline.close()
+
+    def put(self, data):
+        """Сохраняет blob (если его еще нет) и возвращает (digest, filename)"""
+        digest = image_digest(data)
+        filename = self.filename_for(digest)
+
+        if self.pipeline:
+            # Загруженные хеши помнит конвейер, и только после успешной загрузки:
+            # изображение, которое не загрузилось, следующий проект отправит заново
+            if self.pipeline.submit(digest, filename, data):
+                self.stats['written'] += 1
+            else:
+                self.stats['reused'] += 1
+                self.stats['bytes_saved'] += len(data)
+            return digest, filename
+
+        if digest in self._known or (self.root / filename).exists():
+            self._known.add(digest)
+            self.stats['reused'] += 1
+            self.stats['bytes_saved'] += len(data)
+            return digest, filename
+
+        # Атомарная запись: параллельные воркеры не увидят недописанный файл
+        path = self.root / filename
+        tmp_path = path.with_name(f".{filename}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self._known.add(digest)
+        self.stats['written'] += 1
+        self.stats['bytes_written'] += len(data)
+        return digest, filename
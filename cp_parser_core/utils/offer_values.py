@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Нормализация тиража и цен офферов в числа
+
+price_offers.quantity / price_usd / price_rub исторически TEXT ('20 700,00 ₽',
+'1 000', '12.50'), поэтому фильтры /products делали CAST на лету, а веб-интерфейс
+разбирал строку в Python на каждую показанную строку.
+
+Теперь при записи парсеры дополнительно заполняют числовые колонки
+(database/add_price_offer_numeric_columns.py):
+    quantity_num INTEGER, price_usd_num NUMERIC(14,2), price_rub_num NUMERIC(14,2)
+
+Правила разбора совпадают с SQL-функцией parse_price_text() из той же миграции
+(ей досчитываются старые записи).
+"""
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+
+# NUMERIC(14,2): все, что больше, считаем мусором в ячейке
+MAX_ABS_VALUE = Decimal('1e12')
+# quantity_num INTEGER
+MAX_QUANTITY = 2147483647
+
+_NOT_NUMBER_CHARS = re.compile(r'[^0-9,.\-]')
+
+# Колонка с текстом → числовая колонка
+NUMERIC_COLUMNS = {
+    'quantity': 'quantity_num',
+    'price_usd': 'price_usd_num',
+    'price_rub': 'price_rub_num',
+}
+
+
+def parse_number(value):
+    """'20 700,00 ₽' → Decimal('20700.00'); None, если числа нет"""
+    if value is None or isinstance(value, bool):
+        return None
+
+    if isinstance(value, (int, float, Decimal)):
+        number = Decimal(str(value))
+    else:
+        text = str(value).strip()
+        if not text:
+            return None
+        try:
+            # Обычная запись числа (в т.ч. '1e+06' из float)
+            number = Decimal(text)
+        except InvalidOperation:
+            cleaned = _NOT_NUMBER_CHARS.sub('', text).replace(',', '.')
+            try:
+                number = Decimal(cleaned)
+            except InvalidOperation:
+                return None
+
+    if not number.is_finite() or abs(number) >= MAX_ABS_VALUE:
+        return None
+
+    return number.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def parse_quantity(value):
+    """Тираж целым числом"""
+    number = parse_number(value)
+    if number is None or abs(number) >= MAX_QUANTITY:
+        return None
+    return int(number.to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def with_numeric_columns(offer):
+    """Оффер + quantity_num / price_usd_num / price_rub_num"""
+    return dict(
+        offer,
+        quantity_num=parse_quantity(offer.get('quantity')),
+        price_usd_num=parse_number(offer.get('price_usd')),
+        price_rub_num=parse_number(offer.get('price_rub')),
+    )
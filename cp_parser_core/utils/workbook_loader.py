@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Однопроходная загрузка xlsx для парсеров шаблонов
+
+Раньше каждый парсер открывал файл ДВАЖДЫ:
+- load_workbook(data_only=True)  → значения ячеек
+- load_workbook(data_only=False) → изображения (ws._images)
+
+Теперь файл открывается один раз:
+- Значения читаются потоково (read_only=True, data_only=True)
+- Якоря изображений и медиа берутся напрямую из zip (xl/drawings/*, xl/media/*)
+  без декодирования картинок через PIL
+"""
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+
+# Пространства имен OOXML
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+NS_XDR = 'http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing'
+NS_A = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+
+REL_TYPE_DRAWING = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/drawing'
+
+
+class CellValue:
+    """Минимальная замена openpyxl Cell (парсерам нужен только .value)"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class SheetImage:
+    """
+    Изображение, привязанное к ячейке
+
+    row, col - 1-based координаты левого верхнего угла якоря (как anchor._from + 1)
+    ref      - путь к медиафайлу внутри xlsx (xl/media/imageN.png)
+    """
+
+    __slots__ = ('row', 'col', 'ref', '_archive')
+
+    def __init__(self, row, col, ref, archive):
+        self.row = row
+        self.col = col
+        self.ref = ref
+        self._archive = archive
+
+    def data(self):
+        """Читает байты изображения из архива (лениво, только по запросу)"""
+        return self._archive.read(self.ref)
+
+
+class LoadedSheet:
+    """
+    Лист, загруженный за один проход
+
+    Совместим с тем, как парсеры используют openpyxl Worksheet:
+    - ws.cell(row, col).value
+    - ws[row] → кортеж ячеек с .value
+    - ws.max_row / ws.max_column
+    Плюс ws.images - список SheetImage и индекс якорей:
+    - ws.max_image_row       → последняя строка с якорем изображения (0 - нет);
+      max_row считается только по значениям, картинки ниже последней
+      заполненной строки в него не входят
+    - ws.images_at(row, col) → изображения ячейки за O(1)
+    - ws.images_in_row(row)  → изображения строки за O(1)
+    """
+
+    def __init__(self, title, rows, images):
+        self.title = title
+        self._rows = rows
+        self.images = images
+        self.max_row = len(rows)
+        self.max_column = max((len(r) for r in rows), default=0)
+        self.max_image_row = max((image.row for image in images), default=0)
+        self._cell_index = None
+        self._row_index = None
+
+    def _build_anchor_index(self):
+        """Строит индексы (row, col) → [SheetImage] и row → [SheetImage] один раз на лист"""
+        cell_index = {}
+        row_index = {}
+        # Порядок изображений внутри ячейки сохраняется (как в drawing xml)
+        for image in self.images:
+            cell_index.setdefault((image.row, image.col), []).append(image)
+            row_index.setdefault(image.row, []).append(image)
+        self._cell_index = cell_index
+        self._row_index = row_index
+
+    def images_at(self, row, col):
+        """Все изображения, якорь которых в ячейке (row, col)"""
+        if self._cell_index is None:
+            self._build_anchor_index()
+        return self._cell_index.get((row, col), [])
+
+    def images_in_row(self, row):
+        """Все изображения, якорь которых в строке row"""
+        if self._row_index is None:
+            self._build_anchor_index()
+        return self._row_index.get(row, [])
+
+    def cell(self, row, column):
+        """Значение ячейки (1-based), None для пустых"""
+        if row < 1 or column < 1 or row > self.max_row:
+            return CellValue(None)
+        values = self._rows[row - 1]
+        if column > len(values):
+            return CellValue(None)
+        return CellValue(values[column - 1])
+
+    def __getitem__(self, row):
+        if row < 1 or row > self.max_row:
+            return ()
+        return tuple(CellValue(v) for v in self._rows[row - 1])
+
+
+class LoadedWorkbook:
+    """Результат однопроходной загрузки: значения + изображения всех листов"""
+
+    def __init__(self, file_path):
+        self.file_path = str(file_path)
+        self._archive = zipfile.ZipFile(self.file_path)
+        self._wb = load_workbook(self.file_path, read_only=True, data_only=True)
+        self._sheet_parts = _read_sheet_parts(self._archive)
+        self._sheets = {}
+        self.sheetnames = list(self._wb.sheetnames)
+
+    @property
+    def active(self):
+        """Активный лист (как wb.active в openpyxl)"""
+        return self[_read_active_sheet_name(self._archive, self.sheetnames)]
+
+    def __getitem__(self, name):
+        if name not in self._sheets:
+            self._sheets[name] = self._load_sheet(name)
+        return self._sheets[name]
+
+    def _load_sheet(self, name):
+        ws = self._wb[name]
+
+        # Значения читаем потоково, храним только кортежи значений
+        rows = [tuple(r) for r in ws.iter_rows(values_only=True)]
+
+        # Обрезаем хвостовые пустые строки (как max_row у обычного openpyxl)
+        while rows and all(v is None for v in rows[-1]):
+            rows.pop()
+
+        images = []
+        sheet_part = self._sheet_parts.get(name)
+        if sheet_part:
+            images = _read_sheet_images(self._archive, sheet_part)
+
+        return LoadedSheet(name, rows, images)
+
+    def close(self):
+        """Закрывает файл (read_only workbook держит дескриптор открытым)"""
+        try:
+            self._wb.close()
+        finally:
+            self._archive.close()
+
+
+def load_workbook_once(file_path):
+    """Открывает xlsx ОДИН раз: значения (read_only) + изображения из zip"""
+    return LoadedWorkbook(Path(file_path))
+
+
+# ===== Разбор OOXML =====
+
+def _rels_path(part_path):
+    """xl/worksheets/sheet1.xml → xl/worksheets/_rels/sheet1.xml.rels"""
+    folder, name = posixpath.split(part_path)
+    return posixpath.join(folder, '_rels', f'{name}.rels')
+
+
+def _resolve_target(part_path, target):
+    """Относительный Target из .rels → путь внутри архива"""
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(part_path), target))
+
+
+def _read_rels(archive, part_path):
+    """Читает .rels части: {rId: (type, target_path)}"""
+    rels_path = _rels_path(part_path)
+    if rels_path not in archive.namelist():
+        return {}
+
+    root = ET.fromstring(archive.read(rels_path))
+    rels = {}
+    for rel in root.findall(f'{{{NS_PKG_REL}}}Relationship'):
+        if rel.get('TargetMode') == 'External':
+            continue
+        rels[rel.get('Id')] = (rel.get('Type'), _resolve_target(part_path, rel.get('Target')))
+    return rels
+
+
+def _read_sheet_parts(archive):
+    """Имя листа → путь к xml листа внутри архива"""
+    workbook_part = 'xl/workbook.xml'
+    root = ET.fromstring(archive.read(workbook_part))
+    rels = _read_rels(archive, workbook_part)
+
+    parts = {}
+    sheets = root.find(f'{{{NS_MAIN}}}sheets')
+    if sheets is None:
+        return parts
+
+    for sheet in sheets.findall(f'{{{NS_MAIN}}}sheet'):
+        rel = rels.get(sheet.get(f'{{{NS_REL}}}id'))
+        if rel:
+            parts[sheet.get('name')] = rel[1]
+    return parts
+
+
+def _read_active_sheet_name(archive, sheetnames):
+    """Имя активного листа из bookViews (activeTab), по умолчанию первый"""
+    root = ET.fromstring(archive.read('xl/workbook.xml'))
+    view = root.find(f'{{{NS_MAIN}}}bookViews/{{{NS_MAIN}}}workbookView')
+
+    active_tab = 0
+    if view is not None:
+        try:
+            active_tab = int(view.get('activeTab', 0))
+        except ValueError:
+            active_tab = 0
+
+    if 0 <= active_tab < len(sheetnames):
+        return sheetnames[active_tab]
+    return sheetnames[0]
+
+
+def _read_sheet_images(archive, sheet_part):
+    """Достает якоря изображений листа из drawing xml (без PIL)"""
+    images = []
+
+    for rel_type, drawing_part in _read_rels(archive, sheet_part).values():
+        if rel_type != REL_TYPE_DRAWING:
+            continue
+
+        drawing_rels = _read_rels(archive, drawing_part)
+        root = ET.fromstring(archive.read(drawing_part))
+
+        for anchor in root:
+            anchor_from = anchor.find(f'{{{NS_XDR}}}from')
+            if anchor_from is None:
+                # absoluteAnchor - не привязан к ячейке
+                continue
+
+            row = int(anchor_from.findtext(f'{{{NS_XDR}}}row', '0')) + 1
+            col = int(anchor_from.findtext(f'{{{NS_XDR}}}col', '0')) + 1
+
+            # Картинки могут быть вложены в группы (grpSp)
+            for pic in anchor.iter(f'{{{NS_XDR}}}pic'):
+                blip = pic.find(f'.//{{{NS_A}}}blip')
+                if blip is None:
+                    continue
+                rel = drawing_rels.get(blip.get(f'{{{NS_REL}}}embed'))
+                if rel and rel[1] in archive.NameToInfo:
+                    images.append(SheetImage(row, col, rel[1], archive))
+
+    return images